@@ -0,0 +1,82 @@
+import csv
+import io
+import os
+import sys
+
+# run headless: tracking selects Qt5Agg for the GUI, tests only use Agg canvases
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import matplotlib
+matplotlib.use('Agg')
+
+# legacy plotting scripts (not tests)
+collect_ignore = ['test_plot.py', 'test_png.py']
+
+SAMPLEDATA = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'sampledata',
+                          'trackfile.csv')
+
+
+def write_trackfile(filename, rows):
+    '''Write rows of (track, frame, x, y, intensity) as a trackfile with headers (as sampledata)
+    '''
+    with open(filename, 'w', newline='') as fo:
+        fo.write('TRACK NUMBER,frame number,x,y,,intensity\n')
+        for (track, frame, x, y, intensity) in rows:
+            fo.write('%d,%d,%r,%r,,%r\n' % (track, frame, x, y, intensity))
+    return filename
+
+
+def reference_output(rows, numdecimal=1, minpoints=0, minlength=0.00, maxlength=100.00):
+    '''Output of the original per-row loader and write_output for rows of (track, frame, x, y, intensity)
+       with the rows of each track contiguous and in frame order - Returns CSV text
+    '''
+    import numpy as np
+    from tracktable import Coord
+    fieldnames = ['Track', 'Frame', 'x', 'y', 'roundx', 'roundy',
+                  'dx', 'dy', 'rho', 'theta', 'intensity', 'framecount']
+    tracklist = dict()
+    cache = None
+    for (track, frame, x, y, intensity) in rows:
+        coord = Coord(track, frame, x, y, intensity)
+        if cache is None or cache.track != coord.track:
+            tracklist[track] = []
+        else:
+            cache.dx = coord.x - cache.x
+            cache.dy = coord.y - cache.y
+            tracklist[track].append(cache)
+        cache = coord
+    coordlist = dict()
+    for track in tracklist:
+        tracks = sorted(tracklist[track], key=lambda t: t.frame)
+        if len(tracks) == 0:
+            continue
+        (first, last) = (tracks[0], tracks[-1])
+        tracklength = np.sqrt((last.x - first.x) ** 2 + (last.y - first.y) ** 2)
+        if (len(tracks) >= minpoints and tracklength >= minlength and tracklength <= maxlength):
+            for co in tracks:
+                key = (round(co.x, numdecimal), round(co.y, numdecimal))
+                if key in coordlist:
+                    co.framecount += 1
+                else:
+                    coordlist[key] = []
+                co.load(co.dx, co.dy, co.getpolar_rho(co.dx, co.dy), co.getpolar_theta(co.dx, co.dy),
+                        co.framecount)
+                coordlist[key].append(co)
+    out = io.StringIO(newline='')
+    writer = csv.DictWriter(out, delimiter=',', dialect=csv.excel, fieldnames=fieldnames)
+    writer.writeheader()
+    for coords in coordlist.values():
+        if len(coords) > 1:
+            num = len(coords)
+            co1 = coords[0]
+            myco = Coord(co1.track, sum([c.frame for c in coords]) / num, co1.x, co1.y,
+                         sum([c.intensity for c in coords]) / num)
+            myco.dx = sum([c.dx for c in coords]) / num
+            myco.dy = sum([c.dy for c in coords]) / num
+            myco.load(myco.dx, myco.dy, myco.getpolar_rho(myco.dx, myco.dy),
+                      myco.getpolar_theta(myco.dx, myco.dy), num)
+        else:
+            myco = coords[0]
+        writer.writerow(myco.get_rowoutput(numdecimal))
+    return out.getvalue()
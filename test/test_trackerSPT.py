@@ -0,0 +1,78 @@
+import os
+import numpy as np
+import scipy.io
+from conftest import SAMPLEDATA
+from tracking import Tracker
+from trackerplots.trackerSPT import TrackerSPT, MAT5_CELL_OVERHEAD
+
+
+def load_spt():
+    tracker = Tracker()
+    tracker.load_input(SAMPLEDATA, minpoints=5)
+    spt = TrackerSPT()
+    spt.load_data(tracker)
+    return spt, tracker.plotter
+
+
+def track_arrays(plotter):
+    '''Original per-track (n, 3) arrays of x, y, frame in plotter order
+    '''
+    arrays = []
+    for tracknum in plotter:
+        rows = plotter.track(tracknum)
+        arrays.append(np.column_stack((rows['x'], rows['y'], rows['frame'])).astype(np.float64))
+    return arrays
+
+
+def test_load_data_per_track():
+    (spt, plotter) = load_spt()
+    expected = track_arrays(plotter)
+    assert spt.numTraj == len(plotter) == len(expected)
+    assert spt.trajLengths.tolist() == [len(t) for t in expected]
+    for (traj, track) in zip(spt.finalTraj, expected):
+        assert traj.flags['C_CONTIGUOUS']
+        assert np.array_equal(traj, track)
+
+
+def test_save_mat_chunks(tmp_path):
+    (spt, plotter) = load_spt()
+    expected = track_arrays(plotter)
+    sizes = [len(t) * 3 * 8 + MAT5_CELL_OVERHEAD for t in expected]
+    spt.maxbytes = sum(sizes) // 3
+    for compression in [True, False]:
+        outdir = tmp_path / str(compression)
+        outdir.mkdir()
+        filenames = spt.save_mat(str(outdir / 'testrun.mat'), do_compression=compression)
+        assert len(filenames) >= 3
+        assert [os.path.basename(f) for f in filenames] == ['testrun_%03d.mat' % (i + 1)
+                                                           for i in range(len(filenames))]
+        cells = []
+        start = 0
+        for (fname, (chunkstart, chunkend)) in zip(filenames, spt.split_chunks()):
+            mat = scipy.io.loadmat(fname, squeeze_me=False)
+            # chunks are consecutive, within maxbytes and each a complete vbSPT input
+            assert chunkstart == start
+            assert sum(sizes[chunkstart:chunkend]) <= spt.maxbytes
+            assert mat['numTraj'].item() == chunkend - chunkstart
+            assert mat['trajLengths'].ravel().tolist() == [len(t) for t in expected[chunkstart:chunkend]]
+            assert mat['longestTraj'].item() == max([len(t) for t in expected[chunkstart:chunkend]])
+            cells += [cell for cell in mat['finalTraj'].ravel()]
+            start = chunkend
+        assert start == len(expected)
+        assert len(cells) == len(expected)
+        for (cell, track) in zip(cells, expected):
+            assert cell.shape == track.shape
+            assert np.array_equal(cell, track)
+    # single file when within the limit
+    spt.maxbytes = sum(sizes)
+    assert spt.save_mat(str(tmp_path / 'single.mat')) == [str(tmp_path / 'single.mat')]
+    mat = scipy.io.loadmat(str(tmp_path / 'single.mat'))
+    assert mat['numTraj'].item() == len(expected)
+
+
+def test_split_chunks_large_trajectory():
+    spt = TrackerSPT()
+    spt.trajLengths = np.array([10, 1000, 10, 10])
+    spt.maxbytes = 2 * (10 * 24 + MAT5_CELL_OVERHEAD)
+    # a trajectory over the limit is written on its own
+    assert spt.split_chunks() == [(0, 1), (1, 2), (2, 4)]
@@ -0,0 +1,41 @@
+import os
+import numpy as np
+from conftest import SAMPLEDATA, write_trackfile
+from trackercache import ParseCache
+from tracking import Tracker
+
+
+def columns(n):
+    return {'track': np.arange(n, dtype=np.int64), 'x': np.linspace(0, 1, n)}
+
+
+def test_cache_hit(tmp_path):
+    cache = ParseCache(str(tmp_path / 'cache'))
+    tracker = Tracker()
+    tracker.parsecache = cache
+    cols = tracker.read_columns(SAMPLEDATA)
+    assert os.path.isfile(cache.get_filename(SAMPLEDATA))
+    cached = cache.load(SAMPLEDATA)
+    assert isinstance(cached['x'], np.memmap)
+    for name in cols:
+        assert np.array_equal(cached[name], cols[name])
+    # input changed: new key
+    inputfile = write_trackfile(str(tmp_path / 'in.csv'), [(1, 1, 1.0, 2.0, 3.0), (1, 2, 1.5, 2.5, 3.0)])
+    assert cache.load(inputfile) is None
+
+
+def test_cache_eviction(tmp_path):
+    # 16 bytes per row: each entry about 16KB
+    cache = ParseCache(str(tmp_path / 'cache'), maxsize=40 / 1024)
+    names = []
+    for i in range(3):
+        inputfile = write_trackfile(str(tmp_path / ('in%d.csv' % i)), [(i + 1, 1, 1.0, 2.0, 3.0)])
+        names.append(cache.save(inputfile, columns(1000)))
+        os.utime(names[-1], (1000 + i, 1000 + i))
+    # least recently used entry removed, entry just written always kept
+    assert not os.path.isfile(names[0])
+    assert os.path.isfile(names[1])
+    assert os.path.isfile(names[2])
+    # larger than the whole cache: not saved and nothing evicted
+    assert cache.save(inputfile, columns(10000)) is None
+    assert os.path.isfile(names[2])
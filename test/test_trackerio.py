@@ -0,0 +1,70 @@
+import bz2
+import gzip
+import lzma
+import numpy as np
+import pytest
+from conftest import SAMPLEDATA
+from trackerio import save_binary, load_binary, h5py, is_compressed, strip_compression
+from tracking import Tracker
+
+EXTENSIONS = ['.npz', pytest.param('.h5', marks=pytest.mark.skipif(h5py is None, reason="h5py not installed"))]
+
+
+@pytest.mark.parametrize('ext', EXTENSIONS)
+def test_binary_roundtrip(tmp_path, ext):
+    arrays = {'x': np.linspace(0, 1, 7), 'track': np.arange(7, dtype=np.int64),
+              'msd': np.arange(12.0).reshape(3, 4), 'empty': np.zeros(0)}
+    params = {'numdecimal': 2, 'fieldnames': ['Track', 'Frame']}
+    outfile = save_binary(str(tmp_path / ('data' + ext)), arrays, params)
+    (loaded, loadedparams) = load_binary(outfile)
+    assert loadedparams == params
+    assert sorted(loaded) == sorted(arrays)
+    for name in arrays:
+        assert loaded[name].dtype == arrays[name].dtype
+        assert np.array_equal(loaded[name], arrays[name])
+    # members are memory-mapped, not read into memory
+    assert isinstance(loaded['x'], np.memmap)
+    assert isinstance(loaded['msd'], np.memmap)
+
+
+@pytest.mark.parametrize('ext', EXTENSIONS)
+def test_tracker_binary_roundtrip(tmp_path, ext):
+    tracker = Tracker()
+    tracker.numdecimal = 2
+    tracker.load_input(SAMPLEDATA, minpoints=5)
+    outfile = str(tmp_path / ('processed' + ext))
+    assert tracker.save_binary(outfile) == "Binary output written to " + outfile
+    loaded = Tracker()
+    loaded.load_plotdata(outfile)
+    assert loaded.numdecimal == 2
+    assert list(loaded.plotter) == list(tracker.avgplotter)
+    for (name, dtype) in loaded.plotter.columns:
+        assert np.array_equal(loaded.plotter.column(name), tracker.avgplotter.column(name))
+    assert list(loaded.msd) == list(tracker.msd)
+    assert np.array_equal(loaded.msd.msd, tracker.msd.msd, equal_nan=True)
+    assert np.array_equal(loaded.msd.npairs, tracker.msd.npairs)
+
+
+@pytest.mark.parametrize('ext, openfunc', [('.gz', gzip.open), ('.bz2', bz2.open), ('.xz', lzma.open)])
+def test_compressed_input(tmp_path, ext, openfunc):
+    with open(SAMPLEDATA, 'rb') as fi:
+        data = fi.read()
+    inputfile = str(tmp_path / ('trackfile.csv' + ext))
+    with openfunc(inputfile, 'wb') as fo:
+        fo.write(data)
+    assert is_compressed(inputfile)
+    assert strip_compression(inputfile) == str(tmp_path / 'trackfile.csv')
+    plain = Tracker()
+    plain.load_input(SAMPLEDATA)
+    tracker = Tracker()
+    assert tracker.checkinputheaders(inputfile) == 1
+    tracker.load_input(inputfile)
+    assert tracker.ln == plain.ln
+    for (name, dtype) in tracker.table.columns:
+        assert np.array_equal(tracker.table.column(name), plain.table.column(name))
+    outputs = []
+    for (t, name) in [(plain, 'plain_out.csv'), (tracker, 'compressed_out.csv')]:
+        assert t.write_output(str(tmp_path / name)) == "Completed"
+        with open(str(tmp_path / name), 'rb') as fi:
+            outputs.append(fi.read())
+    assert outputs[0] == outputs[1]
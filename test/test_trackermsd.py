@@ -0,0 +1,224 @@
+import numpy as np
+from scipy import stats
+import trackermsd
+from trackermsd import MSDTable, msd_fft, msd_gaps, index_pairs, msd_batch, fit_lines, fit_msd, \
+    bootstrap_msd, msd_stats
+
+
+def reference_msd(x, y):
+    '''MSD by the original double loop: intervals 1..n-2, mean over all pairs of points i apart
+    '''
+    n = len(x)
+    msd = []
+    for i in range(1, n - 1):
+        sd = 0
+        for j in range(0, n - i):
+            sd += (x[j + i] - x[j]) ** 2 + (y[j + i] - y[j]) ** 2
+        msd.append(sd / (n - i))
+    return np.array(msd)
+
+
+def track_results(lengths):
+    rng = np.random.default_rng(1)
+    results = []
+    for n in lengths:
+        (x, y) = (rng.random(n), rng.random(n))
+        msd = msd_fft(x, y)
+        results.append((msd, index_pairs(n, len(msd))))
+    return results
+
+
+def test_msdtable_views():
+    results = track_results([5, 12, 2, 8])
+    table = MSDTable.from_results([3, 1, 7, 4], results)
+    assert list(table) == [3, 1, 7, 4]
+    assert table.msd.shape == (4, 10)
+    assert table[1] == dict(zip(range(1, 11), results[1][0].tolist()))
+    assert table[7] == {}
+    assert table.pairs(3) == {1: 4, 2: 3, 3: 2}
+    (tracknums, msd, npairs) = table.matrix(12)
+    assert msd.shape == (4, 12)
+    assert np.isnan(msd[0, 3:]).all()
+    assert npairs[1, :10].tolist() == list(range(11, 1, -1))
+
+
+def test_msdtable_update_keeps_order():
+    results = track_results([6, 4, 9])
+    table = MSDTable()
+    for (tracknum, (msd, npairs)) in zip([5, 2, 9], results):
+        table.set_track(tracknum, msd, npairs)
+    assert list(table) == [5, 2, 9]
+    (msd, npairs) = track_results([20])[0]
+    table.set_track(2, msd, npairs)
+    assert list(table) == [5, 2, 9]
+    assert table.width == 18
+    assert table[2] == dict(zip(range(1, 19), msd.tolist()))
+    assert table[5] == dict(zip(range(1, 5), results[0][0].tolist()))
+    remaining = table.exclude([5])
+    assert list(remaining) == [2, 9]
+    assert remaining[9] == table[9]
+
+
+def test_msd_fft_matches_loop():
+    rng = np.random.default_rng(2)
+    for n in [0, 1, 2, 3, 4, 7, 16, 33, 100, 257]:
+        # random walk far from the origin
+        x = np.cumsum(rng.normal(size=n)) + 500
+        y = np.cumsum(rng.normal(size=n)) - 200
+        expected = reference_msd(x, y)
+        msd = msd_fft(x, y)
+        assert msd.shape == expected.shape
+        assert np.allclose(msd, expected, rtol=1e-9, atol=1e-9)
+        for maxlag in [1, 5]:
+            assert np.allclose(msd_fft(x, y, maxlag), expected[:maxlag], rtol=1e-9, atol=1e-9)
+        assert index_pairs(n, len(msd)).tolist() == [n - i for i in range(1, len(msd) + 1)]
+    # stationary track: no negative rounding
+    msd = msd_fft(np.full(20, 3.3), np.full(20, 1e4))
+    assert (msd >= 0).all() and np.allclose(msd, 0)
+
+
+def random_tracks(lengths, seed=4):
+    rng = np.random.default_rng(seed)
+    offsets = np.concatenate(([0], np.cumsum(lengths))).astype(np.int64)
+    x = rng.random(offsets[-1]) * 100
+    y = rng.random(offsets[-1]) * 100
+    # frames with gaps (and some repeated) within each track
+    steps = rng.choice([0, 1, 1, 1, 2, 5], size=offsets[-1])
+    frame = np.concatenate([np.cumsum(steps[s:e]) + 1 for (s, e) in zip(offsets[:-1], offsets[1:])])
+    return x, y, offsets, frame.astype(np.int64)
+
+
+def test_msd_batch_workers_match_serial(monkeypatch):
+    lengths = [1, 2, 30, 5, 200, 3, 64, 17, 90, 8, 41, 120]
+    (x, y, offsets, frame) = random_tracks(lengths)
+    monkeypatch.setattr(trackermsd, 'MIN_PARALLEL_POINTS', 0)
+    tracknums = list(range(101, 101 + len(lengths)))
+    for gapframe in [None, frame]:
+        serial = MSDTable.from_results(tracknums, msd_batch(x, y, offsets, 10, workers=1, frame=gapframe))
+        shards = []
+        results = msd_batch(x, y, offsets, 10, workers=2, frame=gapframe,
+                            callback=lambda start, msds: shards.append((start, len(msds))))
+        # more than one shard, together covering every track once
+        assert len(shards) > 1
+        assert sorted([t for (start, n) in shards for t in range(start, start + n)]) == list(range(len(lengths)))
+        parallel = MSDTable.from_results(tracknums, results)
+        assert list(parallel) == list(serial)
+        assert np.array_equal(parallel.msd, serial.msd, equal_nan=True)
+        assert np.array_equal(parallel.npairs, serial.npairs)
+
+
+def reference_gaps(frame, x, y, maxlag=0):
+    '''Gap-aware MSD from every pair of points binned by frame difference 1..numlags
+    '''
+    numlags = int(frame[-1] - frame[0]) if len(frame) > 1 else 0
+    if maxlag > 0:
+        numlags = min(maxlag, numlags)
+    sums = np.zeros(max(numlags, 0))
+    npairs = np.zeros(max(numlags, 0), dtype=np.int64)
+    for i in range(len(frame)):
+        for j in range(i + 1, len(frame)):
+            fd = frame[j] - frame[i]
+            if 1 <= fd <= numlags:
+                sums[fd - 1] += (x[j] - x[i]) ** 2 + (y[j] - y[i]) ** 2
+                npairs[fd - 1] += 1
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return sums / npairs, npairs
+
+
+def test_msd_gaps_matches_pairs():
+    rng = np.random.default_rng(6)
+    tracks = [[1], [1, 2], [3, 3], [1, 2, 3, 4, 5], [1, 2, 5, 6, 10], [2, 2, 3, 7, 7, 8, 20],
+              np.cumsum(rng.choice([0, 1, 1, 3], size=60)) + 1]
+    for frames in tracks:
+        frame = np.asarray(frames, dtype=np.int64)
+        x = rng.random(len(frame)) * 10
+        y = rng.random(len(frame)) * 10
+        for maxlag in [0, 1, 3, 10]:
+            (msd, npairs) = msd_gaps(frame, x, y, maxlag)
+            (expected, expectedpairs) = reference_gaps(frame, x, y, maxlag)
+            assert npairs.tolist() == expectedpairs.tolist()
+            assert np.allclose(msd, expected, equal_nan=True)
+            # intervals without pairs (missing frames) are NaN
+            assert np.array_equal(np.isnan(msd), npairs == 0)
+    # missing frames: no pairs 2, 6 or 7 frames apart
+    (msd, npairs) = msd_gaps([1, 2, 5, 6, 10], np.arange(5.0), np.zeros(5))
+    assert npairs.tolist() == [2, 0, 1, 3, 2, 0, 0, 1, 1]
+    assert np.isnan(msd[[1, 5, 6]]).all()
+    assert msd[0] == 1.0
+    # repeated frames are not an interval and do not count as pairs
+    (msd, npairs) = msd_gaps([4, 4, 4], [0.0, 1.0, 2.0], [0.0, 0.0, 0.0])
+    assert len(msd) == 0 and len(npairs) == 0
+    assert msd_gaps([1, 3, 3, 4], np.arange(4.0), np.zeros(4), maxlag=2)[1].tolist() == [2, 2]
+
+
+def test_fits_match_linregress():
+    rng = np.random.default_rng(8)
+    dt = np.arange(1, 11) * 0.5
+    # MSD of 20 tracks (columns) with noise and missing intervals at the end of short tracks
+    matrix = 4 * rng.random(20) * dt[:, np.newaxis] ** rng.uniform(0.5, 1.5, 20) + rng.random((10, 20)) * 0.1
+    for (col, n) in enumerate(rng.integers(2, 11, 20)):
+        matrix[n:, col] = np.nan
+    (slope, icpt, r2, n) = fit_lines(dt, matrix)
+    fits = fit_msd(dt, matrix)
+    for col in range(matrix.shape[1]):
+        valid = ~np.isnan(matrix[:, col])
+        assert n[col] == valid.sum()
+        expected = stats.linregress(dt[valid], matrix[valid, col])
+        assert np.isclose(slope[col], expected.slope)
+        assert np.isclose(icpt[col], expected.intercept)
+        if n[col] > 2:
+            assert np.isclose(r2[col], expected.rvalue ** 2)
+        assert np.isclose(fits['D'][col], expected.slope / 4)
+        assert np.isclose(fits['offset'][col], expected.intercept)
+        logfit = stats.linregress(np.log(dt[valid]), np.log(matrix[valid, col]))
+        assert np.isclose(fits['alpha'][col], logfit.slope)
+        assert np.isclose(fits['Dalpha'][col], np.exp(logfit.intercept) / 4)
+    # through the origin: slope = sum(xy) / sum(xx)
+    (slope, icpt, r2, n) = fit_lines(dt, matrix, intercept=False)
+    valid = ~np.isnan(matrix[:, 0])
+    assert np.isclose(slope[0], (dt[valid] * matrix[valid, 0]).sum() / (dt[valid] ** 2).sum())
+    assert (icpt == 0).all()
+
+
+def test_fits_degenerate_tracks():
+    dt = np.arange(1, 6, dtype=np.float64)
+    matrix = np.full((5, 4), np.nan)
+    matrix[0, 1] = 2.0  # single lag
+    matrix[:, 2] = [1.0, 2.0, 3.0, 4.0, 5.0]
+    matrix[:2, 3] = [0.0, 2.0]  # two lags, one not positive for the log-log fit
+    fits = fit_msd(dt, matrix)
+    assert fits['nlags'].tolist() == [0, 1, 5, 2]
+    for name in ['D', 'offset', 'r2', 'alpha', 'Dalpha']:
+        assert np.isnan(fits[name][:2]).all()
+    assert np.isclose(fits['D'][2], 0.25) and np.isclose(fits['offset'][2], 0)
+    assert np.isclose(fits['alpha'][2], 1) and np.isclose(fits['r2'][2], 1)
+    assert np.isclose(fits['D'][3], 0.5)
+    assert np.isnan(fits['alpha'][3])
+
+
+def test_bootstrap_intervals():
+    rng = np.random.default_rng(9)
+    dt = np.arange(1, 9, dtype=np.float64)
+    matrix = 4 * rng.random(50) * dt[:, np.newaxis] + rng.random((8, 50))
+    matrix[5:, :10] = np.nan
+    boot = bootstrap_msd(dt, matrix, numresamples=600, ci=90, seed=11)
+    (mean, se, count) = msd_stats(matrix)
+    assert np.array_equal(boot['mean'], mean)
+    assert boot['lower'].shape == boot['upper'].shape == (8,)
+    assert (boot['lower'] <= mean).all() and (mean <= boot['upper']).all()
+    assert (boot['lower'] < boot['upper']).all()
+    assert boot['slope_lower'] <= boot['slope'] <= boot['slope_upper']
+    # reproducible with a seed, and the same split across worker processes
+    again = bootstrap_msd(dt, matrix, numresamples=600, ci=90, seed=11)
+    parallel = bootstrap_msd(dt, matrix, numresamples=600, ci=90, workers=2, seed=11)
+    for name in boot:
+        assert np.array_equal(again[name], boot[name])
+        assert np.array_equal(parallel[name], boot[name])
+    other = bootstrap_msd(dt, matrix, numresamples=600, ci=90, seed=12)
+    assert not np.array_equal(other['lower'], boot['lower'])
+    # wider confidence level: wider intervals
+    wide = bootstrap_msd(dt, matrix, numresamples=600, ci=99, seed=11)
+    assert (wide['lower'] <= boot['lower']).all() and (wide['upper'] >= boot['upper']).all()
+    # no resamples: limits are the mean
+    none = bootstrap_msd(dt, matrix, numresamples=0)
+    assert np.array_equal(none['lower'], mean) and np.array_equal(none['upper'], mean)
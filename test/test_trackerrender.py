@@ -0,0 +1,79 @@
+import os
+import zipfile
+import numpy as np
+import pytest
+from PIL import Image
+from trackerrender import TrackRenderer, PlotArchive, render_batches, track_atlas, save_atlas, atlas_preview, read_atlas_index, atlas_track
+
+
+def test_atlas_saved_grayscale(tmp_path):
+    x = np.array([0.0, 1.0, 2.0, 5.0, 5.0, 6.0, 1.0])
+    y = np.array([0.0, 1.0, 0.5, 5.0, 6.0, 6.0, 1.0])
+    offsets = np.array([0, 3, 6, 7])
+    (image, cols) = track_atlas(x, y, offsets, tilesize=16)
+    outfile = str(tmp_path / 'atlas.png')
+    indexfile = save_atlas(outfile, image, [11, 12, 13], cols, tilesize=16)
+    with Image.open(outfile) as saved:
+        assert saved.mode == 'L'
+        assert np.array_equal(np.asarray(saved), image)
+    atlasindex = read_atlas_index(indexfile)
+    assert atlas_track(atlasindex, 20, 3) == 12
+    assert atlas_track(atlasindex, 3, 20) == 13
+
+
+def test_atlas_preview_keeps_lines():
+    image = np.full((100, 70), 255, dtype=np.uint8)
+    image[51, :] = 0
+    (preview, step) = atlas_preview(image, maxsize=20)
+    assert step == 5
+    assert preview.shape == (20, 14)
+    assert (preview[10] == 0).all()
+    assert (np.delete(preview, 10, axis=0) == 255).all()
+    (same, step) = atlas_preview(image)
+    assert step == 1 and same is image
+
+
+def test_renderer_reuse_matches_new_figure():
+    rng = np.random.default_rng(3)
+    renderer = TrackRenderer(dpi=50)
+    for (tracknum, n) in enumerate([5, 40, 1, 17]):
+        x = rng.random(n) * 10 + rng.random() * 100
+        y = rng.random(n) * 3 + 50
+        (rho, theta) = (rng.random(n), rng.random(n) * 6 - 3)
+        renderer.plot(tracknum, x, y, rho, theta)
+        fresh = TrackRenderer(dpi=50)
+        fresh.plot(tracknum, x, y, rho, theta)
+        assert np.array_equal(renderer.rgba(), fresh.rgba())
+    assert len(renderer.ax.collections) == 1
+
+
+def test_render_serial_callback_per_track(tmp_path):
+    rng = np.random.default_rng(5)
+    batches = [[(t, rng.random(4), rng.random(4), rng.random(4), rng.random(4)) for t in range(b, b + 3)]
+               for b in (1, 4)]
+    calls = []
+    outputdir = str(tmp_path) + os.path.sep
+    results = render_batches(outputdir, batches, workers=1, dpi=20, callback=lambda r: calls.append(r))
+    # once per track and once for the files still being written
+    assert len(calls) >= 6
+    assert sum([len(c) for c in calls]) == 6
+    assert [r[0] for r in results] == list(range(1, 7))
+    assert os.path.isfile(outputdir + 'Track_6.png')
+    # stop after the second track
+    calls = []
+    results = render_batches(outputdir, batches, workers=1, dpi=20,
+                             callback=lambda r: calls.append(r) or len(calls) == 2)
+    assert [r[0] for r in results] == [1, 2]
+
+
+def test_plot_archive_extension(tmp_path):
+    for ext in ('.png', '.csv', ''):
+        with pytest.raises(ValueError):
+            PlotArchive(str(tmp_path / ('plots' + ext)))
+    assert not os.listdir(str(tmp_path))
+    rng = np.random.default_rng(7)
+    archive = PlotArchive(str(tmp_path / 'plots.ZIP'), dpi=20)
+    archive.add(3, rng.random(4), rng.random(4), rng.random(4), rng.random(4))
+    archive.close()
+    with zipfile.ZipFile(str(tmp_path / 'plots.ZIP')) as zf:
+        assert sorted(zf.namelist()) == ['Track_3.png', 'index.csv']
@@ -0,0 +1,194 @@
+import os
+import numpy as np
+from conftest import SAMPLEDATA, write_trackfile, reference_output
+from tracking import Tracker, find_inputfiles, run_batch
+
+
+def read_rows(filename):
+    rows = []
+    with open(filename) as fi:
+        next(fi)
+        for line in fi:
+            parts = line.strip().split(',')
+            rows.append((int(parts[0]), int(parts[1]), float(parts[2]), float(parts[3]), float(parts[5])))
+    return rows
+
+
+def load_output(inputfile, outfile, numdecimal=1):
+    tracker = Tracker()
+    tracker.numdecimal = numdecimal
+    tracker.load_input(inputfile)
+    assert tracker.write_output(outfile) == "Completed"
+    with open(outfile, newline='') as fi:
+        return fi.read()
+
+
+def test_output_ties(tmp_path):
+    # two tracks meeting at x=10.35 and x=10.31 (both round to 10.3): one row with framecount 3
+    rows = [(1, 1, 10.35, 20.0, 100.0), (1, 2, 10.35, 20.0, 100.0), (1, 3, 11.0, 21.0, 100.0),
+            (2, 1, 10.31, 20.0, 50.0), (2, 2, 12.0, 22.0, 50.0)]
+    inputfile = write_trackfile(str(tmp_path / 'ties.csv'), rows)
+    output = load_output(inputfile, str(tmp_path / 'ties_out.csv'))
+    assert output == reference_output(rows)
+    lines = output.splitlines()[1:]
+    assert len(lines) == 1
+    assert lines[0].split(',')[-1] == '3'
+
+
+def test_output_sampledata(tmp_path):
+    rows = read_rows(SAMPLEDATA)
+    for numdecimal in [1, 2]:
+        output = load_output(SAMPLEDATA, str(tmp_path / 'out.csv'), numdecimal)
+        assert output == reference_output(rows, numdecimal)
+
+
+def test_stream_matches_load(tmp_path):
+    # small chunks: tracks are carried over and rounded coords groups merged across chunks
+    for (numdecimal, chunksize) in [(1, 97), (2, 1000)]:
+        loaded = load_output(SAMPLEDATA, str(tmp_path / 'load.csv'), numdecimal)
+        tracker = Tracker()
+        tracker.numdecimal = numdecimal
+        assert tracker.checkinputheaders(SAMPLEDATA)
+        outfile = str(tmp_path / 'stream.csv')
+        assert tracker.stream_input(SAMPLEDATA, outfile, chunksize=chunksize) == "Completed"
+        with open(outfile, newline='') as fi:
+            assert fi.read() == loaded
+
+
+def test_stream_msd_matches_load(tmp_path):
+    loader = Tracker()
+    loader.maxintervals = 10
+    loader.open_msdstream(str(tmp_path / 'load_msd.csv'))
+    loader.load_input(SAMPLEDATA)
+    loader.close_msdstream()
+    streamer = Tracker()
+    streamer.checkinputheaders(SAMPLEDATA)
+    streamer.open_msdstream(str(tmp_path / 'stream_msd.csv'))
+    streamer.stream_input(SAMPLEDATA, str(tmp_path / 'stream.csv'), chunksize=500, maxintervals=10,
+                          keepmsd=False)
+    streamer.close_msdstream()
+    assert len(streamer.msd) == 0
+    assert streamer.numtracks == len(loader.msd)
+    with open(str(tmp_path / 'load_msd.csv')) as fl, open(str(tmp_path / 'stream_msd.csv')) as fs:
+        assert fs.read() == fl.read()
+
+
+def test_batch_relative_glob(tmp_path, monkeypatch):
+    rows = read_rows(SAMPLEDATA)
+    write_trackfile(str(tmp_path / 'a.csv'), rows[:2000])
+    write_trackfile(str(tmp_path / 'b.csv'), rows[2000:4000])
+    monkeypatch.chdir(tmp_path)
+    inputfiles = find_inputfiles('*.csv')
+    assert inputfiles == ['a.csv', 'b.csv']
+    # output to input directory: dirname of a relative file is ''
+    results = run_batch(inputfiles, os.path.dirname(inputfiles[0]), {'maxintervals': 5}, workers=1)
+    assert [r['status'] for r in results] == ['OK', 'OK']
+    with open('a_processed.csv', newline='') as fi:
+        assert fi.read() == reference_output(rows[:2000])
+    # outputs of the first run are not inputs of the next
+    assert find_inputfiles('*.csv') == ['a.csv', 'b.csv']
+    assert find_inputfiles(str(tmp_path)) == [str(tmp_path / 'a.csv'), str(tmp_path / 'b.csv')]
+
+
+def test_batch_binary(tmp_path):
+    inputfile = write_trackfile(str(tmp_path / 'a.csv'), read_rows(SAMPLEDATA)[:2000])
+    outputdir = str(tmp_path / 'out')
+    results = run_batch([inputfile], outputdir, {'maxintervals': 5, 'binary': '.npz'}, workers=1)
+    assert results[0]['status'] == 'OK'
+    assert os.path.isfile(os.path.join(outputdir, 'a_processed.npz'))
+    # processed rows are not kept when streaming
+    results = run_batch([inputfile], outputdir, {'maxintervals': 5, 'binary': '.npz', 'stream': True}, workers=1)
+    assert results[0]['status'] == 'ERROR'
+    assert 'stream' in results[0]['message']
+
+def test_follow_keeps_track_order(tmp_path):
+    # rows in acquisition (frame) order, appended in chunks with a partial last line
+    rows = sorted(read_rows(SAMPLEDATA), key=lambda r: r[1])
+    inputfile = str(tmp_path / 'follow.csv')
+    write_trackfile(inputfile, rows)
+    with open(inputfile, 'rb') as fi:
+        data = fi.read()
+    chunks = [data[start:start + 997] for start in range(0, len(data), 997)]
+
+    def append_chunk(tracker, changed):
+        if len(chunks) > 0:
+            with open(inputfile, 'ab') as fo:
+                fo.write(chunks.pop(0))
+
+    with open(inputfile, 'wb') as fo:
+        fo.write(chunks.pop(0))
+    tracker = Tracker()
+    tracker.follow_input(inputfile, minpoints=5, interval=0.001, idle=0.2, callback=append_chunk)
+    assert len(chunks) == 0
+    loaded = Tracker()
+    loaded.load_input(inputfile, minpoints=5)
+    assert list(tracker.plotter) == list(loaded.plotter)
+    for name in ['track', 'frame', 'x', 'y', 'dx', 'dy', 'rho']:
+        assert np.array_equal(tracker.plotter.column(name), loaded.plotter.column(name))
+    assert sorted(tracker.msd) == sorted(loaded.msd)
+
+
+def test_probe_without_headers(tmp_path):
+    rows = read_rows(SAMPLEDATA)[:500]
+    inputfile = str(tmp_path / 'noheader.csv')
+    with open(inputfile, 'w') as fo:
+        for (track, frame, x, y, intensity) in rows:
+            fo.write('%d,%d,%r,%r,,%r\n' % (track, frame, x, y, intensity))
+    tracker = Tracker()
+    assert tracker.checkinputheaders(inputfile) == 2
+    tracker.load_input(inputfile)
+    reference = Tracker()
+    reference.load_input(write_trackfile(str(tmp_path / 'header.csv'), rows))
+    for (name, dtype) in tracker.table.columns:
+        assert np.array_equal(tracker.table.column(name), reference.table.column(name))
+
+
+def test_probe_maps_columns_by_header(tmp_path):
+    rows = read_rows(SAMPLEDATA)[:500]
+    inputfile = str(tmp_path / 'reordered.csv')
+    with open(inputfile, 'w') as fo:
+        fo.write('intensity;y;x;frame number;TRACK NUMBER\n')
+        for (track, frame, x, y, intensity) in rows:
+            fo.write('%r;%r;%r;%d;%d\n' % (intensity, y, x, frame, track))
+    tracker = Tracker()
+    assert tracker.checkinputheaders(inputfile) == 1
+    assert tracker.probe.delimiter == ';'
+    assert tracker.probe.get_usecols() == [4, 3, 2, 1, 0]
+    tracker.load_input(inputfile)
+    reference = Tracker()
+    reference.load_input(write_trackfile(str(tmp_path / 'header.csv'), rows))
+    for (name, dtype) in tracker.table.columns:
+        assert np.array_equal(tracker.table.column(name), reference.table.column(name))
+
+
+def test_probe_undetected_delimiter(tmp_path):
+    inputfile = str(tmp_path / 'single.csv')
+    with open(inputfile, 'w') as fo:
+        fo.write('1\n2\n3\n')
+    tracker = Tracker()
+    assert tracker.checkinputheaders(inputfile) == 0
+    assert not tracker.probe.hasheader
+
+
+def test_batch_stream_does_not_keep_msd(tmp_path, monkeypatch):
+    inputfile = write_trackfile(str(tmp_path / 'a.csv'), read_rows(SAMPLEDATA)[:2000])
+    trackers = []
+    stream_input = Tracker.stream_input
+
+    def record(tracker, *args):
+        trackers.append(tracker)
+        return stream_input(tracker, *args)
+
+    monkeypatch.setattr(Tracker, 'stream_input', record)
+    outputdir = str(tmp_path / 'out')
+    results = run_batch([inputfile], outputdir, {'maxintervals': 5, 'stream': True}, workers=1)
+    assert results[0]['status'] == 'OK'
+    assert results[0]['tracks'] > 0
+    # long format MSD written while streaming: no table kept and no fits unless requested
+    assert len(trackers[0].msd) == 0
+    assert os.path.isfile(os.path.join(outputdir, 'a_msd.csv'))
+    assert not os.path.isfile(os.path.join(outputdir, 'a_fits.csv'))
+    results = run_batch([inputfile], outputdir, {'maxintervals': 5, 'stream': True, 'fits': True}, workers=1)
+    assert results[0]['status'] == 'OK'
+    assert len(trackers[1].msd) == results[0]['tracks']
+    assert os.path.isfile(os.path.join(outputdir, 'a_fits.csv'))
@@ -0,0 +1,46 @@
+import numpy as np
+from tracktable import TrackTable, grid_keys, round_grid
+
+
+def python_groups(x, y, numdecimal):
+    '''Groups by Python round as the original loader (dict in order of first appearance)'''
+    keys = dict()
+    groups = []
+    for (a, b) in zip(x, y):
+        key = (round(a, numdecimal), round(b, numdecimal))
+        groups.append(keys.setdefault(key, len(keys)))
+    return groups
+
+
+def test_grid_keys_ties():
+    # 10.35 is 10.3499... so round(10.35, 1) == 10.3 whereas np.rint(10.35 * 10) == 104
+    x = np.array([10.35, 10.31, 10.35, 10.25, 10.45, 0.05, -0.05, -10.35])
+    y = np.array([20.0, 20.0, 20.0, 20.0, 20.0, 0.0, 0.0, 20.0])
+    groups, first = grid_keys(x, y, 1)
+    assert groups.tolist() == python_groups(x.tolist(), y.tolist(), 1)
+    assert groups[0] == groups[1]
+
+
+def test_grid_keys_matches_round():
+    rng = np.random.default_rng(1)
+    for numdecimal in [-1, 0, 1, 2, 3]:
+        # values on and next to half units at this number of decimals
+        halves = (rng.integers(-5000, 5000, 2000) + 0.5) / 10.0 ** numdecimal
+        x = np.concatenate((halves, np.nextafter(halves, np.inf), np.nextafter(halves, -np.inf),
+                            rng.uniform(-100, 100, 2000)))
+        y = rng.permutation(x)
+        groups, first = grid_keys(x, y, numdecimal)
+        assert groups.tolist() == python_groups(x.tolist(), y.tolist(), numdecimal)
+        expected = np.array([round(v, numdecimal) for v in x.tolist()])
+        if numdecimal >= 0:
+            assert np.array_equal(round_grid(x, numdecimal), np.rint(expected * 10.0 ** numdecimal))
+
+
+def test_group_and_select():
+    table = TrackTable.group({'track': np.array([3, 1, 3, 1]), 'frame': np.array([1, 1, 2, 2]),
+                              'x': np.array([1.0, 2.0, 3.0, 4.0]), 'y': np.zeros(4)})
+    assert list(table) == [3, 1]
+    assert table.column('x', 3).tolist() == [1.0, 3.0]
+    assert table.get_tracknum(1) == 1
+    assert table.get_position(1) == 1
+    assert list(table.exclude([3])) == [1]
@@ -27,6 +27,7 @@ __date__ = "$15/06/2015 11:03:33 AM$"
 __version__ = 1.0
 
 import os
+import multiprocessing
 from os.path import expanduser
 
 homedir = expanduser("~")
@@ -37,6 +38,8 @@ from trackerplots.trackerSPT import TrackerSPT
 from trackerplots.trackerplot import TrackerPlot
 from trackerplots.contourplot import ContourPlot
 from trackerExportConfig import ExportConfig
+from trackercache import ParseCache
+from trackerrender import read_atlas_index, atlas_track
 import numpy as np
 import matplotlib.pyplot as plt
 from matplotlib.backends.backend_qt5agg import (
@@ -95,6 +98,8 @@ class MyApp(QtWidgets.QMainWindow):
         self.ui.spinDec.setValue(float(self.settings.value('decimal', '1')))
         self.ui.spinFramerate.setValue(float(self.settings.value('framerate', '1')))
         self.ui.spinIntervals.setValue(float(self.settings.value('intervals','10')))
+        self.ui.spinWorkers.setValue(int(self.settings.value('workers', '0')))
+        self.ui.spinBootstrap.setValue(int(self.settings.value('bootstrap', '0')))
         if (len(self.ui.txtInput.text()) > 5 and len(self.ui.txtOutputdir.text()) > 5 and len(
                 self.ui.txtOutputfile.text()) > 5):
             self.ui.btnRunScript.setEnabled(True)
@@ -120,6 +125,7 @@ class MyApp(QtWidgets.QMainWindow):
         self.ui.btnReviewDataset.clicked.connect(self.loadData)
         self.ui.actionAverage_MSD.triggered.connect(self.avgMSD)
         self.ui.btnAvgMSD.clicked.connect(self.avgMSD)
+        self.ui.actionTrack_atlas.triggered.connect(self.showAtlas)
         self.ui.checkExclude.clicked.connect(self.excludeTrack)
         self.ui.spinCurrentTrack.valueChanged.connect(self.loadTrack, self.ui.spinCurrentTrack.value())
         # self.ui.groupSD.clicked.connect(self.loadTrack,self.ui.spinCurrentTrack.value())
@@ -127,6 +133,7 @@ class MyApp(QtWidgets.QMainWindow):
         self.ui.action_Load_dataset.setEnabled(False)
         self.ui.action_Export_data_to_vbSPT.setEnabled(False)
         self.ui.actionSave_plot_data.setEnabled(False)
+        self.ui.actionTrack_atlas.setEnabled(False)
         # Setup ProgressBar
         self.progress = progress(self)
         self.finished = False
@@ -226,7 +233,7 @@ class MyApp(QtWidgets.QMainWindow):
         browser.setFileMode(QtWidgets.QFileDialog.ExistingFiles)
         fname = browser.getOpenFileName(self, 'Choose a data file',
                                         self.settings.value('datafile', '.'),
-                                        'CSV files (*.csv *.trc)')
+                                        'CSV files (*.csv *.trc *.csv.gz *.csv.bz2 *.csv.xz)')
         if fname:
             self.ui.txtInput.setText(str(fname[0]))
             self.ui.statusBar.showMessage(str(fname[0]))
@@ -252,6 +259,15 @@ class MyApp(QtWidgets.QMainWindow):
             return 0
         # setup Tracker
         tracker = Tracker()
+        tracker.parsecache = ParseCache(self.settings.value('cachedir', homedir + os.path.sep + '.trackercache'),
+                                        int(self.settings.value('cachesize', '1024')))
+        # processes for MSD calculation (0 for number of CPUs)
+        workers = self.ui.spinWorkers.value()
+        tracker.workers = workers if workers > 0 else None
+        # gap-aware MSD (intervals by frame difference)
+        tracker.gaps = str(self.settings.value('gaps', 'false')).lower() in ('true', '1')
+        # bootstrap resamples for averaged MSD confidence intervals (0 for none)
+        tracker.bootstrap = self.ui.spinBootstrap.value()
 
         # Check input file has correct headings
         validinput = tracker.checkinputheaders(params['Input'])
@@ -274,6 +290,10 @@ class MyApp(QtWidgets.QMainWindow):
         outputfilename = params['OutputFile']
         msg = tracker.write_output(outputfilename)
         self.updateLog(msg)
+        # binary copy of output for reloading (npz or h5)
+        binary = str(self.settings.value('binary', ''))
+        if ("Completed" in msg) and len(binary) > 0:
+            self.updateLog(tracker.save_binary(os.path.splitext(outputfilename)[0] + '.' + binary.lstrip('.')))
 
         # Generate quiver plots (if required)
         if ("Completed" in msg) and (tracker.counter > 0):
@@ -324,17 +344,39 @@ class MyApp(QtWidgets.QMainWindow):
         totalplots = self.ui.checkBoxMatlab.isChecked()
         arrowwidth = self.ui.spinArrowsize.value()
         pngplots = self.ui.checkPNG.isChecked()
-        i = 0
-        for n in plotrange:
-            if (self.progress.finished == False):
-                trak = self.tracker.getPlotByIndex(self.tracker.avgplotter, n)
-                if trak is None:
-                    continue
-                i += 1
-                self.progress.update(i)
-                QtWidgets.QApplication.processEvents()
-                msg = tracker.plottrack(trak, totalplots, arrowwidth, pngplots)
-                # self.updateLog(msg)
+        # processes for rendering plots (0 for number of CPUs)
+        workers = int(self.settings.value('plotworkers', self.ui.spinWorkers.value()))
+        # PNG compression level (0-9, blank for default) and rendered plots queued for writing
+        compression = str(self.settings.value('pngcompression', ''))
+        tracker.plotcompression = int(compression) if len(compression) > 0 else None
+        tracker.plotqueue = int(self.settings.value('pngqueue', tracker.plotqueue))
+        positions = [n for n in plotrange if 0 <= n < len(tracker.avgplotter)]
+        i = len(positions)
+        done = [0]
+
+        def plotsdone(results):
+            done[0] += len(results)
+            self.progress.update(done[0])
+            for (tracknum, filename, msg) in results:
+                if msg.startswith('ERROR'):
+                    self.updateLog(msg)
+            QtWidgets.QApplication.processEvents()
+            return self.progress.finished
+
+        QtWidgets.QApplication.processEvents()
+        # all plots in one file (pdf or zip) instead of a PNG per track
+        plotexport = str(self.settings.value('plotexport', '')).lstrip('.').lower()
+        if pngplots and plotexport in ('pdf', 'zip') and len(positions) > 0:
+            filename = tracker.outputdir + "Tracks_" + str(positions[0]) + "to" + str(positions[-1]) + "." + plotexport
+            tracker.set_fromplot(positions[0])
+            tracker.set_toplot(positions[-1] + 1)
+            results = tracker.export_plots(filename, totalplots, plotsdone)
+            for (tracknum, fname, msg) in results:
+                if msg.startswith('ERROR'):
+                    self.updateLog(msg)
+            self.updateLog("Plots saved to " + filename)
+        else:
+            tracker.render_plots(positions, totalplots, pngplots, workers if workers > 0 else None, plotsdone)
         self.progress.stop()
         msg = "Track plots done"
         self.updateLog(msg)
@@ -383,6 +425,7 @@ class MyApp(QtWidgets.QMainWindow):
         self.ui.action_Load_dataset.setEnabled(True)
         self.ui.action_Export_data_to_vbSPT.setEnabled(True)
         self.ui.actionSave_plot_data.setEnabled(True)
+        self.ui.actionTrack_atlas.setEnabled(True)
         self.current = 1
         self.excluded = []
         self.ui.spinCurrentTrack.setValue(self.current)
@@ -433,37 +476,22 @@ class MyApp(QtWidgets.QMainWindow):
     def loadTrack(self, track):
         ptrack = self.tracker.getPlotByIndex(self.tracker.plotter, track - 1)
         ptracknum = ptrack[0]
-        ptracklist = ptrack[1]
-        print("loadTrack: plot=" + str(track) + " track=" + str(ptracknum) + " num points=" + str(len(ptracklist)))
+        rows = self.tracker.plotter.track(ptracknum)
+        print("loadTrack: plot=" + str(track) + " track=" + str(ptracknum) + " num points=" + str(len(rows['x'])))
         # Sort by timeframe
-        if (len(ptracklist) > 0):
-            tracklist = sorted(ptracklist, key=lambda t: t.frame)
-        else:
-            tracklist = ptracklist
-        x = []
-        y = []
-        dx = []
-        dy = []
-        sd = []
-        frames = []
-        cg = []  # cumulative gradient
-        for tn in tracklist:
-            dx.append(tn.dx)
-            dy.append(tn.dy)
-            x.append(tn.x)
-            y.append(tn.y)
-            frames.append(tn.frame)
-            sd.append(tn.sd)
-            cg.append(tn.gradient)
+        order = np.argsort(rows['frame'], kind='stable')
+        x = rows['x'][order]
+        y = rows['y'][order]
+        frames = rows['frame'][order]
 
         # convert timeframe via fps
         t0 = frames[0]
 
         if (t0 > 1):
-            tf = [x - t0 for x in frames]
+            tf = frames - t0
         else:
             tf = frames
-        t1 = [f * self.tracker.framerate for f in tf]
+        t1 = tf * self.tracker.framerate
         # Get MSD plots per track
         msdtrack = self.tracker.msd[ptracknum]
 
@@ -497,6 +525,11 @@ class MyApp(QtWidgets.QMainWindow):
     def excludeTrack(self):
         self.excluded.append(self.current)
 
+    '''Track numbers of excluded plots (self.excluded holds plot numbers from review)
+    '''
+    def getExcludedTracks(self):
+        return self.tracker.getTracksByIndex(self.tracker.plotter, [plot - 1 for plot in self.excluded])
+
     ''' saveData
         Definition: outputs coordinates per plot (except exclusions)
     '''
@@ -515,12 +548,17 @@ class MyApp(QtWidgets.QMainWindow):
         fname, _ = browser.getSaveFileName(self, 'Save as', outputfilename, 'CSV files (*.csv)')
 
         if fname:
-            msg, total = self.tracker.save_data(fname, self.excluded)
+            excluded = self.getExcludedTracks()
+            msg, total = self.tracker.save_data(fname, excluded)
             self.updateLog(msg)
             fname = str.replace(fname, '.csv', '_msd.csv')
             intervals = int(self.ui.spinIntervals.value())
             framerate = float(self.ui.spinFramerate.value())
-            msg = self.tracker.save_msd(fname, self.excluded,intervals,framerate)
+            layout = str(self.settings.value('msdlayout', 'wide'))  # wide or long (track, lag, dt, msd, npairs)
+            msg = self.tracker.save_msd(fname, excluded,intervals,framerate, layout=layout)
+            self.updateLog(msg)
+            fname = str.replace(fname, '_msd.csv', '_fits.csv')
+            msg = self.tracker.save_fits(fname, excluded, intervals, framerate)
             self.updateLog(msg)
             self.total = total
             self.initPlotReview()
@@ -529,7 +567,43 @@ class MyApp(QtWidgets.QMainWindow):
     def avgMSD(self):
         maxintervals = int(self.ui.spinIntervals.value())
         framerate = float(self.ui.spinFramerate.value())
-        self.tracker.generate_avgmsd(self.excluded, maxintervals,framerate)
+        self.tracker.generate_avgmsd(self.getExcludedTracks(), maxintervals,framerate)
+
+    '''Thumbnail atlas of all tracks - click on a track to review it
+    '''
+    def showAtlas(self):
+        if self.fname is not None:
+            outputfilename = os.path.splitext(self.fname)[0] + '_atlas.png'
+        else:
+            outputfilename = str.replace(self.loadparams()['OutputFile'], '.csv', '_atlas.png')
+        browser = QtWidgets.QFileDialog(self)
+        fname, _ = browser.getSaveFileName(self, 'Save atlas as', outputfilename, 'Images (*.png)')
+        if not fname:
+            return
+        msg = self.tracker.save_atlas(fname)
+        self.updateLog(msg)
+        if msg.startswith('ERROR'):
+            return
+        atlasindex = read_atlas_index(os.path.splitext(fname)[0] + '_index.csv')
+        # downsampled copy kept by save_atlas (the full atlas is not reloaded)
+        (preview, step) = self.tracker.atlaspreview
+        fig = plt.figure()
+        plt.imshow(preview, cmap='gray', vmin=0, vmax=255,
+                   extent=(0, preview.shape[1] * step, preview.shape[0] * step, 0))
+        plt.axis('off')
+        plt.title("Track atlas (" + str(len(self.tracker.plotter)) + " tracks) - click a track to review")
+
+        def onclick(event):
+            if event.inaxes is None or event.xdata is None:
+                return
+            # extent in atlas pixels
+            tracknum = atlas_track(atlasindex, event.xdata, event.ydata)
+            if tracknum is not None and tracknum in self.tracker.plotter:
+                self.ui.spinCurrentTrack.setValue(self.tracker.plotter.get_position(tracknum) + 1)
+                self.ui.statusBar.showMessage("Track " + str(tracknum))
+
+        fig.canvas.mpl_connect('button_press_event', onclick)
+        plt.show()
 
     def exportData(self):
         params = self.loadparams();
@@ -551,9 +625,10 @@ class MyApp(QtWidgets.QMainWindow):
             msg = "ExportConfig data loaded"
             self.updateLog(msg)
            # units = units #TODO - translate to ?field
+        spt.do_compression = str(self.settings.value('compression', 'true')).lower() in ('true', '1')
         spt.load_data(self.tracker)
-        spt.save_mat(fname)
-        msg = "Data exported to Matlab: " + fname
+        fnames = spt.save_mat(fname)
+        msg = "Data exported to Matlab: " + ", ".join(fnames)
         self.updateLog(msg)
         self.ui.statusBar.showMessage(msg)
 
@@ -567,7 +642,7 @@ class MyApp(QtWidgets.QMainWindow):
         browser.setAcceptMode(QtWidgets.QFileDialog.AcceptSave)
         fname, _ = browser.getOpenFileName(self, 'Choose a data file',
                                            self.settings.value('datafile', '.'),
-                                           'CSV files (*.csv *.trc)')
+                                           'Data files (*.csv *.trc *.csv.gz *.csv.bz2 *.csv.xz *.npz *.h5)')
         if fname:
             self.tracker.load_plotdata(fname)
             self.fname = fname
@@ -618,6 +693,8 @@ class MyApp(QtWidgets.QMainWindow):
             self.settings.setValue("decimal", self.ui.spinDec.value())
             self.settings.setValue("framerate", self.ui.spinFramerate.value())
             self.settings.setValue("intervals", self.ui.spinIntervals.value())
+            self.settings.setValue("workers", self.ui.spinWorkers.value())
+            self.settings.setValue("bootstrap", self.ui.spinBootstrap.value())
             self.progress.close()
             if (self.fig is not None):
                 plt.close(self.fig)
@@ -626,6 +703,8 @@ class MyApp(QtWidgets.QMainWindow):
 
 
 if __name__ == "__main__":
+    # worker processes (MSD, plots) re-run this module when frozen (Windows/macOS app bundles)
+    multiprocessing.freeze_support()
     import sys
 
     app = QtWidgets.QApplication(sys.argv)
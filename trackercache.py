@@ -0,0 +1,137 @@
+#!/usr/bin/python3
+"""
+    QBI Meunier Tracker APP: Parse cache
+    *******************************************************************************
+    Stores parsed input columns (track, frame, x, y, intensity) as a raw .npy file
+    which can be memory-mapped on later runs instead of re-parsing the CSV.
+    Entries are keyed on input path, size, mtime and a hash of the file contents
+    (first and last blocks) and the cache directory is trimmed to a maximum size.
+
+    Copyright (C) 2015  QBI Software, The University of Queensland
+
+    This program is free software; you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation; either version 2 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+"""
+import os
+import hashlib
+import numpy as np
+from os.path import expanduser
+
+CACHE_VERSION = 1
+
+
+class ParseCache:
+
+    def __init__(self, cachedir=None, maxsize=1024):
+        if cachedir is None:
+            cachedir = expanduser("~") + os.path.sep + '.trackercache'
+        self.cachedir = cachedir
+        self.maxsize = maxsize  # MB
+        self.blocksize = 1024 * 1024  # bytes hashed from start and end of file
+
+    '''Generate key from input path, size, mtime and content hash
+    '''
+    def key(self, inputfilename):
+        fullname = os.path.abspath(inputfilename)
+        st = os.stat(fullname)
+        h = hashlib.sha1()
+        h.update(str((CACHE_VERSION, fullname, st.st_size, st.st_mtime_ns)).encode('utf-8'))
+        with open(fullname, 'rb') as fi:
+            h.update(fi.read(self.blocksize))
+            if st.st_size > self.blocksize:
+                fi.seek(max(self.blocksize, st.st_size - self.blocksize))
+                h.update(fi.read(self.blocksize))
+        return h.hexdigest()
+
+    def get_filename(self, inputfilename):
+        return os.path.join(self.cachedir, self.key(inputfilename) + '.npy')
+
+    '''Load columns for input file if cached
+       Returns dict of (memory-mapped) column arrays or None if not cached
+    '''
+    def load(self, inputfilename):
+        try:
+            fname = self.get_filename(inputfilename)
+            if not os.path.isfile(fname):
+                return None
+            data = np.load(fname, mmap_mode='r')
+            # mark as recently used for eviction
+            os.utime(fname)
+        except (IOError, OSError, ValueError) as e:
+            print("Error: Unable to read parse cache:", e)
+            return None
+        cols = dict()
+        for name in data.dtype.names:
+            cols[name] = data[name]
+        print("DEBUG: Loaded from parse cache:", fname)
+        return cols
+
+    '''Save columns for input file then trim cache to maxsize (the new entry is kept)
+       cols: dict of equal length arrays
+       Returns cache filename or None if not saved (eg larger than maxsize)
+    '''
+    def save(self, inputfilename, cols):
+        names = list(cols.keys())
+        nbytes = len(cols[names[0]]) * sum([cols[n].dtype.itemsize for n in names])
+        if nbytes > self.maxsize * 1024 * 1024:
+            print("DEBUG: Not cached - parsed input larger than parse cache:", inputfilename)
+            return None
+        try:
+            if not os.path.isdir(self.cachedir):
+                os.makedirs(self.cachedir)
+            fname = self.get_filename(inputfilename)
+            data = np.empty(len(cols[names[0]]), dtype=[(n, cols[n].dtype) for n in names])
+            for n in names:
+                data[n] = cols[n]
+            # write to temp file so partial entries are never loaded
+            tmpname = fname + '.tmp'
+            with open(tmpname, 'wb') as fo:
+                np.save(fo, data)
+            os.replace(tmpname, fname)
+        except (IOError, OSError) as e:
+            print("Error: Unable to write parse cache:", e)
+            return None
+        self.evict(keep=os.path.basename(fname))
+        return fname
+
+    '''Remove least recently used entries until cache is under maxsize (MB)
+       keep: filename of entry which is not removed
+    '''
+    def evict(self, keep=None):
+        if not os.path.isdir(self.cachedir):
+            return 0
+        entries = []
+        for f in os.listdir(self.cachedir):
+            if f.endswith('.npy') and f != keep:
+                st = os.stat(os.path.join(self.cachedir, f))
+                entries.append((st.st_mtime, st.st_size, f))
+        entries.sort()
+        total = sum([e[1] for e in entries])
+        if keep is not None and os.path.isfile(os.path.join(self.cachedir, keep)):
+            total += os.path.getsize(os.path.join(self.cachedir, keep))
+        maxbytes = self.maxsize * 1024 * 1024
+        removed = 0
+        for (mtime, size, f) in entries:
+            if total <= maxbytes:
+                break
+            try:
+                os.remove(os.path.join(self.cachedir, f))
+                total -= size
+                removed += 1
+            except OSError:
+                pass
+        return removed
+
+    def clear(self):
+        maxsize = self.maxsize
+        self.maxsize = 0
+        removed = self.evict()
+        self.maxsize = maxsize
+        return removed
@@ -0,0 +1,154 @@
+#!/usr/bin/python3
+"""
+    QBI Meunier Tracker APP: Input file handling
+    *******************************************************************************
+    Opens plain or compressed (gzip, bz2, xz) CSV files for reading as text.
+    Compressed files are decompressed while streaming - no scratch copy is needed.
+    Binary output (NPZ or HDF5 if h5py is installed) stores columns as raw arrays
+    which are memory-mapped when reopened instead of parsing CSV.
+
+    Copyright (C) 2015  QBI Software, The University of Queensland
+
+    This program is free software; you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation; either version 2 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+"""
+import bz2
+import gzip
+import json
+import lzma
+import struct
+import zipfile
+import numpy as np
+try:
+    import h5py
+except ImportError:
+    h5py = None
+
+# file signature: (extension, open function)
+COMPRESSION = [(b'\x1f\x8b', '.gz', gzip.open),
+               (b'BZh', '.bz2', bz2.open),
+               (b'\xfd7zXZ\x00', '.xz', lzma.open)]
+
+INPUT_PATTERNS = ['*.csv', '*.trc', '*.csv.gz', '*.csv.bz2', '*.csv.xz']
+BINARY_PATTERNS = ['*.npz', '*.h5']
+HDF5_EXTENSIONS = ('.h5', '.hdf5')
+
+
+'''Get open function for compressed file (by file signature) or None if not compressed
+'''
+def get_decompressor(inputfilename):
+    with open(inputfilename, 'rb') as fi:
+        magic = fi.read(6)
+    for (signature, ext, openfunc) in COMPRESSION:
+        if magic.startswith(signature):
+            return openfunc
+    return None
+
+
+def is_compressed(inputfilename):
+    return get_decompressor(inputfilename) is not None
+
+
+'''Open plain or compressed input file as text for csv reading
+'''
+def open_input(inputfilename):
+    openfunc = get_decompressor(inputfilename)
+    if openfunc is None:
+        return open(inputfilename, 'r', newline='')
+    return openfunc(inputfilename, 'rt', newline='')
+
+
+'''Remove compression extension from filename (eg trackfile.csv.gz -> trackfile.csv)
+'''
+def strip_compression(inputfilename):
+    for (signature, ext, openfunc) in COMPRESSION:
+        if inputfilename.endswith(ext):
+            return inputfilename[:-len(ext)]
+    return inputfilename
+
+
+def is_binary(filename):
+    return filename.lower().endswith(('.npz',) + HDF5_EXTENSIONS)
+
+
+'''Write arrays (dict of name: array) and params (dict, stored as JSON) to binary file
+   .h5/.hdf5 as HDF5 (requires h5py) otherwise uncompressed NPZ
+'''
+def save_binary(outfilename, arrays, params):
+    if outfilename.lower().endswith(HDF5_EXTENSIONS):
+        if h5py is None:
+            raise ImportError("h5py is required for HDF5 output - use .npz")
+        with h5py.File(outfilename, 'w') as f:
+            for (name, arr) in arrays.items():
+                # contiguous (not chunked or compressed) so datasets can be memory-mapped
+                f.create_dataset(name, data=np.asarray(arr))
+            f.attrs['params'] = json.dumps(params)
+    else:
+        data = dict(arrays)
+        data['params'] = np.array(json.dumps(params))
+        # np.savez stores members uncompressed so they can be memory-mapped
+        with open(outfilename, 'wb') as fo:
+            np.savez(fo, **data)
+    return outfilename
+
+
+'''Memory-map an uncompressed .npy member of a zip (npz) file or None if not possible
+'''
+def _map_npz_member(filename, fi, info):
+    if info.compress_type != zipfile.ZIP_STORED:
+        return None
+    fi.seek(info.header_offset)
+    header = fi.read(30)
+    (namelen, extralen) = struct.unpack('<HH', header[26:30])
+    fi.seek(info.header_offset + 30 + namelen + extralen)
+    version = np.lib.format.read_magic(fi)
+    if version == (1, 0):
+        shape, fortran, dtype = np.lib.format.read_array_header_1_0(fi)
+    else:
+        shape, fortran, dtype = np.lib.format.read_array_header_2_0(fi)
+    if dtype.hasobject:
+        return None
+    if int(np.prod(shape)) == 0:
+        return np.zeros(shape, dtype=dtype)
+    return np.memmap(filename, dtype=dtype, mode='r', offset=fi.tell(), shape=shape,
+                     order='F' if fortran else 'C')
+
+
+'''Read binary file written by save_binary
+   Arrays are memory-mapped where possible (uncompressed members / contiguous datasets)
+   Returns (arrays, params)
+'''
+def load_binary(filename):
+    arrays = dict()
+    if filename.lower().endswith(HDF5_EXTENSIONS):
+        if h5py is None:
+            raise ImportError("h5py is required to read HDF5 files")
+        with h5py.File(filename, 'r') as f:
+            params = json.loads(f.attrs['params'])
+            for name in f:
+                ds = f[name]
+                offset = ds.id.get_offset()
+                if offset is not None and ds.size > 0:
+                    arrays[name] = np.memmap(filename, dtype=ds.dtype, mode='r', offset=offset, shape=ds.shape)
+                else:
+                    arrays[name] = ds[()]
+        return arrays, params
+    with zipfile.ZipFile(filename) as zf, open(filename, 'rb') as fi:
+        for info in zf.infolist():
+            name = info.filename[:-4] if info.filename.endswith('.npy') else info.filename
+            arr = None
+            if name != 'params':
+                arr = _map_npz_member(filename, fi, info)
+            if arr is None:
+                with zf.open(info) as member:
+                    arr = np.lib.format.read_array(member)
+            arrays[name] = arr
+    params = json.loads(str(arrays.pop('params')))
+    return arrays, params
@@ -0,0 +1,568 @@
+#!/usr/bin/python3
+"""
+    QBI Meunier Tracker APP: MSD calculation
+    *******************************************************************************
+    Mean square displacement per track using the FFT (autocorrelation) method,
+    O(N log N) per track instead of comparing every pair of points per interval.
+    All tracks of a table can be calculated in shards across a process pool with
+    coordinates passed to workers in shared memory.
+    Gap-aware MSD bins displacements by frame difference so tracks with missing
+    frames (eg blinking) do not mix different time intervals.
+    MSD of all tracks is stored as (tracks x intervals) arrays of values and pairs (MSDTable).
+    Diffusion coefficient and anomalous exponent are fitted for all tracks at once
+    from the interval x track MSD matrix. Confidence intervals of the averaged MSD
+    are estimated by resampling tracks (bootstrap) in batches of index arrays.
+
+    Copyright (C) 2015  QBI Software, The University of Queensland
+
+    This program is free software; you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation; either version 2 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+"""
+import concurrent.futures
+import itertools
+import os
+import numpy as np
+from multiprocessing import shared_memory
+from collections.abc import Mapping
+
+# Below this number of points all tracks are calculated in the calling process
+MIN_PARALLEL_POINTS = 100000
+# Tracks per shard when calculated in the calling process (results passed to callback per shard)
+SERIAL_SHARD_TRACKS = 1000
+# Bootstrap resamples per seeded batch (batches and results do not depend on the number of workers)
+BOOTSTRAP_BATCH = 250
+
+
+'''Autocorrelation sum(r[j] * r[j + m]) for m = 0..n-1 via zero-padded FFT
+'''
+def autocorrelation(r):
+    n = len(r)
+    size = 1 << int(2 * n - 1).bit_length()  # power of 2 >= 2n - avoids circular overlap
+    f = np.fft.rfft(r, size)
+    return np.fft.irfft(f * np.conjugate(f), size)[:n]
+
+
+'''Number of intervals calculated for a track of n points (see msd_fft)
+'''
+def num_lags(n, maxlag=0):
+    numlags = max(n - 2, 0)
+    if (maxlag > 0):
+        numlags = min(maxlag, numlags)
+    return numlags
+
+
+'''Mean square displacement of a track for time intervals 1..maxlag
+   x, y: coordinates sorted by frame
+   maxlag: maximum interval (0 for all), the last interval (n - 1) with a single pair is not included
+   Returns array where element i-1 is the MSD for interval i
+      MSD(m) = S1(m) - 2 * S2(m)
+      S1(m) = sum(r[j]^2 + r[j + m]^2) / (n - m),  S2(m) = sum(r[j] . r[j + m]) / (n - m)
+'''
+def msd_fft(x, y, maxlag=0):
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    n = len(x)
+    numlags = num_lags(n, maxlag)
+    if (numlags == 0):
+        return np.zeros(0, dtype=np.float64)
+    # MSD does not depend on origin - centering reduces rounding error in S1 - 2 * S2
+    x = x - x.mean()
+    y = y - y.mean()
+    d = x * x + y * y
+    lags = np.arange(1, numlags + 1)
+    # sum of r^2 over j = 0..n-m-1 and j = m..n-1
+    head = np.cumsum(d)[n - 1 - lags]
+    tail = np.cumsum(d[::-1])[n - 1 - lags]
+    s1 = head + tail
+    s2 = autocorrelation(x)[lags] + autocorrelation(y)[lags]
+    # rounding can leave tiny negative values for stationary tracks
+    return np.maximum(s1 - 2 * s2, 0) / (n - lags)
+
+
+'''Gap-aware MSD of a track binned by frame difference (interval) 1..maxlag
+   frame, x, y: track sorted by frame (frames may be missing)
+   maxlag: maximum frame difference (0 for all - up to first to last frame)
+   Pairs are enumerated per index offset k for all points at once until every frame difference
+   is over maxlag (with repeated frames points more than maxlag apart can still be within maxlag frames)
+   Returns (msd, npairs) arrays where element i-1 is for a frame difference of i
+   msd is NaN where there are no pairs
+'''
+def msd_gaps(frame, x, y, maxlag=0):
+    frame = np.asarray(frame, dtype=np.int64)
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    n = len(x)
+    numlags = 0
+    if (n > 1):
+        numlags = int(frame[-1] - frame[0])
+        if (maxlag > 0):
+            numlags = min(maxlag, numlags)
+    if (numlags <= 0):
+        return np.zeros(0, dtype=np.float64), np.zeros(0, dtype=np.int64)
+    sums = np.zeros(numlags + 1, dtype=np.float64)
+    npairs = np.zeros(numlags + 1, dtype=np.int64)
+    for k in range(1, n):
+        fd = frame[k:] - frame[:-k]
+        if (fd.min() > numlags):
+            break
+        sel = (fd >= 1) & (fd <= numlags)  # repeated frames are not an interval
+        dx = x[k:][sel] - x[:-k][sel]
+        dy = y[k:][sel] - y[:-k][sel]
+        sums += np.bincount(fd[sel], weights=dx * dx + dy * dy, minlength=numlags + 1)
+        npairs += np.bincount(fd[sel], minlength=numlags + 1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        msd = sums[1:] / npairs[1:]
+    return msd, npairs[1:]
+
+
+'''Number of pairs per interval 1..len(msd) for MSD by point index (see msd_fft) of n points
+'''
+def index_pairs(n, numlags):
+    return n - np.arange(1, numlags + 1, dtype=np.int64)
+
+
+'''Number of pairs per interval as dict of interval: npairs (intervals without MSD value are left out)
+'''
+def pairs_dict(msd, npairs):
+    valid = ~np.isnan(np.asarray(msd))
+    return dict(zip((np.flatnonzero(valid) + 1).tolist(), np.asarray(npairs)[valid].tolist()))
+
+
+LONG_FIELDNAMES = ['track', 'lag', 'dt', 'msd', 'npairs']
+
+
+'''Rows of long format MSD output (track, lag, dt, msd, npairs) for one track
+   msd, npairs: arrays where element i-1 is for interval i (intervals without MSD are left out)
+'''
+def long_rows(tracknum, msd, npairs, framerate=1):
+    msd = np.asarray(msd)
+    valid = ~np.isnan(msd)
+    lags = np.flatnonzero(valid) + 1
+    return zip(itertools.repeat(tracknum), lags.tolist(), (lags * framerate).tolist(), msd[valid].tolist(),
+               np.asarray(npairs)[valid].tolist())
+
+
+'''Convert MSD array (element i-1 for interval i) to dict of interval: msd
+   Intervals without a value (NaN) are left out
+'''
+def to_dict(msd):
+    msd = np.asarray(msd)
+    valid = ~np.isnan(msd)
+    if valid.all():
+        return dict(zip(range(1, len(msd) + 1), msd.tolist()))
+    return dict(zip((np.flatnonzero(valid) + 1).tolist(), msd[valid].tolist()))
+
+
+'''Rows of long format MSD output (see long_rows) for a block of tracks
+   msd, npairs: (tracks x lags) arrays where column i-1 is for interval i - rows in track then interval order
+'''
+def matrix_rows(tracknums, msd, npairs, framerate=1):
+    (rows, cols) = np.nonzero(~np.isnan(msd))
+    lags = cols + 1
+    return zip(np.asarray(tracknums)[rows].tolist(), lags.tolist(), (lags * framerate).tolist(),
+               msd[rows, cols].tolist(), npairs[rows, cols].tolist())
+
+
+class MSDTable(Mapping):
+    '''MSD per track and time interval stored as (tracks x lags) arrays
+       msd[i, lag - 1] is the MSD of track tracknums[i] for interval lag (NaN if not calculated)
+       and npairs[i, lag - 1] its number of pairs. Rows are kept in order tracks were added.
+       As a mapping: track number -> dict of interval: msd (created on demand)
+    '''
+    def __init__(self, tracknums=None, msd=None, npairs=None):
+        if tracknums is None:
+            tracknums = np.zeros(0, dtype=np.int64)
+            msd = np.zeros((0, 0), dtype=np.float64)
+            npairs = np.zeros((0, 0), dtype=np.int64)
+        self._tracknums = np.asarray(tracknums, dtype=np.int64)
+        self._msd = np.asarray(msd, dtype=np.float64)
+        self._npairs = np.asarray(npairs, dtype=np.int64)
+        self.size = len(self._tracknums)
+        self.width = self._msd.shape[1]
+        self.positions = dict(zip(self._tracknums.tolist(), range(self.size)))
+
+    '''Create from list of (msd, npairs) arrays per track (as msd_batch)
+    '''
+    @classmethod
+    def from_results(cls, tracknums, results):
+        lens = np.fromiter((len(m) for (m, n) in results), dtype=np.int64, count=len(results))
+        width = int(lens.max()) if len(lens) > 0 else 0
+        msd = np.full((len(results), width), np.nan)
+        npairs = np.zeros((len(results), width), dtype=np.int64)
+        if lens.sum() > 0:
+            rows = np.repeat(np.arange(len(results)), lens)
+            cols = np.arange(len(rows)) - np.repeat(np.cumsum(lens) - lens, lens)
+            msd[rows, cols] = np.concatenate([m for (m, n) in results])
+            npairs[rows, cols] = np.concatenate([n for (m, n) in results])
+        return cls(np.asarray(tracknums, dtype=np.int64), msd, npairs)
+
+    @property
+    def tracknums(self):
+        return self._tracknums[:self.size]
+
+    @property
+    def msd(self):
+        return self._msd[:self.size, :self.width]
+
+    @property
+    def npairs(self):
+        return self._npairs[:self.size, :self.width]
+
+    def __len__(self):
+        return self.size
+
+    def __iter__(self):
+        return iter(self.tracknums.tolist())
+
+    def __contains__(self, tracknum):
+        return tracknum in self.positions
+
+    def __getitem__(self, tracknum):
+        return to_dict(self.msd[self.positions[tracknum]])
+
+    '''Number of pairs per interval of track as dict of interval: npairs
+    '''
+    def pairs(self, tracknum):
+        pos = self.positions[tracknum]
+        return pairs_dict(self.msd[pos], self.npairs[pos])
+
+    def nbytes(self):
+        return self._tracknums.nbytes + self._msd.nbytes + self._npairs.nbytes
+
+    '''Grow arrays (doubling) to hold at least numrows tracks and width intervals
+    '''
+    def reserve(self, numrows, width):
+        (caprows, capwidth) = self._msd.shape
+        if numrows <= caprows and width <= capwidth:
+            return
+        if numrows > caprows:
+            caprows = max(numrows, 2 * caprows)
+        if width > capwidth:
+            capwidth = max(width, 2 * capwidth)
+        tracknums = np.zeros(caprows, dtype=np.int64)
+        msd = np.full((caprows, capwidth), np.nan)
+        npairs = np.zeros((caprows, capwidth), dtype=np.int64)
+        tracknums[:self.size] = self.tracknums
+        msd[:self.size, :self.width] = self.msd
+        npairs[:self.size, :self.width] = self.npairs
+        (self._tracknums, self._msd, self._npairs) = (tracknums, msd, npairs)
+
+    '''Set MSD (and number of pairs) arrays of a track - replaced in place if already present
+    '''
+    def set_track(self, tracknum, msd, npairs):
+        width = len(msd)
+        pos = self.positions.get(tracknum)
+        if pos is None:
+            pos = self.size
+            self.reserve(pos + 1, width)
+            self._tracknums[pos] = tracknum
+            self.positions[tracknum] = pos
+            self.size += 1
+        else:
+            self.reserve(self.size, width)
+            self._msd[pos, :] = np.nan
+            self._npairs[pos, :] = 0
+        self._msd[pos, :width] = msd
+        self._npairs[pos, :width] = npairs
+        self.width = max(self.width, width)
+
+    '''Set MSD of tracks from list of (msd, npairs) arrays per track (see from_results)
+       New tracks are appended as a block, tracks already present are replaced in place
+    '''
+    def set_tracks(self, tracknums, results):
+        tracknums = np.asarray(tracknums, dtype=np.int64)
+        present = np.fromiter((t in self.positions for t in tracknums.tolist()), dtype=bool, count=len(tracknums))
+        for i in np.flatnonzero(present).tolist():
+            self.set_track(tracknums[i].item(), *results[i])
+        new = np.flatnonzero(~present)
+        if len(new) == 0:
+            return
+        added = MSDTable.from_results(tracknums[new], [results[i] for i in new.tolist()])
+        (start, end) = (self.size, self.size + added.size)
+        self.reserve(end, added.width)
+        self._tracknums[start:end] = added.tracknums
+        self._msd[start:end, :added.width] = added.msd
+        self._npairs[start:end, :added.width] = added.npairs
+        self.positions.update(zip(added.tracknums.tolist(), range(start, end)))
+        self.size = end
+        self.width = max(self.width, added.width)
+
+    '''New table without the given tracks
+    '''
+    def exclude(self, tracknums):
+        keep = ~np.isin(self.tracknums, np.asarray(list(tracknums), dtype=np.int64))
+        return MSDTable(self.tracknums[keep], self.msd[keep], self.npairs[keep])
+
+    '''MSD and number of pairs for intervals 1..maxlag (NaN and 0 beyond the last calculated interval)
+       Returns (tracknums, msd, npairs) - views of the table if maxlag is not above its width
+    '''
+    def matrix(self, maxlag):
+        if maxlag <= self.width:
+            return self.tracknums, self.msd[:, :maxlag], self.npairs[:, :maxlag]
+        msd = np.full((self.size, maxlag), np.nan)
+        npairs = np.zeros((self.size, maxlag), dtype=np.int64)
+        msd[:, :self.width] = self.msd
+        npairs[:, :self.width] = self.npairs
+        return self.tracknums, msd, npairs
+
+
+'''MSD of tracks at positions start..end-1 - rows of track i are offsets[i]:offsets[i + 1]
+   Rows of each track must be sorted by frame
+   frame: if given MSD is gap-aware (see msd_gaps)
+   Returns list of (msd, npairs) arrays per track
+'''
+def msd_tracks(x, y, offsets, maxlag=0, start=0, end=None, frame=None):
+    if end is None:
+        end = len(offsets) - 1
+    results = []
+    for i in range(start, end):
+        (s, e) = (offsets[i], offsets[i + 1])
+        if frame is None:
+            msd = msd_fft(x[s:e], y[s:e], maxlag)
+            results.append((msd, index_pairs(e - s, len(msd))))
+        else:
+            results.append(msd_gaps(frame[s:e], x[s:e], y[s:e], maxlag))
+    return results
+
+
+'''Split tracks into about numshards ranges (start, end) with similar numbers of points
+'''
+def split_shards(offsets, numshards):
+    numtracks = len(offsets) - 1
+    bounds = np.searchsorted(offsets, np.linspace(0, offsets[-1], numshards + 1), side='left')
+    bounds = np.unique(np.clip(bounds, 0, numtracks))
+    bounds[0] = 0
+    bounds[-1] = numtracks
+    return [(int(s), int(e)) for (s, e) in zip(bounds[:-1], bounds[1:]) if e > s]
+
+
+'''Worker: attach to shared memory blocks and calculate a shard of tracks
+   shared: list of (name, dtype, length) for x, y, offsets (and frame if gap-aware)
+'''
+def _msd_shard(shared, maxlag, start, end):
+    blocks = []
+    arrays = []
+    try:
+        for (name, dtype, length) in shared:
+            shm = shared_memory.SharedMemory(name=name)
+            blocks.append(shm)
+            arrays.append(np.ndarray((length,), dtype=dtype, buffer=shm.buf))
+        (x, y, offsets) = arrays[:3]
+        frame = arrays[3] if len(arrays) > 3 else None
+        return start, msd_tracks(x, y, offsets, maxlag, start, end, frame)
+    finally:
+        del arrays
+        for shm in blocks:
+            shm.close()
+
+
+'''Copy array into a new shared memory block
+'''
+def _share(arr):
+    arr = np.ascontiguousarray(arr)
+    shm = shared_memory.SharedMemory(create=True, size=max(arr.nbytes, 1))
+    view = np.ndarray(arr.shape, dtype=arr.dtype, buffer=shm.buf)
+    view[:] = arr
+    del view
+    return shm, (shm.name, arr.dtype.str, len(arr))
+
+
+'''MSD of all tracks (see msd_tracks) calculated in shards by a pool of worker processes
+   workers: number of processes (None for number of CPUs, 1 to calculate in this process)
+   callback: called with (start, results) as each shard of tracks finishes (in order of completion)
+   Returns list of (msd, npairs) arrays in track order
+'''
+def msd_batch(x, y, offsets, maxlag=0, workers=None, shardsperworker=4, frame=None, callback=None):
+    numtracks = len(offsets) - 1
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if (workers <= 1 or numtracks < 2 or offsets[-1] < MIN_PARALLEL_POINTS):
+        results = []
+        for start in range(0, numtracks, SERIAL_SHARD_TRACKS):
+            msds = msd_tracks(x, y, offsets, maxlag, start, min(start + SERIAL_SHARD_TRACKS, numtracks), frame)
+            if callback is not None:
+                callback(start, msds)
+            results.extend(msds)
+        return results
+    shards = split_shards(offsets, workers * shardsperworker)
+    blocks = []
+    results = [None] * numtracks
+    try:
+        shared = []
+        arrays = [np.asarray(x, dtype=np.float64), np.asarray(y, dtype=np.float64),
+                  np.asarray(offsets, dtype=np.int64)]
+        if frame is not None:
+            arrays.append(np.asarray(frame, dtype=np.int64))
+        for arr in arrays:
+            (shm, desc) = _share(arr)
+            blocks.append(shm)
+            shared.append(desc)
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(_msd_shard, shared, maxlag, start, end) for (start, end) in shards]
+            for future in concurrent.futures.as_completed(futures):
+                (start, msds) = future.result()
+                results[start:start + len(msds)] = msds
+                if callback is not None:
+                    callback(start, msds)
+    finally:
+        for shm in blocks:
+            shm.close()
+            shm.unlink()
+    return results
+
+
+'''Mean, standard error and number of tracks per interval (row) of MSD matrix, ignoring missing values
+'''
+def msd_stats(matrix):
+    count = np.count_nonzero(~np.isnan(matrix), axis=1)
+    total = np.nansum(matrix, axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = total / count
+        var = np.nansum((matrix - mean[:, np.newaxis]) ** 2, axis=1) / count
+        se = np.sqrt(var) / np.sqrt(count)
+    return mean, se, count
+
+
+'''Least squares line y = slope * x + intercept for each column of y (NaN values ignored)
+   x: values per row, y: matrix (rows x columns)
+   intercept: fit intercept or force line through origin
+   Returns slope, intercept, r2, n (number of values per column) - NaN where n < 2
+'''
+def fit_lines(x, y, intercept=True):
+    x = np.asarray(x, dtype=np.float64)[:, np.newaxis]
+    valid = ~np.isnan(y)
+    n = np.count_nonzero(valid, axis=0)
+    xv = np.where(valid, x, 0)
+    yv = np.where(valid, y, 0)
+    sx = xv.sum(axis=0)
+    sy = yv.sum(axis=0)
+    sxx = (xv * xv).sum(axis=0)
+    sxy = (xv * yv).sum(axis=0)
+    syy = (yv * yv).sum(axis=0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        if intercept:
+            slope = (n * sxy - sx * sy) / (n * sxx - sx * sx)
+            icpt = (sy - slope * sx) / n
+        else:
+            slope = sxy / sxx
+            icpt = np.zeros(len(n))
+        # residual and total sum of squares
+        ssres = syy - 2 * slope * sxy - 2 * icpt * sy + slope * slope * sxx + 2 * slope * icpt * sx + n * icpt * icpt
+        sstot = syy - sy * sy / n
+        r2 = 1 - ssres / sstot
+    short = n < 2
+    slope[short] = np.nan
+    icpt[short] = np.nan
+    r2[short] = np.nan
+    return slope, icpt, r2, n
+
+
+'''Fit MSD of every track (columns of matrix) against time interval dt (rows)
+   Brownian: MSD = 4 * D * dt + offset (offset from localization error, optional)
+   Anomalous: MSD = 4 * Dalpha * dt^alpha (fitted as a line in log-log)
+   Returns dict of arrays per track: nlags, D, offset, r2, alpha, Dalpha
+'''
+def fit_msd(dt, matrix, offset=True):
+    dt = np.asarray(dt, dtype=np.float64)
+    slope, icpt, r2, n = fit_lines(dt, matrix, offset)
+    # log-log fit only for positive values
+    with np.errstate(invalid='ignore', divide='ignore'):
+        logmsd = np.where(matrix > 0, np.log(matrix), np.nan)
+    alpha, logicpt, logr2, logn = fit_lines(np.log(dt), logmsd)
+    fits = dict()
+    fits['nlags'] = n
+    fits['D'] = slope / 4
+    fits['offset'] = icpt
+    fits['r2'] = r2
+    fits['alpha'] = alpha
+    fits['Dalpha'] = np.exp(logicpt) / 4
+    return fits
+
+
+'''Averaged MSD per interval for a batch of bootstrap resamples of tracks
+   matrix: intervals x tracks (NaN if missing), numresamples: resamples in this batch
+   Returns array (numresamples x intervals)
+'''
+def _bootstrap_batch(matrix, numresamples, seed, batchsize=100):
+    rng = np.random.default_rng(seed)
+    numtracks = matrix.shape[1]
+    valid = (~np.isnan(matrix)).astype(np.float64).T
+    values = np.nan_to_num(matrix).T
+    means = np.empty((numresamples, matrix.shape[0]))
+    for start in range(0, numresamples, batchsize):
+        b = min(batchsize, numresamples - start)
+        # resampled track indices -> count of each track per resample
+        idx = rng.integers(0, numtracks, size=(b, numtracks))
+        idx += np.arange(b)[:, np.newaxis] * numtracks
+        counts = np.bincount(idx.ravel(), minlength=b * numtracks).reshape(b, numtracks).astype(np.float64)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            means[start:start + b] = (counts @ values) / (counts @ valid)
+    return means
+
+
+'''Worker: attach to shared memory block of MSD matrix and calculate a batch of resamples
+   shared: (name, dtype, length) of the flattened matrix
+'''
+def _bootstrap_shard(shared, shape, numresamples, seed):
+    (name, dtype, length) = shared
+    shm = shared_memory.SharedMemory(name=name)
+    matrix = None
+    try:
+        matrix = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+        return _bootstrap_batch(matrix, numresamples, seed)
+    finally:
+        del matrix
+        shm.close()
+
+
+'''Bootstrap confidence intervals of averaged MSD and its slope by resampling tracks
+   dt: time per interval (rows), matrix: intervals x tracks (NaN if missing)
+   numresamples: number of resamples, ci: confidence level (%)
+   workers: processes to split resamples across (1 for this process) - same results for a seed
+   Returns dict: mean, lower, upper (per interval), slope, slope_lower, slope_upper
+'''
+def bootstrap_msd(dt, matrix, numresamples=1000, ci=95, workers=1, seed=None):
+    dt = np.asarray(dt, dtype=np.float64)
+    mean, se, count = msd_stats(matrix)
+    if workers is None:
+        workers = os.cpu_count() or 1
+    sizes = [min(BOOTSTRAP_BATCH, numresamples - start) for start in range(0, numresamples, BOOTSTRAP_BATCH)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    parts = [np.empty((0, matrix.shape[0]))]
+    if (workers <= 1 or len(sizes) < 2):
+        parts += [_bootstrap_batch(matrix, n, sd) for (n, sd) in zip(sizes, seeds)]
+    else:
+        matrix = np.ascontiguousarray(matrix, dtype=np.float64)
+        (shm, shared) = _share(matrix.ravel())
+        try:
+            with concurrent.futures.ProcessPoolExecutor(max_workers=min(workers, len(sizes))) as executor:
+                futures = [executor.submit(_bootstrap_shard, shared, matrix.shape, n, sd)
+                           for (n, sd) in zip(sizes, seeds)]
+                parts += [f.result() for f in futures]
+        finally:
+            shm.close()
+            shm.unlink()
+    means = np.concatenate(parts)
+    # slope of averaged MSD for each resample (intervals with values only)
+    valid = count > 0
+    slopes = fit_lines(dt[valid], means[:, valid].T)[0]
+    slope = fit_lines(dt[valid], mean[valid][:, np.newaxis])[0][0]
+    q = [(100 - ci) / 2, 100 - (100 - ci) / 2]
+    with np.errstate(invalid='ignore'):
+        lower, upper = np.nanpercentile(means, q, axis=0) if numresamples > 0 else (mean, mean)
+        slopelimits = np.nanpercentile(slopes, q) if numresamples > 0 else (slope, slope)
+    results = dict()
+    results['mean'] = mean
+    results['lower'] = lower
+    results['upper'] = upper
+    results['slope'] = slope
+    results['slope_lower'] = slopelimits[0]
+    results['slope_upper'] = slopelimits[1]
+    return results
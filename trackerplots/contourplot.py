@@ -22,6 +22,7 @@ import os
 import copy
 import collections
 import numpy as np
+from trackerio import open_input
 import matplotlib
 matplotlib.use("Qt5Agg")
 import matplotlib.backends.backend_qt5agg
@@ -50,11 +51,8 @@ class ContourPlot:
     '''Load from a CSV file produced by TrackerApp
     '''
     def load(self,inputfilename):
-        #Open input file
-        if sys.version_info >= (3,0,0):
-            fi = open(inputfilename, 'r', newline='')
-        else:
-            fi = open(inputfilename, 'rb')
+        #Open input file (plain or compressed)
+        fi = open_input(inputfilename)
         self.name = os.path.basename(inputfilename)
         self.initlists()
         with fi as csvfile:
@@ -77,6 +75,17 @@ class ContourPlot:
         self.y = y
         self.z = z
 
+    '''Load from TrackTable columns (all rows or only given row numbers)
+    '''
+    def load_table(self, table, rows=None):
+        self.initlists()
+        if rows is None:
+            rows = slice(None)
+        self.x = table.column('x')[rows]
+        self.y = table.column('y')[rows]
+        self.z = table.column('rho')[rows]
+        self.t = table.column('frame')[rows]
+
     def contour_region(self,fname='test'):
         print("Plotting contour plot")
         MAX = 1000000
@@ -8,6 +8,7 @@ import os
 import copy
 import collections
 import numpy as np
+from trackerio import open_input
 import matplotlib
 matplotlib.use("Qt5Agg")
 import matplotlib.backends.backend_qt5agg
@@ -37,11 +38,8 @@ class PlotlyTracker:
     '''Load from a CSV file produced by TrackerApp
     '''
     def load(self,inputfilename):
-        #Open input file
-        if sys.version_info >= (3,0,0):
-            fi = open(inputfilename, 'r', newline='')
-        else:
-            fi = open(inputfilename, 'rb')
+        #Open input file (plain or compressed)
+        fi = open_input(inputfilename)
         self.name = os.path.basename(inputfilename)
         self.initlists()
         with fi as csvfile:
@@ -19,6 +19,11 @@ import scipy.io
 import os
 from tracking import Tracker
 
+# MAT v5 stores the byte size of each variable as uint32 - MATLAB limits a variable to 2GB
+MAT5_MAXBYTES = 2 ** 31 - 1
+# bytes per cell element besides data: matrix tag, array flags, dimensions, name and data tags
+MAT5_CELL_OVERHEAD = 56
+
 class TrackerSPT:
 
     def __init__(self):
@@ -44,6 +49,8 @@ class TrackerSPT:
         self.tracker = Tracker()
         self.fields = dict()
         self.numTraj = 0
+        self.do_compression = True
+        self.maxbytes = MAT5_MAXBYTES
 
     def loadtest(self):
         mydata = scipy.io.loadmat('D:\\Projects\\Meunier_Tracking\\Tracking\\testdata_vbSPT.mat',
@@ -60,57 +67,95 @@ class TrackerSPT:
         #'finalTraj': array([ array([[-247.62617404,   86.06416631,    7.26799504,    1.        ],
 
     """Output to matlab file for use with vbSPT
+       Trajectories larger than the MAT v5 variable limit (maxbytes) are written in chunks
+       to numbered files (eg testrun_001.mat, testrun_002.mat), each a complete vbSPT input
+       Returns list of files written
     """
-    def save_mat(self, fullfilename):
-        # List the parameters
-        if (len(self.trajLengths) > 0):
-            self.fields['finalTraj']=self.createNDarray(self.finalTraj)
-            self.fields['trajLengths']=self.trajLengths
-            self.fields['runs']=self.runs
-            self.fields['do_steadystate']=self.do_steadystate
-            self.fields['do_parallel']=self.do_parallel
-            self.fields['do_single']=self.do_single
-            self.fields['cylL']=self.CylinderL
-            self.fields['cylRadius']=self.Radius
-            self.fields['timestep']=self.timestep
-            self.fields['stepSize']=self.stepSize
-            self.fields['locAccuracy']=self.locAccuracy
-            self.fields['numTraj']=self.numTraj #len(self.trajLengths)
-            self.fields['avTrajLength']=np.mean(self.trajLengths)
-            self.fields['shortestTraj']=min(self.trajLengths)
-            self.fields['longestTraj']=max(self.trajLengths)
-            self.fields['Dapp']=self.Dapp
-            self.fields['occProb']=self.occProb
-            self.fields['transMat']=self.transMat
-            self.fields['transRate']=self.transRate
-            scipy.io.savemat(fullfilename,appendmat=True,mdict=self.fields)
-        else:
+    def save_mat(self, fullfilename, do_compression=None):
+        if do_compression is None:
+            do_compression = self.do_compression
+        if (len(self.trajLengths) <= 0):
             print('Error: No trajectory data to save')
+            return []
+        chunks = self.split_chunks()
+        if len(chunks) == 1:
+            filenames = [fullfilename]
+        else:
+            (base, ext) = os.path.splitext(fullfilename)
+            if ext.lower() != '.mat':
+                (base, ext) = (fullfilename, '.mat')
+            width = max(3, len(str(len(chunks))))
+            filenames = [base + '_' + str(i + 1).zfill(width) + ext for i in range(len(chunks))]
+        for (fname, (start, end)) in zip(filenames, chunks):
+            self.set_fields(start, end)
+            scipy.io.savemat(fname, appendmat=True, mdict=self.fields, do_compression=do_compression)
+        return filenames
+
+    """Parameters and trajectories start:end for matlab output
+    """
+    def set_fields(self, start=0, end=None):
+        if end is None:
+            end = len(self.trajLengths)
+        trajlengths = np.asarray(self.trajLengths[start:end])
+        self.fields['finalTraj'] = self.createNDarray(self.finalTraj[start:end])
+        self.fields['trajLengths'] = trajlengths
+        self.fields['runs'] = self.runs
+        self.fields['do_steadystate'] = self.do_steadystate
+        self.fields['do_parallel'] = self.do_parallel
+        self.fields['do_single'] = self.do_single
+        self.fields['cylL'] = self.CylinderL
+        self.fields['cylRadius'] = self.Radius
+        self.fields['timestep'] = self.timestep
+        self.fields['stepSize'] = self.stepSize
+        self.fields['locAccuracy'] = self.locAccuracy
+        self.fields['numTraj'] = len(trajlengths)
+        self.fields['avTrajLength'] = np.mean(trajlengths)
+        self.fields['shortestTraj'] = trajlengths.min()
+        self.fields['longestTraj'] = trajlengths.max()
+        self.fields['Dapp'] = self.Dapp
+        self.fields['occProb'] = self.occProb
+        self.fields['transMat'] = self.transMat
+        self.fields['transRate'] = self.transRate
 
+    """Ranges (start, end) of trajectories so finalTraj of each range is within maxbytes
+    """
+    def split_chunks(self):
+        sizes = np.asarray(self.trajLengths, dtype=np.int64) * 3 * 8 + MAT5_CELL_OVERHEAD
+        chunks = []
+        start = 0
+        total = 0
+        for (i, size) in enumerate(sizes.tolist()):
+            if total + size > self.maxbytes and i > start:
+                chunks.append((start, i))
+                start = i
+                total = 0
+            total += size
+        chunks.append((start, len(sizes)))
+        return chunks
+
+    """Cell array (1D object array) of trajectories - each stays a numeric (n, 3) matrix
+    """
     def createNDarray(self,trajitems):
-        dtype = object
-        #self.loadtest()
-        nd = np.asanyarray(trajitems)
+        nd = np.empty(len(trajitems), dtype=object)
+        for (i, traj) in enumerate(trajitems):
+            nd[i] = traj
         return nd
 
     """ Load data from Tracker obj
+        Each trajectory is a contiguous (n, 3) float array of x, y, frame
     """
     def load_data(self, tracker):
-        self.finalTraj = []
-        self.trajLengths = []
-        #Load from tracker data
-        plotlist = list(tracker.plotter.items())
-        self.numTraj = len(plotlist)
-        # for each plot
-        tracknum = 0
-        for track in plotlist:
-            tracklist = track[1]
-            trackrow = []
-            for co in tracklist:
-                trackrow.append(np.array([co.x, co.y, co.frame]))
-            self.finalTraj.append(trackrow)
-            self.trajLengths.append(len(tracklist))
-            tracknum = tracknum + 1 #not actual track num track[0]
+        #Load from tracker data (TrackTable)
+        plotter = tracker.plotter
+        data = plotter.data
+        self.numTraj = len(plotter)
+        traj = np.empty((len(data['track']), 3), dtype=np.float64)
+        traj[:, 0] = data['x']
+        traj[:, 1] = data['y']
+        traj[:, 2] = data['frame']
+        # row slices of a C-contiguous array are contiguous views
+        self.finalTraj = np.split(traj, plotter.offsets[1:-1]) if self.numTraj > 0 else []
+        self.trajLengths = np.diff(plotter.offsets)
 
 if __name__ == "__main__":
     import sys
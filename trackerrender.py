@@ -0,0 +1,412 @@
+#!/usr/bin/python3
+"""
+    QBI Meunier Tracker APP: Track plot rendering
+    *******************************************************************************
+    Renders per-track quiver plots to PNG files on the Agg canvas without a GUI
+    backend so plots can be rendered headless in a process pool.
+    Each batch reuses one figure and quiver artist, updating only the data,
+    limits and title per track instead of building and closing a figure.
+    Plots are rendered to in-memory RGBA buffers and PNG encoding and writing is
+    done by a bounded pool of background threads so rendering and I/O overlap.
+    Plots can also be written page by page to one multi-page PDF or zip archive
+    with an index of the page of each track.
+    A thumbnail atlas of all tracks is rasterized directly into one image array
+    (one tile per track) with an index of the track in each tile.
+    Tracks are sent to workers in batches and each worker returns the status of
+    every file it wrote.
+
+    Copyright (C) 2015  QBI Software, The University of Queensland
+
+    This program is free software; you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation; either version 2 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+"""
+import concurrent.futures
+import csv
+import io
+import itertools
+import os
+import threading
+import zipfile
+import numpy as np
+import matplotlib
+from PIL import Image
+import matplotlib.image
+from matplotlib.artist import setp
+from matplotlib.backends.backend_pdf import PdfPages
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+# Tracks per batch sent to a render worker
+RENDER_BATCH_TRACKS = 20
+# Below this number of tracks all plots are rendered in the calling process
+MIN_PARALLEL_TRACKS = 40
+# Threads encoding and writing PNG files per renderer
+WRITER_THREADS = 2
+# Rendered images waiting to be written before rendering blocks
+WRITER_QUEUE = 8
+# Page index of plot archives: page number, track number, PDF page or archive member
+INDEX_FIELDNAMES = ['page', 'track', 'name']
+# Pixels per side of each tile of track atlas
+ATLAS_TILE = 64
+# Atlas index: tile number, grid row and column, pixel origin and size of tile, track number
+ATLAS_FIELDNAMES = ['tile', 'row', 'col', 'x0', 'y0', 'size', 'track']
+# Maximum pixels per side of atlas shown for review
+ATLAS_PREVIEW = 2048
+
+
+def track_filename(outputdir, tracknum):
+    return outputdir + "Track_" + str(tracknum) + ".png"
+
+
+class TrackRenderer:
+    '''Figure and axes reused for the plots of many tracks
+       Only the quiver (replaced per track), limits and title change between tracks so each plot is
+       identical to one drawn on a new figure (as Tracker.plottrack)
+    '''
+    def __init__(self, dpi=300):
+        self.dpi = dpi
+        self.fig = Figure()
+        FigureCanvasAgg(self.fig)
+        self.ax = self.fig.add_subplot()
+        self.ax.set_xlabel('x')
+        self.ax.set_ylabel('y')
+        self.quiver = None
+
+    def plot(self, tracknum, x, y, rho, theta):
+        self.ax.set_title("Track: " + str(tracknum))
+        if self.quiver is not None:
+            self.quiver.remove()
+        # data limits of the new quiver only (as when it is added to new axes)
+        self.ax.ignore_existing_data_limits = True
+        self.quiver = self.ax.quiver(x, y, rho, theta)
+        setp(self.quiver, color='b', antialiased=True)
+
+    def save(self, filename):
+        self.fig.savefig(filename, dpi=self.dpi, orientation='landscape', format='png')
+
+    '''Render at dpi (as save) to a new RGBA array (height, width, 4)
+    '''
+    def rgba(self):
+        buf = io.BytesIO()
+        self.fig.savefig(buf, dpi=self.dpi, orientation='landscape', format='rgba')
+        height = int(self.fig.bbox_inches.height * self.dpi)
+        return np.frombuffer(buf.getbuffer(), dtype=np.uint8).reshape((height, -1, 4))
+
+
+'''Encode RGBA image to PNG file as savefig does
+   compression: zlib level 0 (none, fastest) to 9 (smallest) or None for default (6)
+'''
+def write_png(filename, rgba, dpi=300, compression=None):
+    pil_kwargs = None
+    if compression is not None:
+        pil_kwargs = {'compress_level': int(compression)}
+    matplotlib.image.imsave(filename, rgba, format='png', origin='upper', dpi=dpi, pil_kwargs=pil_kwargs)
+
+
+class PNGWriter:
+    '''Background threads encoding and writing rendered images to PNG files
+       (or members of zip archive if given)
+       submit blocks while queuedepth images are waiting to be written (backpressure)
+    '''
+    def __init__(self, threads=WRITER_THREADS, queuedepth=WRITER_QUEUE, compression=None, archive=None):
+        self.compression = compression
+        self.archive = archive
+        self.lock = threading.Lock()
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=threads)
+        self.slots = threading.BoundedSemaphore(max(1, queuedepth))
+        self.pending = []
+
+    def submit(self, filename, rgba, dpi=300, key=None):
+        self.slots.acquire()
+        try:
+            future = self.executor.submit(self.write, filename, rgba, dpi)
+        except RuntimeError:
+            self.slots.release()
+            raise
+        future.add_done_callback(lambda f: self.slots.release())
+        self.pending.append((key, filename, future))
+
+    def write(self, filename, rgba, dpi=300):
+        try:
+            if self.archive is None:
+                write_png(filename, rgba, dpi, self.compression)
+                msg = "Plot saved to " + filename
+            else:
+                buf = io.BytesIO()
+                write_png(buf, rgba, dpi, self.compression)
+                with self.lock:
+                    self.archive.writestr(filename, buf.getvalue())
+                msg = "Plot saved to " + self.archive.filename + ": " + filename
+        except (IOError, OSError) as e:
+            msg = "ERROR: cannot write plot " + filename + ": " + str(e)
+        return msg
+
+    '''Status of files written so far (in order submitted, up to the first not yet written)
+       Returns [(key, filename, msg)] - these are not returned again by close
+    '''
+    def collect(self):
+        done = 0
+        while done < len(self.pending) and self.pending[done][2].done():
+            done += 1
+        results = [(key, filename, future.result()) for (key, filename, future) in self.pending[:done]]
+        del self.pending[:done]
+        return results
+
+    '''Wait for all files to be written
+       Returns status of each file in order submitted: [(key, filename, msg)]
+    '''
+    def close(self):
+        self.executor.shutdown(wait=True)
+        results = [(key, filename, future.result()) for (key, filename, future) in self.pending]
+        self.pending = []
+        return results
+
+
+'''Quiver plot of a track saved to PNG file (as Tracker.plottrack)
+'''
+def render_track(filename, tracknum, x, y, rho, theta, dpi=300):
+    renderer = TrackRenderer(dpi)
+    renderer.plot(tracknum, x, y, rho, theta)
+    renderer.save(filename)
+
+
+class PlotArchive:
+    '''Plots of many tracks in one file written page by page:
+       multi-page PDF (.pdf) or zip archive (.zip) of Track_<n>.png files
+       The page index is written to <name>_index.csv (and to index.csv in a zip archive)
+       Raises ValueError for any other extension
+    '''
+    def __init__(self, outfilename, dpi=300, compression=None, queuedepth=WRITER_QUEUE):
+        ext = os.path.splitext(outfilename)[1].lower()
+        if ext not in ('.pdf', '.zip'):
+            raise ValueError("Plot archive must be a .pdf or .zip file: " + outfilename)
+        self.outfilename = outfilename
+        self.indexfilename = os.path.splitext(outfilename)[0] + '_index.csv'
+        self.renderer = TrackRenderer(dpi)
+        self.index = []
+        self.status = []
+        self.pdf = None
+        self.archive = None
+        self.writer = None
+        if ext == '.pdf':
+            self.pdf = PdfPages(outfilename)
+        else:
+            # PNG files are already compressed
+            self.archive = zipfile.ZipFile(outfilename, 'w', zipfile.ZIP_STORED, allowZip64=True)
+            self.writer = PNGWriter(queuedepth=queuedepth, compression=compression, archive=self.archive)
+
+    def add(self, tracknum, x, y, rho, theta):
+        self.renderer.plot(tracknum, x, y, rho, theta)
+        page = len(self.index) + 1
+        if self.pdf is not None:
+            name = str(page)
+            self.renderer.fig.savefig(self.pdf, format='pdf', dpi=self.renderer.dpi, orientation='landscape')
+            self.status.append((tracknum, self.outfilename, "Plot saved to " + self.outfilename + ": page " + name))
+        else:
+            name = track_filename('', tracknum)
+            self.writer.submit(name, self.renderer.rgba(), self.renderer.dpi, tracknum)
+        self.index.append({'page': page, 'track': tracknum, 'name': name})
+
+    '''Finish writing archive and index
+       Returns status of each page: [(tracknum, filename, msg)]
+    '''
+    def close(self):
+        if self.pdf is not None:
+            self.pdf.close()
+            self.pdf = None
+        if self.archive is not None:
+            self.status = self.writer.close()
+            buf = io.StringIO(newline='')
+            write_index(buf, self.index)
+            self.archive.writestr('index.csv', buf.getvalue())
+            self.archive.close()
+            self.archive = None
+        with open(self.indexfilename, 'w', newline='') as outfile:
+            write_index(outfile, self.index)
+        return self.status
+
+
+def write_index(outfile, index):
+    writer = csv.DictWriter(outfile, dialect=csv.excel, fieldnames=INDEX_FIELDNAMES)
+    writer.writeheader()
+    writer.writerows(index)
+
+
+'''Read page index of plot archive (see PlotArchive) - Returns list of (page, tracknum, name)
+'''
+def read_index(indexfilename):
+    with open(indexfilename, 'r', newline='') as infile:
+        return [(int(row['page']), int(row['track']), row['name']) for row in csv.DictReader(infile)]
+
+
+'''Render batch of tracks [(tracknum, x, y, rho, theta)] - PNG files are written in the background
+   (see PNGWriter) while the next track is rendered
+   callback(results) is called after each track with the files written since the last call
+   (may be empty) and with the rest once all are written - if it returns True no more tracks are rendered
+   Returns status of each file: [(tracknum, filename, msg)] - msg starts with ERROR if not written
+'''
+def render_batch(outputdir, batch, dpi=300, compression=None, queuedepth=WRITER_QUEUE, callback=None):
+    renderer = TrackRenderer(dpi)
+    writer = PNGWriter(queuedepth=queuedepth, compression=compression)
+    results = []
+    try:
+        for (tracknum, x, y, rho, theta) in batch:
+            renderer.plot(tracknum, x, y, rho, theta)
+            writer.submit(track_filename(outputdir, tracknum), renderer.rgba(), dpi, tracknum)
+            if callback is not None:
+                status = writer.collect()
+                results.extend(status)
+                if callback(status):
+                    break
+    finally:
+        status = writer.close()
+    results.extend(status)
+    if callback is not None and len(status) > 0:
+        callback(status)
+    return results
+
+
+'''Pixels of line segments from (x0, y0) to (x1, y1) (arrays of pixel coordinates)
+   Each segment is sampled at least once per pixel so lines are connected
+   Returns (px, py) integer arrays
+'''
+def rasterize_lines(x0, y0, x1, y1):
+    dx = x1 - x0
+    dy = y1 - y0
+    steps = np.ceil(np.maximum(np.abs(dx), np.abs(dy))).astype(np.int64) + 1
+    seg = np.repeat(np.arange(len(steps)), steps)
+    first = np.cumsum(steps) - steps
+    t = (np.arange(len(seg)) - first[seg]) / np.maximum(steps[seg] - 1, 1)
+    px = np.rint(x0[seg] + t * dx[seg]).astype(np.int64)
+    py = np.rint(y0[seg] + t * dy[seg]).astype(np.int64)
+    return px, py
+
+
+'''Thumbnails of all tracks in one image: track k (rows offsets[k]:offsets[k + 1], in frame order)
+   is drawn in tile k of a grid of cols tiles per row (default square), scaled to fit its tile
+   Returns (image, cols) - image is uint8 grayscale: 255 background, 192 tile borders, 0 tracks
+'''
+def track_atlas(x, y, offsets, tilesize=ATLAS_TILE, cols=0):
+    numtracks = len(offsets) - 1
+    if cols <= 0:
+        cols = max(1, int(np.ceil(np.sqrt(numtracks))))
+    rows = max(1, -(-numtracks // cols))
+    image = np.full((rows * tilesize, cols * tilesize), 255, dtype=np.uint8)
+    image[::tilesize, :] = 192
+    image[:, ::tilesize] = 192
+    if numtracks == 0:
+        return image, cols
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    starts = np.asarray(offsets[:-1], dtype=np.int64)
+    lengths = np.diff(offsets)
+    pos = np.repeat(np.arange(numtracks), lengths)
+    xmin = np.minimum.reduceat(x, starts)
+    xmax = np.maximum.reduceat(x, starts)
+    ymin = np.minimum.reduceat(y, starts)
+    ymax = np.maximum.reduceat(y, starts)
+    span = np.maximum(xmax - xmin, ymax - ymin)
+    span[span <= 0] = 1
+    # same scale for x and y, track centred in tile with a margin of 2 pixels
+    scale = (tilesize - 5) / span
+    tx = (x - (xmin + xmax)[pos] / 2) * scale[pos] + (pos % cols) * tilesize + tilesize / 2
+    ty = ((ymin + ymax)[pos] / 2 - y) * scale[pos] + (pos // cols) * tilesize + tilesize / 2
+    # segments between consecutive points of each track (a single point is a segment to itself)
+    nxt = np.arange(1, len(x) + 1)
+    nxt[offsets[1:] - 1] = offsets[1:] - 1
+    last = np.zeros(len(x), dtype=bool)
+    last[offsets[1:] - 1] = True
+    keep = ~last | (lengths[pos] == 1)
+    (px, py) = rasterize_lines(tx[keep], ty[keep], tx[nxt[keep]], ty[nxt[keep]])
+    image[py, px] = 0
+    return image, cols
+
+
+'''Write atlas image (see track_atlas) to PNG file and index of the track in each tile
+   to <name>_index.csv - Returns index filename
+'''
+def save_atlas(outfilename, image, tracknums, cols, tilesize=ATLAS_TILE):
+    # 8-bit grayscale as is (no colormapped RGBA copy of the image)
+    Image.fromarray(image, 'L').save(outfilename, format='PNG')
+    indexfilename = os.path.splitext(outfilename)[0] + '_index.csv'
+    with open(indexfilename, 'w', newline='') as outfile:
+        writer = csv.writer(outfile, dialect=csv.excel)
+        writer.writerow(ATLAS_FIELDNAMES)
+        for (tile, tracknum) in enumerate(tracknums):
+            (row, col) = divmod(tile, cols)
+            writer.writerow([tile, row, col, col * tilesize, row * tilesize, tilesize, tracknum])
+    return indexfilename
+
+
+'''Downsampled atlas (see track_atlas) for display: minimum of each block of step x step pixels
+   so track lines are kept. Returns (preview, step) - preview pixel (i, j) covers image pixels
+   from (i * step, j * step)
+'''
+def atlas_preview(image, maxsize=ATLAS_PREVIEW):
+    step = max(1, -(-max(image.shape) // maxsize))
+    if step == 1:
+        return image, step
+    blocks = np.minimum.reduceat(image, np.arange(0, image.shape[0], step), axis=0)
+    return np.minimum.reduceat(blocks, np.arange(0, image.shape[1], step), axis=1), step
+
+
+'''Read atlas index (see save_atlas) - Returns (tilesize, dict of (row, col): tracknum)
+'''
+def read_atlas_index(indexfilename):
+    tilesize = ATLAS_TILE
+    tiles = dict()
+    with open(indexfilename, 'r', newline='') as infile:
+        for row in csv.DictReader(infile):
+            tilesize = int(row['size'])
+            tiles[(int(row['row']), int(row['col']))] = int(row['track'])
+    return tilesize, tiles
+
+
+'''Track number at pixel (px, py) of atlas or None if not on a tile
+'''
+def atlas_track(atlasindex, px, py):
+    (tilesize, tiles) = atlasindex
+    if px < 0 or py < 0:
+        return None
+    return tiles.get((int(py) // tilesize, int(px) // tilesize))
+
+
+def _init_worker():
+    # workers only render to Agg canvases - never start a GUI backend
+    matplotlib.use('Agg')
+
+
+'''Render batches of tracks (see render_batch) in a process pool (workers=None for number of CPUs)
+   callback(results) is called in the calling process as each batch completes - if it returns True
+   remaining batches are cancelled. Without a pool all tracks are rendered in one pass with
+   callback called after each track (see render_batch)
+   compression: PNG zlib level (0-9, None for default), queuedepth: images waiting per writer
+   Returns status of each file written
+'''
+def render_batches(outputdir, batches, workers=None, dpi=300, callback=None, compression=None,
+                   queuedepth=WRITER_QUEUE):
+    if workers is None:
+        workers = os.cpu_count() or 1
+    numtracks = sum([len(batch) for batch in batches])
+    results = []
+    if (workers <= 1 or len(batches) < 2 or numtracks < MIN_PARALLEL_TRACKS):
+        return render_batch(outputdir, itertools.chain.from_iterable(batches), dpi, compression, queuedepth,
+                            callback)
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as executor:
+        futures = [executor.submit(render_batch, outputdir, batch, dpi, compression, queuedepth)
+                   for batch in batches]
+        for future in concurrent.futures.as_completed(futures):
+            status = future.result()
+            results.extend(status)
+            if callback is not None and callback(status):
+                for f in futures:
+                    f.cancel()
+                break
+    return results
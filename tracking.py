@@ -28,6 +28,11 @@ __version__ = 1.0
 
 import csv
 import argparse
+import itertools
+import glob
+import json
+import time
+import concurrent.futures
 import sys
 import inspect
 import os
@@ -36,8 +41,21 @@ import numpy as np
 import matplotlib
 matplotlib.use("Qt5Agg")
 import matplotlib.pyplot as plt
-from shapely.geometry import Polygon, Point
+from shapely.geometry import Polygon
+try:
+    from shapely import contains_xy
+except ImportError:
+    from shapely.vectorized import contains as contains_xy
 from trackerplots.contourplot import ContourPlot
+from trackercache import ParseCache
+from trackerio import open_input, is_compressed, strip_compression, INPUT_PATTERNS, is_binary, \
+    save_binary as write_binary, load_binary
+from tracktable import TrackTable, Coord, CoordGroups, track_offsets, grid_keys, average_groups, \
+    polar
+from trackermsd import msd_fft, msd_gaps, msd_batch, index_pairs, msd_stats, fit_msd, bootstrap_msd, long_rows, \
+    matrix_rows, MSDTable, LONG_FIELDNAMES
+from trackerrender import render_batches, PlotArchive, track_atlas, atlas_preview, \
+    RENDER_BATCH_TRACKS, WRITER_QUEUE, ATLAS_TILE, save_atlas as write_atlas
 from scipy import stats
 
 
@@ -62,84 +80,81 @@ def file_check(fn):
         return 0
 
 
-class Coord:
-    def __init__(self, track=0, frame=0, xcoord=0, ycoord=0, intensity=0):
-        self.track = track
-        self.frame = frame
-        self.x = xcoord
-        self.y = ycoord
-        self.dx = 0
-        self.dy = 0
-        self.rho = 0
-        self.theta = 0
-        self.intensity = intensity
-        self.framecount = 1
-        self.msd = 0
-        self.gradient = 0
-        self.sd = 0
-
-    def load(self, dx, dy, rho, theta, framecount):
-        self.dx = dx
-        self.dy = dy
-        self.rho = rho
-        self.theta = theta
-        self.framecount = framecount
-        if (self.dx > 0):
-            self.gradient = self.dy / self.dx
-
-        #self.sd = self.dx ** 2 + self.dy ** 2
-
-    ''' Determines if x,y coordinates have changed
-        Args: (x,y) and (x1,y1) - 2 sets of coordinates
-               f - number of decimal places for rounding coord values (default is 1)
-        Returns 1 if changed (moved) or 0 if not changed
-       '''
-
-    def has_moved(self):
-        if ((self.x, self.y) == (0, 0) or (self.xcache, self.ycache) == (0, 0)):
-            return 0
-        elif ((round(self.x, self.numdecimal), round(self.y, self.numdecimal)) ==
-                  (round(self.xcache, self.numdecimal), round(self.ycache, self.numdecimal))):
-            return 0
-        else:
-            return 1
-
-    '''Returns compiled row to output
-       fieldnames must match fieldnames in Tracker
-       '''
-
-    def get_rowoutput(self, numdecimal):
-        myx = self.x
-        myy = self.y
-
-        row = {'Track': str(self.track),
-               'Frame': str(self.frame),
-               'x': myx, 'y': myy,
-               'roundx': round(myx, numdecimal),
-               'roundy': round(myy, numdecimal),
-               'dx': self.dx,
-               'dy': self.dy,
-               'rho': self.rho,  # getpolar_rho(self.dx,self.dy),
-               'theta': self.theta,  # getpolar_theta(self.dy,self.dx),
-               'intensity': self.intensity,
-               'framecount': str(self.framecount),
-               #'sd': self.sd
-               }
-        return row
-
-    def set_first(self):
-        if self.framecount > 1:
-            self.first = self.frame - self.framecount + 1
+class InputProbe:
+    '''Detects delimiter, header and column positions of an input file in a single read
+       Shared by Tracker.checkinputheaders and Tracker.load_input
+       valid: 0 if not valid, 1 if valid with headers, 2 valid but no headers
+    '''
+    def __init__(self, inputfilename, inputheaders, samplesize=1024):
+        self.filename = inputfilename
+        self.inputheaders = inputheaders
+        self.samplesize = samplesize
+        self.hasheader = False
+        self.delimiter = ','
+        self.quotechar = '"'
+        self.fieldnames = []
+        # column positions by name (default order if no headers)
+        self.columns = {'track': 0, 'frame': 1, 'x': 2, 'y': 3, 'intensity': 5}
+        self.valid = 0
+        self.probe()
+
+    def probe(self):
+        # Open input file (plain or compressed)
+        fi = open_input(self.filename)
+        with fi as csvfile:
+            sample = csvfile.read(self.samplesize)
+        if len(sample) == 0:
+            return self.valid
+        try:
+            dialect = csv.Sniffer().sniff(sample)
+            self.delimiter = dialect.delimiter
+            self.quotechar = dialect.quotechar
+            self.hasheader = csv.Sniffer().has_header(sample)
+        except csv.Error:
+            print("DEBUG: Unable to detect delimiter - using ", self.delimiter)
+        rows = csv.reader(sample.splitlines(), delimiter=self.delimiter, quotechar=self.quotechar)
+        rows = [row for row in rows if len(row) > 0]
+        if len(rows) == 0:
+            return self.valid
+        if self.hasheader:
+            print("DEBUG: CSV file has headers")
+            self.fieldnames = rows[0]
+            self.valid = self.map_columns(self.fieldnames)
         else:
-            self.first = ''
+            print("DEBUG: Delimiter = ", self.delimiter)
+            self.valid = self.check_row(rows[0])
+        return self.valid
 
-    def getpolar_rho(self, x, y):
-        rho = np.sqrt(x ** 2 + y ** 2)
-        return rho
+    '''Map column positions by header name (in order of Tracker.inputheaders)
+       Returns 1 if all input headers found else 0
+    '''
+    def map_columns(self, fieldnames):
+        headers = [f.strip().lower() for f in fieldnames]
+        names = ['track', 'frame', 'x', 'y', 'intensity']
+        for (name, hdr) in zip(names, self.inputheaders):
+            if hdr.lower() not in headers:
+                return 0
+            self.columns[name] = headers.index(hdr.lower())
+        return 1
+
+    '''Check first row of data without headers
+       Returns 2 if valid (positive track, frame, x, y, intensity) else 0
+    '''
+    def check_row(self, row):
+        print("DEBUG: Row[0]=", row[0])
+        try:
+            if (int(row[self.columns['track']]) > 0 and
+                        int(row[self.columns['frame']]) > 0 and
+                        float(row[self.columns['x']]) > 0 and
+                        float(row[self.columns['y']]) > 0 and
+                        float(row[self.columns['intensity']]) > 0):
+                return 2
+        except (ValueError, IndexError):
+            pass
+        return 0
 
-    def getpolar_theta(self, x, y):
-        theta = np.arctan2(y, x)
-        return theta
+    def get_usecols(self):
+        return [self.columns[name] for name in ['track', 'frame', 'x', 'y', 'intensity']]
 
 
 class Tracker:
@@ -149,10 +164,22 @@ class Tracker:
         self.ln = 0
         self.cache = 0
         self.numdecimal = 1
-        self.coordlist = dict()
-        self.plotter = dict()  # Store coords by track number for individual plots
-        self.avgplotter = dict()  # Store averaged coords by track number for full plot
-        self.msd = collections.OrderedDict() #dict()
+        self.table = TrackTable()  # All filtered coords as loaded
+        self.coordgroups = np.zeros(0, dtype=np.int64)  # Rounded coords group of each row in table
+        self.coordfirst = np.zeros(0, dtype=np.int64)  # First row in table of each rounded coords group
+        self.plotter = self.table  # Store coords by track number for individual plots
+        self.avgplotter = TrackTable()  # Store averaged coords by track number for full plot
+        self.msd = MSDTable()  # MSD and number of pairs per track and time interval (track -> {interval: msd})
+        self.gaps = False  # MSD intervals by frame difference (gap-aware) instead of point index
+        self.msdtracks = np.zeros(0, dtype=np.int64)  # track numbers of msdmatrix columns
+        self.msdmatrix = np.zeros((0, 0))  # MSD per time interval (row) and track (column) from msd
+        self.npairs = np.zeros((0, 0), dtype=np.int64)  # number of pairs for msdmatrix
+        self.msdfits = None  # per-track fit results (see fit_tracks)
+        self.bootstrap = 0  # number of bootstrap resamples for averaged MSD confidence intervals (0 for none)
+        self.confidence = 95  # bootstrap confidence level (%)
+        self.msdboot = None  # bootstrap results (see get_avgmsd_ci)
+        self.msdfile = None  # file for streamed long format MSD output (see open_msdstream)
+        self.msdstream = None  # csv writer of streamed MSD rows
         self.fieldnames = ['Track', 'Frame', 'x', 'y', 'roundx', 'roundy',
                            'dx', 'dy', 'rho', 'theta', 'intensity', 'framecount']
         self.inputheaders = ['TRACK NUMBER', 'frame number', 'x', 'y', 'intensity']
@@ -161,7 +188,21 @@ class Tracker:
         self.toplot = 0
         self.init_allplots()
         self.roilist = []
+        self.bufsize = 1024 * 1024  # output file buffer (bytes) for bulk writes
+        self.plotcompression = None  # PNG zlib level of rendered plots (0-9, None for default)
+        self.plotqueue = WRITER_QUEUE  # rendered plots waiting to be written before rendering blocks
         self.framerate = 1
+        self.maxintervals = 0  # maximum MSD interval calculated on load (0 for all)
+        self.workers = 1  # processes for MSD calculation on load (None for number of CPUs)
+        self.columntypes = [('track', np.int64), ('frame', np.int64), ('x', np.float64),
+                            ('y', np.float64), ('intensity', np.float64)]
+        self.parsecache = None  # ParseCache for parsed input columns (optional)
+        self.probe = None  # InputProbe of current input file
+        self.followpos = 0  # bytes read from input in follow mode
+        self.followtracks = dict()  # rows per track read in follow mode
+        self.followrank = dict()  # order of first appearance of tracks in follow mode
+        self.numtracks = 0  # tracks processed by stream_input (also if msd is not kept)
+        self.atlaspreview = None  # (image, step) downsampled from last saved atlas (see save_atlas)
 
     def init_allplots(self):
         # for all tracks
@@ -186,35 +227,76 @@ class Tracker:
     Spatial displacement: pos at given t from initial pos
     MSD =<(x(t) - x0)^2>
     numintervals = use only set number of intervals or 0 for all
+    If gaps is set, intervals are frame differences (missing frames are not counted as intervals)
     '''
     def calculate_msd(self, plot, numintervals=0):
         # ptrack = self.getPlotByIndex(self.plotter,tracknum)
         ptracknum = plot[0]
         ptracklist = plot[1]
+        frame = np.array([co.frame for co in ptracklist])
+        x = np.array([co.x for co in ptracklist], dtype=np.float64)
+        y = np.array([co.y for co in ptracklist], dtype=np.float64)
+        self.calculate_track_msd(ptracknum, frame, x, y, numintervals)
 
+    '''Calculate MSD for a track from column arrays (see calculate_msd)
+    '''
+    def calculate_track_msd(self, ptracknum, frame, x, y, numintervals=0):
         # Sort by timeframe
-        if (len(ptracklist) > 0):
-            tracklist = sorted(ptracklist, key=lambda t: t.frame)
+        order = np.argsort(frame, kind='stable')
+        if (self.gaps):
+            msd, npairs = msd_gaps(frame[order], x[order], y[order], numintervals)
         else:
-            tracklist = ptracklist
-        msdlist = dict()  # hashlist of msd per time interval
-        ln = len(tracklist)
-        #compare with each coord for each time interval : 1T, 2T 3T
-        for i in range(1, ln - 1):
-            sd = 0
-            ctr = 0
-            for j in range(0, ln - i):
-                c1 = tracklist[j+i]
-                c2 = tracklist[j]
-                sd = sd + (c1.x - c2.x) ** 2 + (c1.y - c2.y) ** 2
-                ctr = ctr + 1
-            if (ctr > 0):
-                t = round(i * self.framerate,2)
-                msdlist.update({i : (sd / ctr)})
-
-
-        # save updated list
-        self.msd.update({ptracknum: msdlist})
+            msd = msd_fft(x[order], y[order], numintervals)
+            npairs = index_pairs(len(x), len(msd))
+        # save msd (and number of pairs) per time interval
+        self.msd.set_track(ptracknum, msd, npairs)
+        if self.msdstream is not None:
+            self.msdstream.writerows(long_rows(ptracknum, msd, npairs, self.framerate))
+
+    '''Calculate MSD for all tracks in table (rows of each track sorted by frame)
+       Tracks are split into shards calculated by self.workers processes (1 for none)
+       keep: add to msd (else only written to the MSD stream if open)
+    '''
+    def calculate_all_msd(self, table, numintervals=0, keep=True):
+        frame = table.column('frame') if self.gaps else None
+        callback = None
+        if self.msdstream is not None:
+            callback = lambda start, results: self.stream_msd_shard(table, start, results)
+        msds = msd_batch(table.column('x'), table.column('y'), table.offsets, numintervals, self.workers,
+                         frame=frame, callback=callback)
+        if keep:
+            self.msd.set_tracks(table.tracknums, msds)
+
+    '''Write long format MSD rows for a shard of tracks as it is calculated (see open_msdstream)
+    '''
+    def stream_msd_shard(self, table, start, results):
+        tracknums = table.tracknums[start:start + len(results)].tolist()
+        for (tracknum, (msd, npairs)) in zip(tracknums, results):
+            self.msdstream.writerows(long_rows(tracknum, msd, npairs, self.framerate))
+
+    '''Stream MSD in long format (track, lag, dt, msd, npairs) to file while tracks are calculated
+       by load_input or stream_input - call close_msdstream when done
+    '''
+    def open_msdstream(self, outfilename):
+        try:
+            if sys.version_info >= (3, 0, 0):
+                fo = open(outfilename, 'w', newline='', buffering=self.bufsize)
+            else:
+                fo = open(outfilename, 'wb')
+        except IOError:
+            msg = "ERROR: cannot access output file (maybe open in another program): " + outfilename
+            return msg
+        self.msdfile = fo
+        self.msdstream = csv.writer(fo, delimiter=',', dialect=csv.excel)
+        self.msdstream.writerow(LONG_FIELDNAMES)
+        msg = "Streaming MSD to " + outfilename
+        return msg
+
+    def close_msdstream(self):
+        if self.msdfile is not None:
+            self.msdfile.close()
+        self.msdfile = None
+        self.msdstream = None
 
     def get_headers(self):
         # return keys Coord.getrowoutput(0)
@@ -237,159 +319,372 @@ class Tracker:
     '''
 
     def checkinputheaders(self, inputfilename):
-        valid = 1
-        # Open input file
-        if sys.version_info >= (3, 0, 0):
-            fi = open(inputfilename, 'r', newline='')
-        else:
-            fi = open(inputfilename, 'rb')
-        with fi as csvfile:
-            if (csv.Sniffer().has_header(csvfile.read(1024))):
-                print("DEBUG: CSV file has headers")
-                csvfile.seek(0)
-                inputreader = csv.DictReader(csvfile)
-                for hdr in self.inputheaders:
-                    if hdr not in inputreader.fieldnames:
-                        valid = 0
-                        break
-            else:
-                csvfile.seek(0)
-                dialect = csv.Sniffer().sniff(csvfile.read(1024))
-                print("DEBUG: Delimiter = ", dialect.delimiter)
-                csvfile.seek(0)
-                reader = csv.reader(csvfile, dialect=dialect)
-                for row in reader:
-                    print("DEBUG: Row[0]=", row[0])
-                    if (int(row[0]) > 0 and
-                                int(row[1]) > 0 and
-                                float(row[2]) > 0 and
-                                float(row[3]) > 0 and
-                                float(row[5]) > 0):
-                        valid = 2
-                        break
-                    else:
-                        valid = 0
-                        break
-
-        return valid
+        probe = self.probe_input(inputfilename)
+        return probe.valid
+
+    '''Probe input file for delimiter, headers and columns (once per file)
+    '''
+    def probe_input(self, inputfilename):
+        if self.probe is None or self.probe.filename != inputfilename:
+            self.probe = InputProbe(inputfilename, self.inputheaders)
+        return self.probe
 
     def load_input(self, inputfilename, minpoints=0, minlength=0.00, maxlength=100.00):
-        # Open input file
-        if sys.version_info >= (3, 0, 0):
-            fi = open(inputfilename, 'r', newline='')
-        else:
-            fi = open(inputfilename, 'rb')
+        cols = self.read_columns(inputfilename)
+        self.load_columns(cols, minpoints, minlength, maxlength)
 
-        with fi as csvfile:
-            hasheader = csv.Sniffer().has_header(csvfile.read(1024))
-            csvfile.seek(0)
-            dialect = csv.Sniffer().sniff(csvfile.read(1024))
-            csvfile.seek(0)
-            fh = csv.reader(csvfile, dialect)
-            tracklist = dict()
-            for row in fh:
-                self.ln = fh.line_num
-                # print("Row " , fh.line_num)
-                if (len(row) == 0 or (self.ln == 1 and hasheader)):
-                    continue
-                # Change in x,y wrt next row:  x(t+1) - x(t)
-                # coord = Coord(int(row['TRACK NUMBER']),
-                #        int(row['frame number']),
-                #        float(row['x']),float(row['y']),
-                #        float(row['intensity']) )
-                coord = Coord(int(row[0]),
-                              int(row[1]),
-                              float(row[2]), float(row[3]),
-                              float(row[5]))
-
-                if (self.track != coord.track):
-                    print("TRACK:" + str(self.track))
-                    # self.track = int(row['TRACK NUMBER'])
-                    self.track = int(row[0])
-                    # load to list for filtering
-                    tracklist.update({self.track: []})
-                else:
-                    self.cache.dx = coord.x - self.cache.x
-                    self.cache.dy = coord.y - self.cache.y
-                    tracklist[self.track].append(self.cache)
-                self.set_cache(coord)
-
-            # Filter tracklist then save by coord indexed list
-            for track in tracklist:
-                tracks = sorted(tracklist[track], key=lambda t: t.frame)
-                first = tracks[0]
-                last = tracks[-1]
-                tracklength = np.sqrt((last.x - first.x) ** 2 + (last.y - first.y) ** 2)
-                if (len(tracks) >= minpoints and tracklength >= minlength and tracklength <= maxlength):
-                    for co in tracks:
-                        roundx = round(co.x, self.numdecimal)
-                        roundy = round(co.y, self.numdecimal)
-
-                        if (roundx, roundy) in self.coordlist:
-                            co.framecount += 1
-                        else:
-                            self.coordlist.update({(roundx, roundy): []})
-                        # load derived values
-                        # load(self, dx,dy,rho,theta,framecount):
-                        co.load(co.dx, co.dy, co.getpolar_rho(co.dx, co.dy), co.getpolar_theta(co.dx, co.dy),
-                                co.framecount)
-                        self.coordlist[(roundx, roundy)].append(co)
-                        self.counter += 1
-                        # Add all filtered coords to plotter list (for Averaged coords - avgplotter)
-                        self.addto_plotter(self.plotter, co)
-
-            # Update plots with msd for full track
-            for p in self.plotter.items():
-                self.calculate_msd(p)
-
-    def addto_plotter(self, plotter, co):
-        if (co.track not in plotter):
-            plotter.update({co.track: []})
-        plotter[co.track].append(co)
+    '''Reads track, frame, x, y and intensity columns into numpy arrays in one pass
+       Returns dict of arrays keyed by column name (empty arrays if no data)
+    '''
+    def read_columns(self, inputfilename):
+        cols = None
+        if self.parsecache is not None:
+            cols = self.parsecache.load(inputfilename)
+        if cols is None:
+            csvfile, probe = self.open_rows(inputfilename)
+            with csvfile:
+                cols = self.parse_rows(csvfile, probe)
+            if self.parsecache is not None:
+                self.parsecache.save(inputfilename, cols)
+        self.ln = len(cols['track'])
+        print("DEBUG: Rows read =", self.ln)
+        return cols
+
+    '''Opens input file, skipping header row if present (uses probe from checkinputheaders)
+       Returns open file (positioned at first data row) and InputProbe
+    '''
+    def open_rows(self, inputfilename):
+        probe = self.probe_input(inputfilename)
+        # Open input file (plain or compressed)
+        csvfile = open_input(inputfilename)
+        if probe.hasheader:
+            csvfile.readline()
+        return csvfile, probe
+
+    '''Parses rows (open file or list of lines) into dict of column arrays
+    '''
+    def parse_rows(self, lines, probe):
+        data = np.loadtxt(lines, delimiter=probe.delimiter, quotechar=probe.quotechar,
+                          usecols=probe.get_usecols(), dtype=self.columntypes, ndmin=1)
+        cols = dict()
+        for name, dtype in self.columntypes:
+            cols[name] = np.ascontiguousarray(data[name])
+        return cols
+
+    '''Groups rows by track (tracks kept in order of first appearance) and sorts by frame
+       with a single lexsort, then derives dx, dy wrt next frame: x(t+1) - x(t).
+       The last point of each track has no next frame and is dropped.
+       Returns dict of arrays (sorted rows with derived values)
+    '''
+    def group_tracks(self, cols):
+        track = cols['track']
+        uniq, first, inv = np.unique(track, return_index=True, return_inverse=True)
+        order = np.lexsort((cols['frame'], first[inv.ravel()]))
+        rows = dict()
+        for name in cols:
+            rows[name] = cols[name][order]
+        # keep rows followed by another row of the same track
+        keep = np.zeros(len(track), dtype=bool)
+        keep[:-1] = rows['track'][1:] == rows['track'][:-1]
+        return self.derive_rows(rows, keep)
+
+    '''Derive dx, dy, rho, theta for sorted rows and keep only masked rows
+    '''
+    def derive_rows(self, rows, keep):
+        dx = np.zeros(len(keep))
+        dy = np.zeros(len(keep))
+        dx[:-1] = np.diff(rows['x'])
+        dy[:-1] = np.diff(rows['y'])
+        derived = dict()
+        for name in rows:
+            derived[name] = rows[name][keep]
+        derived['dx'] = dx[keep]
+        derived['dy'] = dy[keep]
+        (derived['rho'], derived['theta']) = polar(derived['dx'], derived['dy'])
+        return derived
+
+    '''Filters tracks by number of points and length (first to last point)
+       Returns boolean mask of rows to keep
+    '''
+    def filter_tracks(self, derived, minpoints=0, minlength=0.00, maxlength=100.00):
+        if len(derived['track']) == 0:
+            return np.zeros(0, dtype=bool)
+        offsets = track_offsets(derived['track'])
+        first = offsets[:-1]
+        last = offsets[1:] - 1
+        x = derived['x']
+        y = derived['y']
+        tracklength = np.sqrt((x[last] - x[first]) ** 2 + (y[last] - y[first]) ** 2)
+        counts = np.diff(offsets)
+        passed = (counts >= minpoints) & (tracklength >= minlength) & (tracklength <= maxlength)
+        return np.repeat(passed, counts)
+
+    '''Framecount per row: 1 for first point at a rounded coordinate, 2 if already seen
+       Returns framecounts, rounded x, rounded y
+    '''
+    def count_frames(self, x, y):
+        groups, first = grid_keys(x, y, self.numdecimal)
+        framecount = np.full(len(x), 2, dtype=np.int64)
+        framecount[first] = 1
+        return framecount, groups, first
+
+    '''Load derived rows into table (plotter) and rounded coords groups, then calculate MSD per track
+    '''
+    def load_columns(self, cols, minpoints=0, minlength=0.00, maxlength=100.00):
+        derived = self.group_tracks(cols)
+        mask = self.filter_tracks(derived, minpoints, minlength, maxlength)
+        for name in derived:
+            derived[name] = derived[name][mask]
+        framecount, self.coordgroups, self.coordfirst = self.count_frames(derived['x'], derived['y'])
+        derived['framecount'] = framecount
+        self.table = TrackTable(derived)
+        self.plotter = self.table
+        self.counter += self.table.numrows()
+
+        # Update plots with msd for full track
+        self.calculate_all_msd(self.plotter, self.maxintervals)
+
+    '''Reads input in chunks of rows and yields column arrays of the finished tracks in each chunk.
+       Rows of a track must be contiguous (as exported by Metamorph): the last track
+       of each chunk is carried over to the next chunk until a new track starts.
+       If the input is in the parse cache, chunks are read from the mapped arrays.
+    '''
+    def iter_trackchunks(self, inputfilename, chunksize=100000):
+        carry = None
+        for cols in self.iter_chunks(inputfilename, chunksize):
+            self.ln += len(cols['track'])
+            if carry is not None:
+                for name in cols:
+                    cols[name] = np.concatenate((carry[name], cols[name]))
+            offsets = track_offsets(cols['track'])
+            if len(offsets) > 2:
+                yield self.slice_rows(cols, 0, offsets[-2])
+            if len(offsets) > 1:
+                carry = self.slice_rows(cols, offsets[-2], offsets[-1])
+        if carry is not None:
+            yield carry
+
+    '''Yields dict of column arrays per chunk of rows
+    '''
+    def iter_chunks(self, inputfilename, chunksize=100000):
+        cached = None
+        if self.parsecache is not None:
+            cached = self.parsecache.load(inputfilename)
+        if cached is not None:
+            total = len(cached['track'])
+            for start in range(0, total, chunksize):
+                yield self.slice_rows(cached, start, min(start + chunksize, total))
+            return
+        csvfile, probe = self.open_rows(inputfilename)
+        with csvfile:
+            while True:
+                lines = list(itertools.islice(csvfile, chunksize))
+                if len(lines) == 0:
+                    break
+                yield self.parse_rows(lines, probe)
+
+    def slice_rows(self, cols, start, end):
+        rows = dict()
+        for name in cols:
+            rows[name] = cols[name][start:end].copy()
+        return rows
+
+    '''Streaming alternative to load_input + write_output for very large files.
+       The finished tracks of each chunk are filtered, their MSD calculated (up to maxintervals) and
+       their points added to running totals per rounded coordinate (CoordGroups), so the table and
+       plotter are never held in memory. Output is written once all tracks are read.
+       keepmsd: keep MSD table (for wide layout, fits or bootstrap) - else MSD is only written
+       to the MSD stream (see open_msdstream) as each chunk is calculated
+       Memory: chunk + longest track + one entry per rounded coordinate (+ MSD table if kept)
+    '''
+    def stream_input(self, inputfilename, outfilename, minpoints=0, minlength=0.00, maxlength=100.00,
+                     chunksize=100000, maxintervals=10, keepmsd=True):
+        self.ln = 0
+        self.numtracks = 0
+        groups = CoordGroups(self.numdecimal)
+        for cols in self.iter_trackchunks(inputfilename, chunksize):
+            derived = self.group_tracks(cols)
+            mask = self.filter_tracks(derived, minpoints, minlength, maxlength)
+            if not mask.any():
+                continue
+            for name in derived:
+                derived[name] = derived[name][mask]
+            derived['framecount'] = groups.add(derived)
+            table = TrackTable(derived)
+            self.counter += table.numrows()
+            self.numtracks += len(table)
+            self.calculate_all_msd(table, maxintervals, keepmsd)
+        print("DEBUG: Rows read =", self.ln)
+        try:
+            fo = open(outfilename, 'w', newline='', buffering=self.bufsize)
+        except IOError:
+            msg = "ERROR: cannot access output file (maybe open in another program): " + outfilename
+            return msg
+        with fo as outfile:
+            self.write_rows(outfile, groups.average())
+
+        msg = "Completed"
+        return msg
+
+    '''Follow input file while acquisition is still writing it.
+       Polls every interval seconds for appended rows and updates plotter and msd
+       for the tracks which received new frames (see update_input).
+       callback(tracker, changed) is called after each update with new rows.
+       Stops after idle seconds without new rows (0 = until interrupted)
+    '''
+    def follow_input(self, inputfilename, minpoints=0, minlength=0.00, maxlength=100.00,
+                     interval=1.0, idle=0, callback=None):
+        if is_compressed(inputfilename):
+            print("Error: Cannot follow compressed input file:", inputfilename)
+            return 0
+        self.followpos = 0
+        self.followtracks = dict()
+        self.followrank = dict()
+        self.plotter = TrackTable()
+        lastupdate = time.time()
+        try:
+            while True:
+                changed = self.update_input(inputfilename, minpoints, minlength, maxlength)
+                if changed is not None:
+                    lastupdate = time.time()
+                    if callback is not None:
+                        callback(self, changed)
+                elif (idle > 0 and time.time() - lastupdate > idle):
+                    break
+                time.sleep(interval)
+        except KeyboardInterrupt:
+            print("Follow stopped")
+        return len(self.plotter)
+
+    '''Read complete rows appended since last update (partial last line is left for next time)
+       Only tracks with new frames are re-derived, filtered and have their MSD recalculated and
+       are updated in place in plotter (tracks kept in order of first appearance).
+       Note: rounded coords groups are not maintained - load_input the completed file for write_output
+       Returns list of changed track numbers or None if no new rows
+    '''
+    def update_input(self, inputfilename, minpoints=0, minlength=0.00, maxlength=100.00):
+        with open(inputfilename, 'rb') as fi:
+            fi.seek(self.followpos)
+            data = fi.read()
+        end = data.rfind(b'\n') + 1
+        if end == 0:
+            return None
+        if self.followpos == 0:
+            # probe once file has data
+            self.probe = None
+            probe = self.probe_input(inputfilename)
+        else:
+            probe = self.probe
+        lines = data[:end].decode('utf-8').splitlines()
+        if self.followpos == 0 and probe.hasheader:
+            lines = lines[1:]
+        self.followpos += end
+        lines = [line for line in lines if len(line.strip()) > 0]
+        if len(lines) == 0:
+            return None
+        cols = self.parse_rows(lines, probe)
+        self.ln += len(lines)
+        # group new rows per track (in order of first appearance) and append to rows read so far
+        order = np.argsort(cols['track'], kind='stable')
+        for name in cols:
+            cols[name] = cols[name][order]
+        offsets = track_offsets(cols['track'])
+        changed = []
+        updates = dict()
+        for i in np.argsort(order[offsets[:-1]], kind='stable').tolist():
+            rows = self.slice_rows(cols, offsets[i], offsets[i + 1])
+            tracknum = int(rows['track'][0])
+            if tracknum in self.followtracks:
+                previous = self.followtracks[tracknum]
+                for name in rows:
+                    rows[name] = np.concatenate((previous[name], rows[name]))
+            else:
+                self.followrank[tracknum] = len(self.followrank)
+            self.followtracks[tracknum] = rows
+            updates[tracknum] = self.update_track(tracknum, rows, minpoints, minlength, maxlength)
+            changed.append(tracknum)
+        self.plotter.update_tracks(updates, self.followrank)
+        self.counter = self.plotter.numrows()
+        return changed
+
+    '''Re-derive a single track and update its msd
+       Returns derived rows (for plotter) or None if the track is filtered out
+    '''
+    def update_track(self, tracknum, rows, minpoints=0, minlength=0.00, maxlength=100.00):
+        derived = self.group_tracks(rows)
+        mask = self.filter_tracks(derived, minpoints, minlength, maxlength)
+        if not mask.any():
+            if tracknum in self.msd:
+                self.msd = self.msd.exclude([tracknum])
+            return None
+        framecount, groups, first = self.count_frames(derived['x'], derived['y'])
+        derived['framecount'] = framecount
+        self.calculate_track_msd(tracknum, derived['frame'], derived['x'], derived['y'], self.maxintervals)
+        return derived
+
+    '''Average coords of table with the same rounded coords (in order of first appearance)
+       Coords of a group take track, x and y of the first row with frame, intensity, dx and dy
+       averaged and rho, theta recalculated from averaged dx, dy. Single coords are unchanged.
+       Returns dict of columns (as TrackTable.columns, frame as float)
+    '''
+    def aggregate_coords(self):
+        data = self.table.data
+        groups = self.coordgroups
+        first = self.coordfirst
+        numgroups = len(first)
+        counts = np.bincount(groups, minlength=numgroups)
+        firstcols = dict()
+        for name in ['track', 'frame', 'x', 'y', 'dx', 'dy', 'rho', 'theta', 'intensity', 'framecount']:
+            firstcols[name] = data[name][first]
+        sums = dict()
+        if (counts > 1).any():
+            # sums in row order (as sum of list)
+            for name in ['frame', 'intensity', 'dx', 'dy']:
+                sums[name] = np.bincount(groups, weights=data[name].astype(np.float64), minlength=numgroups)
+        return average_groups(firstcols, counts, sums)
+
+    '''Write columns (as TrackTable.columns) as output rows in the format of Coord.get_rowoutput
+       Rows are formatted in blocks of chunksize and written with writerows
+       rows: row numbers to write (default all)
+       Frame is written as int unless averaged (float frame with framecount > 1)
+    '''
+    def write_rows(self, outfile, cols, rows=None, chunksize=100000):
+        writer = csv.writer(outfile, delimiter=',', dialect=csv.excel)
+        writer.writerow(self.get_headers())
+        if rows is None:
+            rows = np.arange(len(cols['track']))
+        nd = self.numdecimal
+        for start in range(0, len(rows), chunksize):
+            block = rows[start:start + chunksize]
+            values = dict()
+            for name in ['track', 'x', 'y', 'dx', 'dy', 'rho', 'theta', 'intensity', 'framecount']:
+                values[name] = cols[name][block].tolist()
+            frame = cols['frame'][block]
+            if np.issubdtype(frame.dtype, np.integer):
+                frames = frame.tolist()
+            else:
+                averaged = (cols['framecount'][block] > 1).tolist()
+                frames = [f if avg else int(f) for (f, avg) in zip(frame.tolist(), averaged)]
+            writer.writerows(zip(values['track'], frames, values['x'], values['y'],
+                                 [round(v, nd) for v in values['x']], [round(v, nd) for v in values['y']],
+                                 values['dx'], values['dy'], values['rho'], values['theta'],
+                                 values['intensity'], values['framecount']))
 
     def write_output(self, outfilename):
         msg = "Starting output..."
         try:
             if sys.version_info >= (3, 0, 0):
-                fo = open(outfilename, 'w', newline='')
+                fo = open(outfilename, 'w', newline='', buffering=self.bufsize)
             else:
                 fo = open(outfilename, 'wb')
         except IOError:
             msg = "ERROR: cannot access output file (maybe open in another program): " + outfilename
             return msg
+        avgcols = self.aggregate_coords()
         with fo as outfile:
-            fieldnames = self.get_headers()
-            writer = csv.DictWriter(outfile, delimiter=',', dialect=csv.excel, fieldnames=fieldnames)
-            writer.writeheader()
-
-            for co in self.coordlist:
-
-                if (len(self.coordlist[co]) > 1):
-                    avg_dx = []
-                    avg_dy = []
-                    avg_intensity = []
-                    avg_frame = []
-                    co1 = self.coordlist[co][0]
-
-                    for avgco in self.coordlist[co]:
-                        # All coords averaged VS per track
-                        avg_dx.append(avgco.dx)
-                        avg_dy.append(avgco.dy)
-                        avg_frame.append(avgco.frame)
-                        avg_intensity.append(avgco.intensity)
-                    myco = Coord(co1.track, self.avg(avg_frame), co1.x, co1.y, self.avg(avg_intensity))
-                    myco.dx = self.avg(avg_dx)
-                    myco.dy = self.avg(avg_dy)
-                    myco.load(myco.dx, myco.dy,
-                              myco.getpolar_rho(myco.dx, myco.dy),
-                              myco.getpolar_theta(myco.dx, myco.dy),
-                              len(self.coordlist[co]))
-                else:
-                    myco = self.coordlist[co][0]
-
-                writer.writerow(myco.get_rowoutput(self.numdecimal))
-                # group by tracknum for averaging
-                self.addto_plotter(self.avgplotter, myco)
+            self.write_rows(outfile, avgcols)
+        # group by tracknum for averaging
+        self.avgplotter = TrackTable.group(avgcols)
 
         msg = "Completed"
         return msg
@@ -399,40 +694,77 @@ class Tracker:
     def save_data(self, outfilename, excluded=[]):
         msg = "Saving data ..."
         ctr = 0;
-        newplotter = dict()
         try:
             if sys.version_info >= (3, 0, 0):
-                fo = open(outfilename, 'w', newline='')
+                fo = open(outfilename, 'w', newline='', buffering=self.bufsize)
             else:
                 fo = open(outfilename, 'wb')
         except IOError:
             msg = "ERROR: cannot access output file (maybe open in another program): " + outfilename
             return msg
         with fo as outfile:
-            fieldnames = self.get_headers()
-            writer = csv.DictWriter(outfile, delimiter=',', dialect=csv.excel, fieldnames=fieldnames)
-            writer.writeheader()
-            plotlist = list(self.plotter.items())
             # for each plot
-            for track in plotlist:
-                tracknum = track[0]
-                tracklist = track[1]
-                if (tracknum not in excluded):
-                    ctr = ctr + 1
-                    newplotter.update({tracknum: tracklist})
-                    for co in tracklist:
-                        writer.writerow(co.get_rowoutput(self.numdecimal))
-        self.plotter = newplotter
+            saved = self.plotter.exclude(excluded)
+            ctr = len(saved)
+            self.write_rows(outfile, saved.data)
+        self.plotter = saved
         msg = str(ctr) + " tracks written to " + outfilename
         return msg, ctr
 
     """ Output MSD per time interval per track for max intervals
     Format: 'dT'. 'track1' 'track2' ...
     """
-    def save_msd(self, outfilename, excluded=[],maxintervals=10, framerate=1):
+    def save_msd(self, outfilename, excluded=[],maxintervals=10, framerate=1, showplot=True, layout='wide'):
+        if (layout == 'long'):
+            msg = self.save_msd_long(outfilename, excluded, maxintervals, framerate)
+            if (showplot and len(self.msd) > 0):
+                self.generate_avgmsd(excluded, maxintervals, framerate)
+            return msg
         msg = "Saving data ..."
-        fieldnames,msdlist = self._generate_msdlist(excluded,maxintervals,framerate)
-        plotlist = list(self.msd.items())
+        fieldnames, dt = self.generate_msdmatrix(excluded, maxintervals, framerate)
+        try:
+            if sys.version_info >= (3, 0, 0):
+                fo = open(outfilename, 'w', newline='')
+            else:
+                fo = open(outfilename, 'wb')
+        except IOError:
+            msg = "ERROR: cannot access output file (maybe open in another program): " + outfilename
+            return msg
+
+        with fo as outfile:
+            writer = csv.writer(outfile, delimiter=',', dialect=csv.excel)
+            # Gap-aware: total number of pairs per interval in last column
+            if (self.gaps):
+                fieldnames = fieldnames + ['npairs']
+            writer.writerow(fieldnames)
+            # Row per time interval: dT, msd per track (0 if not calculated)
+            totalpairs = self.npairs.sum(axis=1).tolist()
+            for (t, row, n) in zip(dt, self.msdmatrix.tolist(), totalpairs):
+                row = [t] + [v if v == v else 0 for v in row]
+                if (self.gaps):
+                    row.append(n)
+                writer.writerow(row)
+
+        if (showplot):
+            self.show_avg_msd(*self.get_avgmsd(dt), ci=self.get_avgmsd_ci(dt))
+
+        msg = "MSD plots written to " + outfilename
+        return msg
+
+    '''Fit D (with optional offset) and anomalous exponent alpha for each track in one vectorized solve
+       Returns dict of arrays per track (Track, nlags, D, offset, r2, alpha, Dalpha) - also set as msdfits
+    '''
+    def fit_tracks(self, excluded=[], maxintervals=10, framerate=1, offset=True):
+        fieldnames, dt = self.generate_msdmatrix(excluded, maxintervals, framerate)
+        fits = collections.OrderedDict([('Track', self.msdtracks)])
+        fits.update(fit_msd(dt, self.msdmatrix, offset))
+        self.msdfits = fits
+        return fits
+
+    '''Write per-track fit results (see fit_tracks) to file - no plots are shown
+    '''
+    def save_fits(self, outfilename, excluded=[], maxintervals=10, framerate=1, offset=True):
+        fits = self.fit_tracks(excluded, maxintervals, framerate, offset)
         try:
             if sys.version_info >= (3, 0, 0):
                 fo = open(outfilename, 'w', newline='')
@@ -443,106 +775,224 @@ class Tracker:
             return msg
 
         with fo as outfile:
+            fieldnames = list(fits.keys())
             writer = csv.DictWriter(outfile, delimiter=',', dialect=csv.excel, fieldnames=fieldnames)
             writer.writeheader()
-            y = []
-            se = []
-            x = []
-            #Syntax: writer.writerow({'dT': k,'track' + str(tracknum): v})
-            for rownum in range(1, maxintervals + 1):
-                row ={}
-                for colnum in range(len(plotlist) + 1):
-                    if msdlist[0][colnum]:
-                        row[msdlist[0][colnum]]= msdlist[rownum][colnum]
-                writer.writerow(row)
-                #Averaged per time interval
-                y.append(np.mean(msdlist[rownum][1:-1]))
-                se.append(np.std(msdlist[rownum][1:-1])/np.sqrt(len(msdlist[rownum][1:-1])))
-                x.append(msdlist[rownum][0])
+            columns = [fits[name].tolist() for name in fieldnames]
+            for values in zip(*columns):
+                # no fit (too few intervals) written as empty
+                writer.writerow(dict(zip(fieldnames, [v if v == v else '' for v in values])))
 
-        self.show_avg_msd(x,y,se)
+        msg = "MSD fits for " + str(len(self.msdtracks)) + " tracks written to " + outfilename
+        return msg
+
+    '''Output MSD in long format: row per track and time interval (track, lag, dt, msd, npairs)
+       Rows are written from msd in blocks of chunksize tracks
+    '''
+    def save_msd_long(self, outfilename, excluded=[], maxintervals=10, framerate=1, chunksize=10000):
+        self.exclude_msd(excluded)
+        try:
+            if sys.version_info >= (3, 0, 0):
+                fo = open(outfilename, 'w', newline='', buffering=self.bufsize)
+            else:
+                fo = open(outfilename, 'wb')
+        except IOError:
+            msg = "ERROR: cannot access output file (maybe open in another program): " + outfilename
+            return msg
+
+        with fo as outfile:
+            writer = csv.writer(outfile, delimiter=',', dialect=csv.excel)
+            writer.writerow(LONG_FIELDNAMES)
+            tracknums = self.msd.tracknums
+            msd = self.msd.msd[:, :maxintervals]
+            npairs = self.msd.npairs[:, :maxintervals]
+            for start in range(0, len(tracknums), chunksize):
+                end = start + chunksize
+                writer.writerows(matrix_rows(tracknums[start:end], msd[start:end], npairs[start:end], framerate))
 
         msg = "MSD plots written to " + outfilename
         return msg
 
     def generate_avgmsd(self,excluded, maxintervals=10,framerate=1):
-        fieldnames,msdlist = self._generate_msdlist(excluded, maxintervals,framerate)
-        if (len(msdlist) > 0):
-            y = []
-            se = []
-            x = []
-            for rownum in range(1, maxintervals + 1):
-                #Averaged per time interval
-                y.append(np.mean(msdlist[rownum][1:-1]))
-                se.append(np.std(msdlist[rownum][1:-1])/np.sqrt(len(msdlist[rownum][1:-1])))
-                x.append(msdlist[rownum][0])
-            self.show_avg_msd(x,y,se)
-
-    def _generate_msdlist(self,excluded=[],max=10, framerate=1):
-        ctr = 0;
-        newplotter = dict()
-        fieldnames = ['dT']
-        plotlist = list(self.msd.items())
-        numcols = self.find_max_tracknum(plotlist)
-        #initialise & organise data
-        msdlist = [[0 for x in range(numcols+ 1)] for x in range(max + 1)]
-        msdlist[0][0] = 'dT'
-        for track in plotlist:
-            tracknum = track[0]
-            tracklist = track[1]
-            if (tracknum not in excluded):
-                newplotter.update({tracknum: tracklist})
-                fieldnames.append('track' + str(tracknum))
-                msdlist[0][tracknum] = 'track' + str(tracknum)
-                ctr = ctr + 1
-                for m in tracklist.items():
-                    dt = int(m[0])
-                    if (dt <= max):
-                        msdlist[dt][0] = dt * framerate
-                        msdlist[dt][tracknum] = m[1]
-        self.msd = newplotter # non-excluded plots
-        return fieldnames,msdlist
-
-    def find_max_tracknum(self,plotlist):
-        tracknums = []
-        for track in plotlist:
-            tracknums.append(track[0])
-        return max(tracknums)
+        fieldnames, dt = self.generate_msdmatrix(excluded, maxintervals, framerate)
+        if (len(self.msdtracks) > 0):
+            self.show_avg_msd(*self.get_avgmsd(dt), ci=self.get_avgmsd_ci(dt))
+
+    '''Bootstrap confidence intervals (self.bootstrap resamples of tracks) for averaged MSD and slope
+       Returns dict of results (see bootstrap_msd) - also set as msdboot - or None if bootstrap not set
+    '''
+    def get_avgmsd_ci(self, dt):
+        if (self.bootstrap <= 0 or len(self.msdtracks) == 0):
+            return None
+        self.msdboot = bootstrap_msd(dt, self.msdmatrix, self.bootstrap, self.confidence, self.workers)
+        return self.msdboot
+
+    '''Write averaged MSD per time interval with standard error and bootstrap confidence interval
+       Last row is the slope of the averaged MSD
+    '''
+    def save_avgmsd(self, outfilename, excluded=[], maxintervals=10, framerate=1):
+        fieldnames, dt = self.generate_msdmatrix(excluded, maxintervals, framerate)
+        mean, se, count = msd_stats(self.msdmatrix)
+        boot = self.get_avgmsd_ci(dt)
+        try:
+            if sys.version_info >= (3, 0, 0):
+                fo = open(outfilename, 'w', newline='')
+            else:
+                fo = open(outfilename, 'wb')
+        except IOError:
+            msg = "ERROR: cannot access output file (maybe open in another program): " + outfilename
+            return msg
+
+        with fo as outfile:
+            fieldnames = ['dT', 'msd', 'se', 'ntracks', 'ci_lower', 'ci_upper']
+            writer = csv.DictWriter(outfile, delimiter=',', dialect=csv.excel, fieldnames=fieldnames)
+            writer.writeheader()
+            for i in np.flatnonzero(count > 0).tolist():
+                row = {'dT': dt[i], 'msd': mean[i].item(), 'se': se[i].item(), 'ntracks': count[i].item()}
+                if boot is not None:
+                    row['ci_lower'] = boot['lower'][i].item()
+                    row['ci_upper'] = boot['upper'][i].item()
+                writer.writerow(row)
+            x, y, se = self.get_avgmsd(dt)
+            if (len(x) > 1):
+                slope, intercept, r_value, p_value, std_err = stats.linregress(x, y)
+                row = {'dT': 'slope', 'msd': slope, 'se': std_err, 'ntracks': len(self.msdtracks)}
+                if boot is not None:
+                    row['ci_lower'] = float(boot['slope_lower'])
+                    row['ci_upper'] = float(boot['slope_upper'])
+                writer.writerow(row)
 
+        msg = "Averaged MSD written to " + outfilename
+        return msg
+
+    '''Averaged MSD per time interval over tracks in MSD matrix (intervals without values are skipped)
+       Returns x (dT), y (mean), se (standard error)
+    '''
+    def get_avgmsd(self, dt):
+        mean, se, count = msd_stats(self.msdmatrix)
+        valid = count > 0
+        return np.asarray(dt)[valid].tolist(), mean[valid].tolist(), se[valid].tolist()
+
+    '''Remove excluded tracks from msd
+    '''
+    def exclude_msd(self, excluded=[]):
+        if (len(excluded) > 0):
+            self.msd = self.msd.exclude(excluded) # non-excluded plots
+
+    '''Generate MSD matrix (intervals x tracks) for tracks not excluded, up to max intervals
+       Sets msdtracks (track numbers of columns), msdmatrix, npairs (pairs per interval and track)
+       from msd (non-excluded tracks only)
+       Returns fieldnames for output and dT per interval
+    '''
+    def generate_msdmatrix(self, excluded=[], max=10, framerate=1):
+        self.exclude_msd(excluded)
+        self.msdtracks, msd, npairs = self.msd.matrix(max)
+        # contiguous per interval so sums over tracks are in the same order as when built per interval
+        self.msdmatrix = np.ascontiguousarray(msd.T)
+        self.npairs = npairs.T
+        fieldnames = ['dT'] + ['track' + str(tracknum) for tracknum in self.msdtracks.tolist()]
+        dt = [i * framerate for i in range(1, max + 1)]
+        return fieldnames, dt
 
     """ Show MSD plots averaged
-       Requires msdlist from generate_msdlist
+       Requires x, y, se from get_avgmsd
+       ci: bootstrap results from get_avgmsd_ci (shown as shaded band) or None
        """
-    def show_avg_msd(self,x=[],y=[],se=[]):
+    def show_avg_msd(self,x=[],y=[],se=[],ci=None):
 
         slope, intercept, r_value, p_value, std_err = stats.linregress(x,y)
         fig = plt.figure()
         plt.xlim(min(x) - min(x), max(x) + min(x))
         plt.xlabel('dT')
         plt.ylabel('MSD (um2)')
-        plt.title('Avg MSD (slope=' + str(round(slope,4)) + ' +/- ' + str(round(std_err,4)) + ')')
+        title = 'Avg MSD (slope=' + str(round(slope,4)) + ' +/- ' + str(round(std_err,4))
+        if ci is not None:
+            valid = ~np.isnan(ci['mean'])
+            plt.fill_between(x, ci['lower'][valid], ci['upper'][valid], color='r', alpha=0.2)
+            title += ', ' + str(self.confidence) + '% CI ' + str(round(float(ci['slope_lower']),4)) + \
+                     ' to ' + str(round(float(ci['slope_upper']),4))
+        plt.title(title + ')')
         plt.errorbar(x, y, se, linestyle='-', color='r',marker='o')
         plt.show(block=True)
 
+    '''Write processed coords (avgplotter by default) with track offsets, MSD matrix and run parameters
+       to a binary file (.npz or .h5 if h5py is installed) which load_plotdata reopens memory-mapped
+    '''
+    def save_binary(self, outfilename, table=None):
+        if table is None:
+            table = self.avgplotter
+        arrays = collections.OrderedDict()
+        for name in table.data:
+            arrays[name] = table.data[name]
+        arrays['offsets'] = table.offsets
+        arrays['tracknums'] = table.tracknums
+        arrays['msdtracks'] = self.msd.tracknums
+        arrays['msd'] = self.msd.msd
+        arrays['npairs'] = self.msd.npairs
+        params = {'input': self.probe.filename if self.probe is not None else '',
+                  'numdecimal': self.numdecimal,
+                  'framerate': self.framerate,
+                  'maxintervals': self.maxintervals,
+                  'gaps': self.gaps,
+                  'points': int(self.counter),
+                  'fieldnames': self.fieldnames}
+        try:
+            write_binary(outfilename, arrays, params)
+        except (IOError, ImportError) as e:
+            msg = "ERROR: cannot write binary output file: " + outfilename + " (" + str(e) + ")"
+            return msg
+        msg = "Binary output written to " + outfilename
+        return msg
+
+    '''Reopen binary file from save_binary: columns are memory-mapped and MSD table restored
+    '''
+    def load_binarydata(self, inputfilename):
+        arrays, params = load_binary(inputfilename)
+        data = dict()
+        for (name, dtype) in TrackTable.columns:
+            if name in arrays:
+                data[name] = arrays[name]
+        self.plotter = TrackTable(data)
+        self.numdecimal = params.get('numdecimal', self.numdecimal)
+        self.framerate = params.get('framerate', self.framerate)
+        self.gaps = params.get('gaps', self.gaps)
+        # copied so tracks can be updated
+        self.msd = MSDTable(np.array(arrays['msdtracks']), np.array(arrays['msd']), np.array(arrays['npairs']))
+        return params
+
     def load_plotdata(self, inputfilename):
-        # Open input file
-        if sys.version_info >= (3, 0, 0):
-            fi = open(inputfilename, 'r', newline='')
-        else:
-            fi = open(inputfilename, 'rb')
-        # clear plotter
-        self.plotter = dict()
+        if is_binary(inputfilename):
+            self.load_binarydata(inputfilename)
+            return
+        # Open input file (plain or compressed)
+        fi = open_input(inputfilename)
+        cols = collections.OrderedDict()
+        for (name, dtype) in TrackTable.columns:
+            cols[name] = []
         with fi as csvfile:
             reader = csv.DictReader(csvfile)
             for row in reader:
-                coord = Coord(int(row['Track']),
-                              int(row['Frame']),
-                              float(row['x']), float(row['y']),
-                              float(row['intensity']))
-                coord.load(float(row['dx']), float(row['dy']),
-                           float(row['rho']), float(row['theta']),
-                           int(row['framecount']))
-                self.addto_plotter(self.plotter, coord)
+                cols['track'].append(int(row['Track']))
+                cols['frame'].append(int(row['Frame']))
+                for name in ['x', 'y', 'dx', 'dy', 'rho', 'theta', 'intensity']:
+                    cols[name].append(float(row[name]))
+                cols['framecount'].append(int(row['framecount']))
+        # replace plotter
+        self.plotter = TrackTable.group(cols)
+
+    '''Quiver plot data for a track: x, y, rho, theta arrays (optionally sorted by frame)
+    '''
+    def get_quiverdata(self, plotter, traknum, sort=True):
+        rows = plotter.track(traknum)
+        if sort:
+            order = np.argsort(rows['frame'], kind='stable')
+        else:
+            order = slice(None)
+        dx = rows['dx'][order]
+        dy = rows['dy'][order]
+        rho = np.sqrt(dx ** 2 + dy ** 2)
+        theta = np.arctan2(dy, dx)
+        return rows['x'][order], rows['y'][order], rho, theta
 
     '''Plot quiver plots with averaged coordinate data
     '''
@@ -553,28 +1003,18 @@ class Tracker:
 
             # create a plot of a track
             plotdir = self.outputdir
-            x = []
-            y = []
-            rho = []
-            theta = []
             mytitle = "Track: " + str(traknum)
             print(mytitle)
             msg = mytitle
             # sort track frames
-            tracklist = sorted(self.avgplotter[traknum], key=lambda t: t.frame)
-
-            for tn in tracklist:
-                x.append(tn.x)
-                y.append(tn.y)
-                rho.append(tn.getpolar_rho(tn.dx, tn.dy))
-                theta.append(tn.getpolar_theta(tn.dx, tn.dy))
+            x, y, rho, theta = self.get_quiverdata(self.avgplotter, traknum)
             print("Points:", len(x))
             # Total plots if option set to show later
             if (totalplots > 0):
-                self.allx += x
-                self.ally += y
-                self.allrho += rho
-                self.alltheta += theta
+                self.allx += x.tolist()
+                self.ally += y.tolist()
+                self.allrho += rho.tolist()
+                self.alltheta += theta.tolist()
                 self.alltracks += 1
             if (png):
                 fig = plt.figure(traknum)
@@ -596,6 +1036,94 @@ class Tracker:
         print(msg)
         return msg
 
+    '''Quiver plot data of tracks at positions (plot indices) of avgplotter in batches of
+       (tracknum, x, y, rho, theta) - adds to all tracks plot if totalplots set
+    '''
+    def plot_batches(self, positions, totalplots=0, batchsize=RENDER_BATCH_TRACKS):
+        batches = []
+        batch = []
+        for idx in positions:
+            if idx < 0 or idx >= len(self.avgplotter):
+                continue
+            traknum = self.avgplotter.get_tracknum(idx)
+            x, y, rho, theta = self.get_quiverdata(self.avgplotter, traknum)
+            if (totalplots > 0):
+                self.allx += x.tolist()
+                self.ally += y.tolist()
+                self.allrho += rho.tolist()
+                self.alltheta += theta.tolist()
+                self.alltracks += 1
+            batch.append((traknum, x, y, rho, theta))
+            if len(batch) >= batchsize:
+                batches.append(batch)
+                batch = []
+        if len(batch) > 0:
+            batches.append(batch)
+        return batches
+
+    '''Render quiver plots (as plottrack) of tracks at positions of avgplotter in a process pool
+       callback(results) is called as plots are written (return True to stop) - see render_batches
+       Returns status of each plot: [(tracknum, filename, msg)]
+    '''
+    def render_plots(self, positions, totalplots=0, png=1, workers=None, callback=None):
+        batches = self.plot_batches(positions, totalplots)
+        if (not png):
+            return []
+        return render_batches(self.outputdir, batches, workers, callback=callback,
+                              compression=self.plotcompression, queuedepth=self.plotqueue)
+
+    '''Write quiver plots of tracks fromplot to toplot (plot indices of avgplotter, all if toplot not set)
+       page by page to one multi-page PDF (.pdf) or zip archive of PNG files (.zip) - see PlotArchive
+       callback(results) is called after each batch of pages (return True to stop)
+       Returns status of each plot: [(tracknum, filename, msg)]
+    '''
+    def export_plots(self, outfilename, totalplots=0, callback=None):
+        start = int(self.fromplot)
+        end = int(self.toplot)
+        if end <= start:
+            end = len(self.avgplotter)
+        batches = self.plot_batches(range(max(start, 0), end), totalplots)
+        try:
+            archive = PlotArchive(outfilename, compression=self.plotcompression, queuedepth=self.plotqueue)
+        except ValueError as e:
+            msg = "ERROR: " + str(e)
+            print(msg)
+            return [(None, outfilename, msg)]
+        except IOError:
+            msg = "ERROR: cannot access output file (maybe open in another program): " + outfilename
+            print(msg)
+            return [(None, outfilename, msg)]
+        try:
+            for batch in batches:
+                for (traknum, x, y, rho, theta) in batch:
+                    archive.add(traknum, x, y, rho, theta)
+                status = [(item[0], outfilename, "Plot added to " + outfilename) for item in batch]
+                if callback is not None and callback(status):
+                    break
+        finally:
+            results = archive.close()
+        print("Plots of", len(archive.index), "tracks saved to", outfilename, "- page index:", archive.indexfilename)
+        return results
+
+    '''Thumbnail atlas of all tracks in plotter (one tile per track in plotter order) saved to PNG file
+       with index of the track in each tile (<name>_index.csv) - see trackerrender.track_atlas
+    '''
+    def save_atlas(self, outfilename, tilesize=ATLAS_TILE):
+        plotter = self.plotter
+        data = plotter.data
+        # frame order within each track
+        pos = np.repeat(np.arange(len(plotter)), np.diff(plotter.offsets))
+        order = np.lexsort((data['frame'], pos))
+        image, cols = track_atlas(data['x'][order], data['y'][order], plotter.offsets, tilesize)
+        try:
+            indexfilename = write_atlas(outfilename, image, plotter.tracknums.tolist(), cols, tilesize)
+        except IOError:
+            msg = "ERROR: cannot access output file (maybe open in another program): " + outfilename
+            return msg
+        self.atlaspreview = atlas_preview(image)
+        msg = "Atlas of " + str(len(plotter)) + " tracks saved to " + outfilename + " (index: " + indexfilename + ")"
+        return msg
+
     def create_plots(self):
         # Check input
         plotdir = self.outputdir
@@ -616,18 +1144,10 @@ class Tracker:
         counter = 0
         for trak in self.avgplotter:
             # for each track
-            x = []
-            y = []
-            rho = []
-            theta = []
             if (counter >= start and counter < end):
                 mytitle = "Track: " + str(trak)
                 print(mytitle)
-                for tn in self.avgplotter[trak]:
-                    x.append(tn.x)
-                    y.append(tn.y)
-                    rho.append(tn.getpolar_rho(tn.dx, tn.dy))
-                    theta.append(tn.getpolar_theta(tn.dx, tn.dy))
+                x, y, rho, theta = self.get_quiverdata(self.avgplotter, trak, sort=False)
                 print("Points:", len(x))
                 fig = plt.figure(trak)
                 lines = plt.quiver(x, y, rho, theta)
@@ -647,10 +1167,10 @@ class Tracker:
                 plt.clf()
                 plt.close()
                 # ADD ALL TRACKS TO ONE
-                allx += x
-                ally += y
-                allrho += rho
-                alltheta += theta
+                allx += x.tolist()
+                ally += y.tolist()
+                allrho += rho.tolist()
+                alltheta += theta.tolist()
                 alltracks += 1
             counter += 1
         # Print all
@@ -673,17 +1193,17 @@ class Tracker:
 
     def plot_region(self, mlpoly):
         poly = Polygon(mlpoly)
-        # reset coords
-        self.roilist = []
         tplot = ContourPlot()
+        # reset coords: rows of table grouped by rounded coords
+        inside = contains_xy(poly, self.table.data['x'], self.table.data['y'])
+        order = np.argsort(self.coordgroups, kind='stable')
+        self.roilist = order[inside[order]].tolist()
 
         sname = '1'
-        for co in self.coordlist:
-            for myco in self.coordlist[co]:
-                if poly.contains(Point(myco.x, myco.y)):
-                    sname = str(int(myco.x)) + '_' + str(int(myco.y))
-                    self.roilist.append(myco)
-                    tplot.loadrow(myco.x, myco.y, myco.rho, myco.frame)
+        if len(self.roilist) > 0:
+            last = self.roilist[-1]
+            sname = str(int(self.table.data['x'][last])) + '_' + str(int(self.table.data['y'][last]))
+        tplot.load_table(self.table, self.roilist)
         msg = 'Total ROI points=' + str(len(self.roilist))
         print(msg)
         fname = self.outputdir + 'ROI_' + sname + '.csv'
@@ -695,33 +1215,189 @@ class Tracker:
         msg = "Starting ROI output..."
         try:
             if sys.version_info >= (3, 0, 0):
-                fo = open(outfilename, 'w', newline='')
+                fo = open(outfilename, 'w', newline='', buffering=self.bufsize)
             else:
                 fo = open(outfilename, 'wb')
         except IOError:
             msg = "ERROR: cannot access output file (maybe open in another program): " + outfilename
             return msg
         with fo as outfile:
-            fieldnames = self.get_headers()
-            writer = csv.DictWriter(outfile, delimiter=',', dialect=csv.excel, fieldnames=fieldnames)
-            writer.writeheader()
-            for myco in self.roilist:
-                writer.writerow(myco.get_rowoutput(self.numdecimal))
+            self.write_rows(outfile, self.table.data, np.asarray(self.roilist, dtype=np.int64))
         msg = 'ROI coordinates written to ' + outfilename
         print(msg)
         return msg
 
     def getPlotByIndex(self, plotter, idx):
-        plotlist = list(plotter.items())
-        if idx >= len(plotlist):
+        if idx < 0 or idx >= len(plotter):
             print('Error: idx not in range -', idx)
             ptrack = None
         else:
-            ptrack = plotlist[idx]
-            ptracknum = ptrack[0]
+            ptracknum = plotter.get_tracknum(idx)
+            ptrack = (ptracknum, plotter[ptracknum])
 
         return ptrack
 
+    '''Convert plot indices (positions in plotter) to track numbers
+    '''
+    def getTracksByIndex(self, plotter, idxlist):
+        idxlist = [idx for idx in idxlist if 0 <= idx < len(plotter)]
+        return plotter.get_tracknums(idxlist)
+
+
+# Files written by run_batch (not input files when the output directory is the input directory)
+OUTPUT_SUFFIXES = ('_processed.csv', '_msd.csv', '_fits.csv', '_avgmsd.csv', 'batch_summary.csv')
+
+
+'''Find input files from directory (all .csv, .trc and compressed .csv files) or glob pattern
+   Output files of a previous batch (see OUTPUT_SUFFIXES) are left out
+'''
+def find_inputfiles(pattern):
+    if os.path.isdir(pattern):
+        inputfiles = []
+        for ext in INPUT_PATTERNS:
+            inputfiles += glob.glob(os.path.join(pattern, ext))
+    else:
+        inputfiles = glob.glob(pattern)
+    return sorted([f for f in inputfiles if not strip_compression(f).endswith(OUTPUT_SUFFIXES)])
+
+
+'''Process one input file to output CSV and MSD CSV (run in worker process for batch)
+   params: dict with input, output, msdoutput and tracker settings
+   Returns summary dict with row counts, track counts and timings
+'''
+def process_trackfile(params):
+    summary = collections.OrderedDict()
+    summary['input'] = params['input']
+    summary['output'] = params['output']
+    summary['msdoutput'] = params['msdoutput']
+    summary['status'] = 'ERROR'
+    summary['rows'] = 0
+    summary['points'] = 0
+    summary['tracks'] = 0
+    summary['load_time'] = 0
+    summary['output_time'] = 0
+    summary['msd_time'] = 0
+    summary['fit_time'] = 0
+    summary['total_time'] = 0
+    summary['message'] = ''
+    start = time.time()
+    tracker = None
+    try:
+        tracker = Tracker()
+        tracker.numdecimal = params.get('numdecimal', 1)
+        tracker.framerate = params.get('framerate', 1)
+        tracker.gaps = params.get('gaps', False)
+        if params.get('cachedir') is not None:
+            tracker.parsecache = ParseCache(params['cachedir'], params.get('cachesize', 1024))
+        if (not tracker.checkinputheaders(params['input'])):
+            summary['message'] = "CSV Input file headers not matching"
+            return summary
+        minpoints = params.get('minpoints', 0)
+        minlength = params.get('minlength', 0.00)
+        maxlength = params.get('maxlength', 100.00)
+        maxintervals = params.get('maxintervals', 10)
+        # long format MSD is streamed while tracks are calculated
+        longmsd = params.get('msdlayout', 'long') == 'long'
+        if longmsd:
+            tracker.open_msdstream(params['msdoutput'])
+        t = time.time()
+        if params.get('stream', False):
+            if params.get('binaryoutput') is not None:
+                raise ValueError("Binary output is not available in stream mode (processed rows are not kept)")
+            # MSD table only kept if needed after the input is read
+            keepmsd = (not longmsd) or params.get('fitoutput') is not None or params.get('bootstrap', 0) > 0
+            msg = tracker.stream_input(params['input'], params['output'], minpoints, minlength, maxlength,
+                                       params.get('chunksize', 100000), maxintervals, keepmsd)
+            summary['load_time'] = round(time.time() - t, 3)
+            summary['tracks'] = tracker.numtracks
+        else:
+            tracker.maxintervals = maxintervals
+            tracker.load_input(params['input'], minpoints, minlength, maxlength)
+            summary['load_time'] = round(time.time() - t, 3)
+            t = time.time()
+            msg = tracker.write_output(params['output'])
+            if ("Completed" in msg) and params.get('binaryoutput') is not None:
+                binarymsg = tracker.save_binary(params['binaryoutput'])
+                if binarymsg.startswith("ERROR"):
+                    msg = binarymsg
+            summary['output_time'] = round(time.time() - t, 3)
+            summary['tracks'] = len(tracker.msd)
+        summary['rows'] = tracker.ln
+        summary['points'] = tracker.counter
+        summary['message'] = msg
+        if longmsd:
+            tracker.close_msdstream()
+        if ("Completed" in msg) and summary['tracks'] > 0:
+            t = time.time()
+            if longmsd:
+                summary['message'] = "MSD plots written to " + params['msdoutput']
+            else:
+                summary['message'] = tracker.save_msd(params['msdoutput'], [], maxintervals,
+                                                      tracker.framerate, showplot=False)
+            summary['msd_time'] = round(time.time() - t, 3)
+            if params.get('fitoutput') is not None:
+                t = time.time()
+                tracker.save_fits(params['fitoutput'], [], maxintervals, tracker.framerate)
+                summary['fit_time'] = round(time.time() - t, 3)
+            if params.get('bootstrap', 0) > 0:
+                tracker.bootstrap = params['bootstrap']
+                tracker.save_avgmsd(params['avgmsdoutput'], [], maxintervals, tracker.framerate)
+            summary['status'] = 'OK'
+    except Exception as e:
+        summary['message'] = str(e)
+        if tracker is not None:
+            tracker.close_msdstream()
+    summary['total_time'] = round(time.time() - start, 3)
+    return summary
+
+
+'''Process input files in a pool of worker processes
+   Output files are written to outputdir as <name>_processed.csv and <name>_msd.csv
+   (and <name>_fits.csv if fits is set, <name>_avgmsd.csv with bootstrap confidence intervals if bootstrap is set,
+   <name>_processed.npz/.h5 if binary is set to the extension)
+   with a run summary (batch_summary.json and batch_summary.csv)
+   Returns list of summary dicts (in order of input files)
+'''
+def run_batch(inputfiles, outputdir, params, workers=None):
+    if outputdir and not os.path.isdir(outputdir):
+        os.makedirs(outputdir)
+    jobs = []
+    for inputfile in inputfiles:
+        name = os.path.splitext(os.path.basename(strip_compression(inputfile)))[0]
+        job = dict(params)
+        job['input'] = inputfile
+        job['output'] = os.path.join(outputdir, name + '_processed.csv')
+        job['msdoutput'] = os.path.join(outputdir, name + '_msd.csv')
+        if params.get('fits', False):
+            job['fitoutput'] = os.path.join(outputdir, name + '_fits.csv')
+        job['avgmsdoutput'] = os.path.join(outputdir, name + '_avgmsd.csv')
+        if params.get('binary') is not None:
+            job['binaryoutput'] = os.path.join(outputdir, name + '_processed' + params['binary'])
+        jobs.append(job)
+    start = time.time()
+    if (workers == 1):
+        results = [process_trackfile(job) for job in jobs]
+    else:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(process_trackfile, jobs))
+    for summary in results:
+        print(summary['status'], summary['input'], "rows=", summary['rows'], "tracks=", summary['tracks'],
+              "time=", summary['total_time'])
+    print("Batch of", len(results), "files completed in", round(time.time() - start, 3), "s")
+    write_summary(os.path.join(outputdir, 'batch_summary'), results)
+    return results
+
+
+def write_summary(outfilename, results):
+    with open(outfilename + '.json', 'w') as fo:
+        json.dump(results, fo, indent=2)
+    if len(results) > 0:
+        with open(outfilename + '.csv', 'w', newline='') as fo:
+            writer = csv.DictWriter(fo, delimiter=',', dialect=csv.excel, fieldnames=list(results[0].keys()))
+            writer.writeheader()
+            writer.writerows(results)
+    print("Batch summary written to", outfilename + '.json')
+
 
 ## Main
 if __name__ == "__main__":
@@ -743,8 +1419,94 @@ if __name__ == "__main__":
     parser.add_argument("-p", "--plots", dest="pythonplot",
                         default='1',
                         help="Generate quiverplots (default is 0, all is -1, none is 0, range is 0-10 (no spaces)")
+    parser.add_argument("--plotfile", dest="plotfile", default=None,
+                        help="Write plots (range from -p) to one multi-page PDF (.pdf) or PNG archive (.zip) "
+                             "with page index <plotfile>_index.csv instead of a PNG per track")
+    parser.add_argument("--atlas", dest="atlas", default=None,
+                        help="Write thumbnail atlas of all tracks to PNG file with tile index <atlas>_index.csv")
+    parser.add_argument("-s", "--stream", dest="stream", action="store_true",
+                        help="Stream input in chunks for very large files (no plots or binary output)")
+    parser.add_argument("--chunksize", dest="chunksize", type=int,
+                        default=100000, help="Number of rows per chunk when streaming")
+    parser.add_argument("-c", "--cache", dest="cachedir", default=None,
+                        help="Directory for parse cache of input files (default is no cache)")
+    parser.add_argument("--cachesize", dest="cachesize", type=int,
+                        default=1024, help="Maximum size of parse cache in MB")
+    parser.add_argument("-b", "--batch", dest="batch", default=None,
+                        help="Batch process all CSV files in a directory or matching a glob (quoted)")
+    parser.add_argument("-d", "--outputdir", dest="outputdir", default=None,
+                        help="Output directory for batch processing (default is input directory)")
+    parser.add_argument("-w", "--workers", dest="workers", type=int, default=None,
+                        help="Number of worker processes for batch processing or MSD calculation (default is number of CPUs)")
+    parser.add_argument("--intervals", dest="maxintervals", type=int,
+                        default=10, help="Number of time intervals for MSD output")
+    parser.add_argument("--fits", dest="fitoutput", default=None,
+                        help="Output file for per-track MSD fits (D, offset, alpha) - no plots are shown - "
+                             "in batch mode any value writes <name>_fits.csv")
+    parser.add_argument("--msd", dest="msdoutput", default=None,
+                        help="Output file for MSD per track (long format is streamed while tracks are calculated)")
+    parser.add_argument("--msdlayout", dest="msdlayout", choices=['long', 'wide'], default='long',
+                        help="MSD output layout: long (track, lag, dt, msd, npairs) or wide (dT, track1, track2, ...)")
+    parser.add_argument("--binary", dest="binaryoutput", default=None,
+                        help="Also write processed data and MSD to binary file (.npz or .h5 with h5py) - "
+                             "in batch mode only the extension is used")
+    parser.add_argument("--bootstrap", dest="bootstrap", type=int, default=0,
+                        help="Bootstrap resamples for averaged MSD confidence intervals (written to <output>_avgmsd.csv)")
+    parser.add_argument("--gaps", dest="gaps", action="store_true",
+                        help="Gap-aware MSD: time intervals by frame difference (for tracks with missing frames)")
+
+    parser.add_argument("-f", "--follow", dest="follow", action="store_true",
+                        help="Follow input file while it is being written and show MSD statistics")
+    parser.add_argument("--interval", dest="interval", type=float,
+                        default=2.0, help="Polling interval in seconds when following input")
+    parser.add_argument("--idle", dest="idle", type=float, default=0,
+                        help="Stop following after seconds without new rows (default is 0 - until Ctrl-C)")
 
     args = parser.parse_args()
+    if (args.stream and args.binaryoutput is not None):
+        parser.error("--binary is not available with --stream (processed rows are not kept)")
+    if (args.plotfile is not None and os.path.splitext(args.plotfile)[1].lower() not in ('.pdf', '.zip')):
+        parser.error("--plotfile must be a .pdf or .zip file")
+    if (args.follow):
+        def show_stats(tracker, changed):
+            lag1 = [m[1] for m in tracker.msd.values() if 1 in m]
+            print("Rows:", tracker.ln, "Points:", tracker.counter, "Tracks:", len(tracker.plotter),
+                  "Updated:", len(changed), "Avg MSD(1):", round(float(np.mean(lag1)), 6) if len(lag1) > 0 else '-')
+
+        tracker = Tracker()
+        tracker.numdecimal = int(args.numdecimal)
+        print("Following", args.filename, "(Ctrl-C to stop) ...")
+        tracker.follow_input(args.filename, interval=args.interval, idle=args.idle, callback=show_stats)
+        # Acquisition finished - full load for output
+        tracker = Tracker()
+        tracker.numdecimal = int(args.numdecimal)
+        if (tracker.checkinputheaders(args.filename)):
+            tracker.load_input(args.filename)
+            print(tracker.write_output(args.outfilename))
+            print("Output file written to: ", args.outfilename)
+        sys.exit()
+    if (args.batch is not None):
+        inputfiles = find_inputfiles(args.batch)
+        if len(inputfiles) == 0:
+            print("Error: No input files found:", args.batch)
+            sys.exit()
+        outputdir = args.outputdir
+        if outputdir is None:
+            outputdir = os.path.dirname(os.path.abspath(inputfiles[0])) or '.'
+        params = {'numdecimal': int(args.numdecimal),
+                  'maxintervals': args.maxintervals,
+                  'gaps': args.gaps,
+                  'bootstrap': args.bootstrap,
+                  'fits': args.fitoutput is not None,
+                  'msdlayout': args.msdlayout,
+                  'binary': os.path.splitext(args.binaryoutput)[1] if args.binaryoutput else None,
+                  'stream': args.stream,
+                  'chunksize': args.chunksize,
+                  'cachedir': args.cachedir,
+                  'cachesize': args.cachesize}
+        print("Starting batch of", len(inputfiles), "files ...")
+        run_batch(inputfiles, outputdir, params, args.workers)
+        sys.exit()
     if (not file_check(args.filename)):
         sys.exit()
     # if (not file_check(args.outfilename)):
@@ -755,21 +1517,56 @@ if __name__ == "__main__":
         defaultDataPath = args.outfilename[0:idx]
     tracker = Tracker()
     tracker.numdecimal = int(args.numdecimal)
+    tracker.workers = args.workers
+    tracker.gaps = args.gaps
+    if (args.cachedir is not None):
+        tracker.parsecache = ParseCache(args.cachedir, args.cachesize)
     # Check input file has correct headings
     if (not tracker.checkinputheaders(args.filename)):
         print("***ERROR: CSV Input file headers not matching, exiting ***")
         print("CSV HEADERS SHOULD BE:")
         for hdr in tracker.inputheaders:
             print(hdr)
+    elif (args.stream):
+        print("Starting (streaming) ...")
+        if (args.msdoutput is not None and args.msdlayout == 'long'):
+            print(tracker.open_msdstream(args.msdoutput))
+        msg = tracker.stream_input(args.filename, args.outfilename, chunksize=args.chunksize,
+                                   maxintervals=args.maxintervals,
+                                   keepmsd=(args.msdoutput is not None and args.msdlayout == 'wide'))
+        tracker.close_msdstream()
+        print(msg)
+        if (args.msdoutput is not None and args.msdlayout == 'wide'):
+            print(tracker.save_msd(args.msdoutput, [], args.maxintervals, tracker.framerate, showplot=False))
+        print("TOTAL ROWS:", tracker.counter)
+        print("TOTAL TRACKS:", tracker.numtracks)
+        if (tracker.counter > 0):
+            print("Output file written to: ", args.outfilename)
     else:
         print("Starting ...")
+        tracker.maxintervals = args.maxintervals
+        if (args.msdoutput is not None and args.msdlayout == 'long'):
+            print(tracker.open_msdstream(args.msdoutput))
         tracker.load_input(args.filename)
+        tracker.close_msdstream()
         tracker.write_output(args.outfilename)
         print("...Completed")
         print("TOTAL ROWS:", tracker.counter)
 
         if (tracker.counter > 0):
             print("Output file written to: ", args.outfilename)
+            if (args.msdoutput is not None and args.msdlayout == 'wide'):
+                print(tracker.save_msd(args.msdoutput, [], args.maxintervals, tracker.framerate, showplot=False))
+            if (args.binaryoutput is not None):
+                print(tracker.save_binary(args.binaryoutput))
+            if (args.atlas is not None):
+                print(tracker.save_atlas(args.atlas))
+            if (args.fitoutput is not None):
+                print(tracker.save_fits(args.fitoutput, [], args.maxintervals, tracker.framerate))
+            if (args.bootstrap > 0):
+                tracker.bootstrap = args.bootstrap
+                print(tracker.save_avgmsd(args.outfilename.replace('.csv', '_avgmsd.csv'), [],
+                                          args.maxintervals, tracker.framerate))
             ## ADDED PLOTS
             plotstart = 0
             plotend = 0
@@ -794,6 +1591,12 @@ if __name__ == "__main__":
                 tracker.set_outputdir(defaultDataPath + os.path.sep)
                 tracker.set_fromplot(plotstart)
                 tracker.set_toplot(plotend)
-                tracker.create_plots(defaultDataPath, plotstart, plotend)
+                if (args.plotfile is not None):
+                    results = tracker.export_plots(args.plotfile)
+                else:
+                    results = tracker.render_plots(range(plotstart, plotend), workers=args.workers)
+                for (traknum, filename, msg) in results:
+                    if msg.startswith('ERROR'):
+                        print(msg)
         else:
             print("Error occurred - please check data files")
@@ -0,0 +1,491 @@
+#!/usr/bin/python3
+"""
+    QBI Meunier Tracker APP: Track data model
+    *******************************************************************************
+    TrackTable stores coordinates as contiguous numpy columns (struct of arrays)
+    with rows grouped by track and a CSR-style offsets array per track.
+    Coord is kept as a lightweight per-row view for compatibility.
+
+    Copyright (C) 2015  QBI Software, The University of Queensland
+
+    This program is free software; you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation; either version 2 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+"""
+import bisect
+import numpy as np
+try:
+    from collections.abc import Mapping
+except ImportError:
+    from collections import Mapping
+
+
+class Coord:
+    __slots__ = ['track', 'frame', 'x', 'y', 'dx', 'dy', 'rho', 'theta', 'intensity',
+                 'framecount', 'msd', 'gradient', 'sd', 'first']
+
+    def __init__(self, track=0, frame=0, xcoord=0, ycoord=0, intensity=0):
+        self.track = track
+        self.frame = frame
+        self.x = xcoord
+        self.y = ycoord
+        self.dx = 0
+        self.dy = 0
+        self.rho = 0
+        self.theta = 0
+        self.intensity = intensity
+        self.framecount = 1
+        self.msd = 0
+        self.gradient = 0
+        self.sd = 0
+
+    def load(self, dx, dy, rho, theta, framecount):
+        self.dx = dx
+        self.dy = dy
+        self.rho = rho
+        self.theta = theta
+        self.framecount = framecount
+        if (self.dx > 0):
+            self.gradient = self.dy / self.dx
+
+        #self.sd = self.dx ** 2 + self.dy ** 2
+
+    ''' Determines if x,y coordinates have changed
+        Args: (x,y) and (x1,y1) - 2 sets of coordinates
+               f - number of decimal places for rounding coord values (default is 1)
+        Returns 1 if changed (moved) or 0 if not changed
+       '''
+
+    def has_moved(self):
+        if ((self.x, self.y) == (0, 0) or (self.xcache, self.ycache) == (0, 0)):
+            return 0
+        elif ((round(self.x, self.numdecimal), round(self.y, self.numdecimal)) ==
+                  (round(self.xcache, self.numdecimal), round(self.ycache, self.numdecimal))):
+            return 0
+        else:
+            return 1
+
+    '''Returns compiled row to output
+       fieldnames must match fieldnames in Tracker
+       '''
+
+    def get_rowoutput(self, numdecimal):
+        myx = self.x
+        myy = self.y
+
+        row = {'Track': str(self.track),
+               'Frame': str(self.frame),
+               'x': myx, 'y': myy,
+               'roundx': round(myx, numdecimal),
+               'roundy': round(myy, numdecimal),
+               'dx': self.dx,
+               'dy': self.dy,
+               'rho': self.rho,  # getpolar_rho(self.dx,self.dy),
+               'theta': self.theta,  # getpolar_theta(self.dy,self.dx),
+               'intensity': self.intensity,
+               'framecount': str(self.framecount),
+               #'sd': self.sd
+               }
+        return row
+
+    def set_first(self):
+        if self.framecount > 1:
+            self.first = self.frame - self.framecount + 1
+        else:
+            self.first = ''
+
+    def getpolar_rho(self, x, y):
+        rho = np.sqrt(x ** 2 + y ** 2)
+        return rho
+
+    def getpolar_theta(self, x, y):
+        theta = np.arctan2(y, x)
+        return theta
+
+
+'''Polar coords (rho, theta) of arrays of dx, dy as Coord.getpolar_rho and Coord.getpolar_theta
+'''
+def polar(dx, dy):
+    # float_power matches Coord.getpolar_rho (x ** 2 of float) to the last digit
+    rho = np.sqrt(np.float_power(dx, 2) + np.float_power(dy, 2))
+    return rho, np.arctan2(dy, dx)
+
+
+'''Start offsets of each run of equal track numbers (with total rows appended)
+'''
+def track_offsets(track):
+    if len(track) == 0:
+        return np.zeros(1, dtype=np.int64)
+    offsets = np.flatnonzero(np.diff(track)) + 1
+    return np.concatenate(([0], offsets, [len(track)])).astype(np.int64)
+
+
+'''Grid number of values rounded to numdecimal places exactly as Python round(v, numdecimal)
+   round works on the exact decimal value of each float (eg 10.35 is 10.3499... so rounds to 10.3)
+   whereas v * 10 ** numdecimal is itself rounded (103.5), so values close to half a unit are
+   rounded with round() and all others with np.rint
+'''
+def round_grid(v, numdecimal):
+    v = np.asarray(v, dtype=np.float64)
+    if numdecimal >= 0:
+        scaled = v * 10.0 ** numdecimal
+    else:
+        scaled = v / 10.0 ** -numdecimal
+    grid = np.rint(scaled)
+    near = np.abs(np.abs(scaled - np.trunc(scaled)) - 0.5) <= 1e-6 * np.maximum(1.0, np.abs(scaled))
+    if near.any():
+        if numdecimal >= 0:
+            exact = [round(round(f, numdecimal) * 10.0 ** numdecimal) for f in v[near].tolist()]
+        else:
+            exact = [round(round(f, numdecimal) / 10.0 ** -numdecimal) for f in v[near].tolist()]
+        grid[near] = exact
+    return grid
+
+
+'''Group rows by coordinates rounded to numdecimal places (as Python round) using integer grid keys
+   Returns (groups, first): group number of each row (groups numbered in order of first appearance)
+   and first row of each group
+'''
+def grid_keys(x, y, numdecimal):
+    if len(x) == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    gx = round_grid(x, numdecimal)
+    gy = round_grid(y, numdecimal)
+    gx = (gx - gx.min()).astype(np.int64)
+    gy = (gy - gy.min()).astype(np.int64)
+    span = int(gy.max()) + 1
+    if int(gx.max()) < (2 ** 62) // span:
+        keys = gx * span + gy
+        uniq, first, inv = np.unique(keys, return_index=True, return_inverse=True)
+    else:
+        uniq, first, inv = np.unique(np.column_stack((gx, gy)), axis=0, return_index=True, return_inverse=True)
+    # renumber groups in order of first appearance
+    order = np.argsort(first, kind='stable')
+    rank = np.empty(len(order), dtype=np.int64)
+    rank[order] = np.arange(len(order))
+    return rank[inv.ravel()], first[order].astype(np.int64)
+
+
+'''Average coords of rounded coords groups (see grid_keys)
+   firstcols: columns of the first row of each group, counts: rows per group,
+   sums: sums of frame, intensity, dx and dy per group (in row order)
+   Coords of a group take track, x and y of the first row with frame, intensity, dx and dy
+   averaged and rho, theta recalculated from averaged dx, dy. Single coords are unchanged.
+   Returns dict of columns (as TrackTable.columns, frame as float) - arrays of firstcols are averaged in place
+'''
+def average_groups(firstcols, counts, sums):
+    avgcols = dict()
+    for name in ['track', 'frame', 'x', 'y', 'dx', 'dy', 'rho', 'theta', 'intensity']:
+        avgcols[name] = firstcols[name]
+    avgcols['frame'] = avgcols['frame'].astype(np.float64)
+    multi = counts > 1
+    if multi.any():
+        for name in sums:
+            avgcols[name][multi] = sums[name][multi] / counts[multi]
+        (avgcols['rho'][multi], avgcols['theta'][multi]) = polar(avgcols['dx'][multi], avgcols['dy'][multi])
+    avgcols['framecount'] = np.where(multi, counts, firstcols['framecount'])
+    return avgcols
+
+
+class CoordGroups:
+    '''Running totals per rounded coordinate for rows added in chunks (groups as grid_keys over all rows)
+       Per group (numbered in order of first appearance): first row, number of rows and
+       sums of frame, intensity, dx, dy added row by row so averages match average_groups of all rows.
+       Grid keys are kept sorted (x grid + 1j * y grid sorts by x then y) to find groups of later chunks.
+    '''
+    firstcolumns = ['track', 'frame', 'x', 'y', 'dx', 'dy', 'rho', 'theta', 'intensity', 'framecount']
+    sumcolumns = ['frame', 'intensity', 'dx', 'dy']
+
+    def __init__(self, numdecimal):
+        self.numdecimal = numdecimal
+        self.keys = np.zeros(0, dtype=np.complex128)  # sorted grid keys
+        self.keygroups = np.zeros(0, dtype=np.int64)  # group of each sorted key
+        self.counts = np.zeros(0, dtype=np.int64)
+        self.firstcols = dict()
+        self.sums = dict()
+        for (name, dtype) in TrackTable.columns:
+            if name in self.firstcolumns:
+                self.firstcols[name] = np.zeros(0, dtype=dtype)
+        for name in self.sumcolumns:
+            self.sums[name] = np.zeros(0, dtype=np.float64)
+
+    def __len__(self):
+        return len(self.counts)
+
+    def nbytes(self):
+        return (self.keys.nbytes + self.keygroups.nbytes + self.counts.nbytes +
+                sum([c.nbytes for c in self.firstcols.values()]) + sum([s.nbytes for s in self.sums.values()]))
+
+    '''Add rows (dict of columns as TrackTable.columns)
+       Returns framecount per row: 1 for first row at a rounded coordinate, 2 if already seen
+    '''
+    def add(self, cols):
+        numrows = len(cols['x'])
+        framecount = np.full(numrows, 2, dtype=np.int64)
+        if numrows == 0:
+            return framecount
+        keys = round_grid(cols['x'], self.numdecimal) + 1j * round_grid(cols['y'], self.numdecimal)
+        uniq, first, inv = np.unique(keys, return_index=True, return_inverse=True)
+        pos = np.searchsorted(self.keys, uniq)
+        found = pos < len(self.keys)
+        found[found] = self.keys[pos[found]] == uniq[found]
+        groups = np.empty(len(uniq), dtype=np.int64)
+        groups[found] = self.keygroups[pos[found]]
+        # new groups numbered in order of first appearance
+        new = np.flatnonzero(~found)
+        new = new[np.argsort(first[new], kind='stable')]
+        numgroups = len(self.counts)
+        groups[new] = numgroups + np.arange(len(new))
+        rows = groups[inv.ravel()]
+        framecount[first[new]] = 1
+        self.keys = np.insert(self.keys, pos[~found], uniq[~found])
+        self.keygroups = np.insert(self.keygroups, pos[~found], groups[~found])
+        for name in self.firstcolumns:
+            values = framecount if name == 'framecount' else cols[name]
+            self.firstcols[name] = np.concatenate((self.firstcols[name], values[first[new]]))
+        total = numgroups + len(new)
+        self.counts = np.concatenate((self.counts, np.zeros(len(new), dtype=np.int64)))
+        self.counts += np.bincount(rows, minlength=total)
+        for name in self.sumcolumns:
+            sums = np.concatenate((self.sums[name], np.zeros(len(new))))
+            # unbuffered: added row by row (as sum of list)
+            np.add.at(sums, rows, cols[name].astype(np.float64))
+            self.sums[name] = sums
+        return framecount
+
+    '''Averaged coords per group (see average_groups) - first rows are averaged in place so
+       call once all rows are added
+    '''
+    def average(self):
+        self.keys = np.zeros(0, dtype=np.complex128)
+        self.keygroups = np.zeros(0, dtype=np.int64)
+        return average_groups(self.firstcols, self.counts, self.sums)
+
+
+class TrackTable(Mapping):
+    '''Columns of all points with rows of each track contiguous
+       Rows of track at position i are offsets[i]:offsets[i + 1], tracknums[i] is its number.
+       As a mapping: track number -> list of Coord (created on demand)
+    '''
+    columns = [('track', np.int64), ('frame', np.int64), ('x', np.float64), ('y', np.float64),
+               ('dx', np.float64), ('dy', np.float64), ('rho', np.float64), ('theta', np.float64),
+               ('intensity', np.float64), ('framecount', np.int64)]
+
+    def __init__(self, data=None):
+        self.data = dict()
+        numrows = 0
+        if data is not None:
+            numrows = len(data['track'])
+        for (name, dtype) in self.columns:
+            if data is not None and name in data:
+                self.data[name] = np.ascontiguousarray(data[name])
+            elif name == 'framecount':
+                self.data[name] = np.ones(numrows, dtype=dtype)
+            else:
+                self.data[name] = np.zeros(numrows, dtype=dtype)
+        self.buffers = None  # columns with spare rows (data are views) once grown by update_tracks
+        self.offsets = track_offsets(self.data['track'])
+        self.tracknums = self.data['track'][self.offsets[:-1]]
+        self.positions = dict(zip(self.tracknums.tolist(), range(len(self.tracknums))))
+        if len(self.positions) != len(self.tracknums):
+            raise ValueError("TrackTable: rows of each track must be contiguous")
+
+    '''Create from columns in any order: rows are grouped by track
+       (in order of first appearance) keeping the order of rows within each track
+    '''
+    @classmethod
+    def group(cls, data):
+        track = np.asarray(data['track'])
+        uniq, first, inv = np.unique(track, return_index=True, return_inverse=True)
+        order = np.argsort(first[inv.ravel()], kind='stable')
+        grouped = dict()
+        for name in data:
+            grouped[name] = np.asarray(data[name])[order]
+        return cls(grouped)
+
+    '''Join tables (or dicts of columns) with different tracks
+    '''
+    @classmethod
+    def concat(cls, tables):
+        parts = [t.data if isinstance(t, TrackTable) else t for t in tables]
+        if len(parts) == 0:
+            return cls()
+        data = dict()
+        for name in parts[0]:
+            data[name] = np.concatenate([p[name] for p in parts])
+        return cls(data)
+
+    def __len__(self):
+        return len(self.tracknums)
+
+    def __iter__(self):
+        return iter(self.tracknums.tolist())
+
+    def __contains__(self, tracknum):
+        return tracknum in self.positions
+
+    def __getitem__(self, tracknum):
+        (start, end) = self.rows(tracknum)
+        return [self.get_coord(i) for i in range(start, end)]
+
+    def numrows(self):
+        return len(self.data['track'])
+
+    def nbytes(self):
+        return sum([col.nbytes for col in self.data.values()]) + self.offsets.nbytes
+
+    '''Track number at position (ordinal) idx - constant time
+    '''
+    def get_tracknum(self, idx):
+        return self.tracknums[idx].item()
+
+    '''Position (ordinal) of track number - constant time
+    '''
+    def get_position(self, tracknum):
+        return self.positions[tracknum]
+
+    '''Track numbers at a list of positions
+    '''
+    def get_tracknums(self, positions):
+        return self.tracknums[np.asarray(positions, dtype=np.int64)].tolist()
+
+    '''Start and end row of track
+    '''
+    def rows(self, tracknum):
+        pos = self.positions[tracknum]
+        return self.offsets[pos], self.offsets[pos + 1]
+
+    '''Column views for a single track
+    '''
+    def track(self, tracknum):
+        (start, end) = self.rows(tracknum)
+        return self.slice(start, end)
+
+    def column(self, name, tracknum=None):
+        if tracknum is None:
+            return self.data[name]
+        (start, end) = self.rows(tracknum)
+        return self.data[name][start:end]
+
+    '''Coord view of row i
+    '''
+    def get_coord(self, i):
+        d = self.data
+        co = Coord(d['track'][i].item(), d['frame'][i].item(), d['x'][i].item(), d['y'][i].item(),
+                   d['intensity'][i].item())
+        co.load(d['dx'][i].item(), d['dy'][i].item(), d['rho'][i].item(), d['theta'][i].item(),
+                d['framecount'][i].item())
+        return co
+
+    '''Grow columns (doubling) to hold numrows keeping the first keep rows - data are views of buffers
+    '''
+    def reserve(self, numrows, keep):
+        capacity = 0
+        if self.buffers is not None:
+            capacity = len(self.buffers['track'])
+        if numrows > capacity:
+            capacity = max(numrows, 2 * capacity)
+            buffers = dict()
+            for (name, dtype) in self.columns:
+                buffers[name] = np.zeros(capacity, dtype=self.data[name].dtype)
+                buffers[name][:keep] = self.data[name][:keep]
+            self.buffers = buffers
+        for name in self.buffers:
+            self.data[name] = self.buffers[name][:numrows]
+
+    '''Replace rows of tracks in place keeping the order of tracks
+       tracks: dict of track number -> dict of columns (rows of the track) or None to remove the track
+       rank: dict of track number -> sort key of all tracks (table sorted by rank) to insert new tracks
+       in order, else new tracks are appended. Rows before the first changed track are not moved.
+    '''
+    def update_tracks(self, tracks, rank=None):
+        numtracks = len(self.tracknums)
+        replaced = dict()
+        inserted = dict()
+        for (tracknum, rows) in tracks.items():
+            pos = self.positions.get(tracknum)
+            if pos is not None:
+                replaced[pos] = rows
+            elif rows is not None:
+                at = numtracks
+                if rank is not None:
+                    at = bisect.bisect_left(_RankView(self.tracknums, rank), rank[tracknum])
+                inserted.setdefault(at, []).append(tracknum)
+        if len(replaced) == 0 and len(inserted) == 0:
+            return
+        edits = sorted(set(replaced) | set(inserted))
+        start = edits[0]
+        pieces = []
+        prev = start
+        for pos in edits:
+            if pos > prev:
+                pieces.append(self.slice(self.offsets[prev], self.offsets[pos]))
+            newtracks = inserted.get(pos, [])
+            if rank is not None:
+                newtracks = sorted(newtracks, key=lambda t: rank[t])
+            pieces += [tracks[t] for t in newtracks]
+            if pos in replaced:
+                if replaced[pos] is not None:
+                    pieces.append(replaced[pos])
+                prev = pos + 1
+            else:
+                prev = pos
+        if prev < numtracks:
+            pieces.append(self.slice(self.offsets[prev], self.offsets[-1]))
+        tail = dict()
+        for (name, dtype) in self.columns:
+            tail[name] = np.concatenate([np.asarray(p[name], dtype=self.data[name].dtype) for p in pieces] +
+                                        [np.zeros(0, dtype=self.data[name].dtype)])
+        rowstart = int(self.offsets[start])
+        self.reserve(rowstart + len(tail['track']), rowstart)
+        for name in tail:
+            self.data[name][rowstart:] = tail[name]
+        for tracknum in self.tracknums[start:].tolist():
+            del self.positions[tracknum]
+        tailoffsets = track_offsets(tail['track'])
+        self.offsets = np.concatenate((self.offsets[:start], tailoffsets + rowstart))
+        self.tracknums = np.concatenate((self.tracknums[:start], tail['track'][tailoffsets[:-1]]))
+        self.positions.update(zip(self.tracknums[start:].tolist(), range(start, len(self.tracknums))))
+
+    '''Column views of rows start..end-1
+    '''
+    def slice(self, start, end):
+        rows = dict()
+        for name in self.data:
+            rows[name] = self.data[name][start:end]
+        return rows
+
+    '''New table with only the given tracks (in current order)
+    '''
+    def select(self, tracknums):
+        mask = np.isin(self.data['track'], np.asarray(list(tracknums), dtype=self.data['track'].dtype))
+        data = dict()
+        for name in self.data:
+            data[name] = self.data[name][mask]
+        return TrackTable(data)
+
+    '''New table without the given tracks (positions of remaining tracks are renumbered)
+    '''
+    def exclude(self, tracknums):
+        excluded = set(tracknums)
+        return self.select([t for t in self.tracknums.tolist() if t not in excluded])
+
+
+class _RankView:
+    '''Rank of each track of a table as a sequence (for bisect)
+    '''
+    def __init__(self, tracknums, rank):
+        self.tracknums = tracknums
+        self.rank = rank
+
+    def __len__(self):
+        return len(self.tracknums)
+
+    def __getitem__(self, i):
+        return self.rank[self.tracknums[i].item()]